@@ -0,0 +1,186 @@
+"""
+Admission control and request deadlines for inference routes
+Bounds how much work may queue on each model and abandons work nobody is waiting for
+"""
+
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Callable, Dict, Optional
+import asyncio
+import math
+import time
+
+
+class AdmissionError(Exception):
+    """Raised when a request is refused or abandoned; carries an HTTP status code"""
+
+    def __init__(self, message: str, status_code: int, retry_after: Optional[int] = None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+    @property
+    def headers(self) -> Optional[Dict[str, str]]:
+        if self.retry_after is None:
+            return None
+        return {"Retry-After": str(self.retry_after)}
+
+
+class Overloaded(AdmissionError):
+    """The model's queue is full"""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message, 429, retry_after)
+
+
+class DeadlineExceeded(AdmissionError):
+    """The request ran past its deadline"""
+
+    def __init__(self, message: str):
+        super().__init__(message, 504)
+
+
+class ClientDisconnected(AdmissionError):
+    """The client went away before the result was ready"""
+
+    def __init__(self, message: str = "Client disconnected"):
+        # 499 is the nginx convention; nobody is left to read it
+        super().__init__(message, 499)
+
+
+class AdmissionController:
+    """
+    Bounded concurrency plus a bounded FIFO queue for one model
+
+    Up to `max_active` requests hold a slot at once, and up to `max_queue`
+    more wait for one in arrival order. Anything beyond that is refused
+    straight away with Overloaded, whose Retry-After is estimated from the
+    recent service time and the queue length. Each model gets its own
+    controller, so a burst of slow requests for one model cannot take the
+    slots of another.
+    """
+
+    def __init__(self, name: str, max_active: int, max_queue: int):
+        """
+        Args:
+            name: Model name used in error messages and /health
+            max_active: Requests allowed to hold a slot at once
+            max_queue: Requests allowed to wait for a slot
+        """
+        self.name = name
+        self.max_active = max(1, max_active)
+        self.max_queue = max(0, max_queue)
+        self.active = 0
+        self.admitted = 0
+        self.rejected = 0
+        self._waiters = deque()
+        self._service_seconds = 1.0
+
+    @property
+    def queued(self) -> int:
+        return sum(1 for waiter in self._waiters if not waiter.done())
+
+    def retry_after(self) -> int:
+        """Seconds until a slot is likely to be free"""
+        return max(1, math.ceil(self._service_seconds * (self.queued + 1) / self.max_active))
+
+    async def acquire(self):
+        """
+        Take a slot, waiting in the queue if all slots are busy
+
+        Raises:
+            Overloaded: The queue is full
+        """
+        if self.active < self.max_active and not self.queued:
+            self.active += 1
+            self.admitted += 1
+            return
+        if self.queued >= self.max_queue:
+            self.rejected += 1
+            raise Overloaded(f"{self.name} is overloaded, try again later", self.retry_after())
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            # A slot handed over just as the caller gave up goes to the next waiter
+            if waiter.done() and not waiter.cancelled():
+                self.release()
+            raise
+        self.admitted += 1
+
+    def release(self, service_seconds: Optional[float] = None):
+        """Give a slot back, handing it to the oldest live waiter if there is one"""
+        if service_seconds is not None:
+            self._service_seconds = 0.8 * self._service_seconds + 0.2 * service_seconds
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+    @asynccontextmanager
+    async def slot(self):
+        """Hold a slot for the duration of the block"""
+        await self.acquire()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.release(time.perf_counter() - start)
+
+    def stats(self) -> Dict:
+        return {
+            "active": self.active,
+            "queued": self.queued,
+            "max_active": self.max_active,
+            "max_queue": self.max_queue,
+            "admitted": self.admitted,
+            "rejected": self.rejected
+        }
+
+
+async def run_with_deadline(
+    fn: Callable[[], Awaitable[Any]],
+    timeout: float,
+    is_disconnected: Optional[Callable[[], Awaitable[bool]]] = None,
+    poll_interval: float = 0.25
+) -> Any:
+    """
+    Run a request's work under a deadline, cancelling it if the client leaves
+
+    Cancellation propagates into the work, so a request still waiting for
+    an admission slot or a batch is dropped from the queue instead of being
+    computed for nobody.
+
+    Args:
+        fn: Zero-argument coroutine function doing the work
+        timeout: Seconds the work may take
+        is_disconnected: Coroutine function reporting whether the client is gone
+        poll_interval: Seconds between disconnect checks
+
+    Returns:
+        Whatever fn returns
+
+    Raises:
+        DeadlineExceeded: The work did not finish within timeout
+        ClientDisconnected: The client disconnected first
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    work = asyncio.ensure_future(fn())
+    try:
+        while True:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                raise DeadlineExceeded(f"Request did not finish within {timeout:g}s")
+            done, _ = await asyncio.wait({work}, timeout=min(poll_interval, remaining))
+            if done:
+                return work.result()
+            if is_disconnected is not None and await is_disconnected():
+                raise ClientDisconnected()
+    finally:
+        if not work.done():
+            work.cancel()
@@ -0,0 +1,289 @@
+"""
+Shared Fashion-CLIP analysis engine
+One place for the label vocabularies, cached label embeddings, batched image
+encoding and scoring, used by the API, the CLI and the GUI
+"""
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+import functools
+import threading
+import numpy as np
+from PIL import Image
+
+import config
+from label_store import LabelEmbeddingStore
+from vocabulary import load_template_file
+from preprocessing import decode_at, CLIP_INPUT_SIZE
+
+# Fashion categories
+CATEGORIES = [
+    "short sleeve top", "long sleeve top", "t-shirt", "shirt", "blouse",
+    "jacket", "coat", "hoodie", "cardigan", "blazer",
+    "pants", "jeans", "trousers", "shorts", "skirt",
+    "dress", "short sleeve dress", "long sleeve dress", "maxi dress",
+    "bag", "handbag", "backpack", "shoes", "sneakers", "boots",
+    "hat", "cap", "sunglasses", "watch", "belt",
+    "sweater", "vest", "scarf", "tie"
+]
+
+COLORS = [
+    "red", "blue", "green", "black", "white",
+    "yellow", "pink", "purple", "brown", "gray",
+    "orange", "navy", "beige"
+]
+
+STYLES = [
+    "casual", "formal", "sporty", "elegant",
+    "vintage", "modern", "streetwear"
+]
+
+VOCABULARIES = {
+    "items": CATEGORIES,
+    "colors": COLORS,
+    "styles": STYLES
+}
+
+# Prompt templates per vocabulary; "*" covers vocabularies added at runtime.
+# Each label is embedded under every template of its vocabulary and the
+# centroid is stored, which scores noticeably better than the bare word.
+PROMPT_TEMPLATES = {
+    "items": [
+        "a photo of {}.",
+        "a photo of a person wearing {}.",
+        "a product photo of {}.",
+        "a close-up photo of {}.",
+        "{} in a fashion catalogue."
+    ],
+    "colors": [
+        "a photo of {} clothing.",
+        "a person wearing {} clothes.",
+        "a product photo of a {} garment.",
+        "the color {}."
+    ],
+    "styles": [
+        "a photo of a {} outfit.",
+        "a person dressed in {} style.",
+        "{} fashion.",
+        "a {} look."
+    ],
+    "*": [
+        "a photo of {} clothing.",
+        "a close-up photo of {} fabric.",
+        "a product photo of a {} garment."
+    ]
+}
+
+DEFAULT_LIMITS = {"items": 10, "colors": 5, "styles": 5}
+
+# Labels returned for each extra vocabulary (material, pattern, ...)
+DEFAULT_ATTRIBUTE_LIMIT = 5
+
+# Result field names per vocabulary, as returned by the API
+RESULT_KEYS = {"items": "name", "colors": "color", "styles": "style"}
+
+
+def format_ranked(ranked: Dict[str, List[Tuple[str, float]]]) -> Dict:
+    """Turn one image's (label, score) pairs into the API's result dictionary"""
+    return {
+        name: [{RESULT_KEYS.get(name, "name"): label, "confidence": score} for label, score in pairs]
+        for name, pairs in ranked.items()
+    }
+
+
+def configured_templates() -> Optional[Dict[str, List[str]]]:
+    """Prompt templates as configured: the template file, the built-ins, or None when ensembling is off"""
+    if not config.PROMPT_ENSEMBLE:
+        return None
+    if config.PROMPT_TEMPLATES_FILE:
+        return load_template_file(config.PROMPT_TEMPLATES_FILE)
+    return PROMPT_TEMPLATES
+
+
+def load_image_file(path: str) -> Image.Image:
+    """Read and decode an image file at Fashion-CLIP input size"""
+    with open(path, 'rb') as f:
+        return decode_at(f.read(), CLIP_INPUT_SIZE)
+
+
+class AnalysisEngine:
+    """
+    Fashion-CLIP plus precomputed label embeddings
+
+    Label embeddings are computed once per engine, images are encoded in
+    batches, and every vocabulary is scored with one matmul. Build one
+    engine per process and reuse it; `default_engine()` does that for
+    scripts. Vocabularies can change at runtime through
+    `update_vocabularies()`, which swaps in a new label store.
+    """
+
+    def __init__(
+        self,
+        fashion_model,
+        vocabularies: Dict[str, List[str]] = VOCABULARIES,
+        templates: Optional[Dict[str, List[str]]] = None
+    ):
+        """
+        Args:
+            fashion_model: Loaded engine exposing encode_images and encode_text
+            vocabularies: Mapping of vocabulary name to its labels
+            templates: Prompt templates per vocabulary (see PROMPT_TEMPLATES);
+                None scores against the bare labels
+        """
+        self.model = fashion_model
+        self.label_store = LabelEmbeddingStore(fashion_model, vocabularies, templates=templates)
+        self._update_lock = threading.Lock()
+
+    @classmethod
+    def load(cls, engine: str = config.FASHION_ENGINE) -> "AnalysisEngine":
+        """Load the configured Fashion-CLIP engine and encode the default vocabularies"""
+        from onnx_engine import load_fashion_engine
+        return cls(load_fashion_engine(engine), templates=configured_templates())
+
+    @property
+    def version(self) -> str:
+        """Identifies the label set, for cache keys"""
+        return self.label_store.version
+
+    @property
+    def vocabularies(self) -> Dict[str, List[str]]:
+        return self.label_store.vocabularies
+
+    def update_vocabularies(self, vocabularies: Dict[str, List[str]]) -> LabelEmbeddingStore:
+        """
+        Switch to new vocabularies, encoding only labels not seen before
+
+        The new store is built off to the side and swapped in with one
+        assignment, so concurrent scoring sees either the old or the new
+        label set, never a mix.
+
+        Args:
+            vocabularies: Complete mapping of vocabulary name to labels
+
+        Returns:
+            The new label store
+        """
+        with self._update_lock:
+            store = self.label_store.updated(self.model, vocabularies)
+            self.label_store = store
+        return store
+
+    def encode(self, images: List[Image.Image]) -> np.ndarray:
+        """
+        Encode images in one batched forward pass
+
+        Args:
+            images: PIL images
+
+        Returns:
+            Image embeddings of shape (n_images, dim)
+        """
+        images = [img if img.mode == 'RGB' else img.convert('RGB') for img in images]
+        image_embeds = self.model.encode_images(images, batch_size=len(images))
+        if hasattr(image_embeds, "cpu"):
+            image_embeds = image_embeds.cpu().numpy()
+        return np.asarray(image_embeds)
+
+    def rank(self, image_embeds, limits: Optional[Dict[str, int]] = None) -> List[Dict[str, List[Tuple[str, float]]]]:
+        """Top (label, score) pairs per vocabulary for each image embedding"""
+        store = self.label_store
+        if limits is None:
+            limits = {name: DEFAULT_LIMITS.get(name, DEFAULT_ATTRIBUTE_LIMIT) for name in store.vocabularies}
+        return store.rank(image_embeds, limits)
+
+    def score(
+        self,
+        image_embeds,
+        top_items: int = 10,
+        top_colors: int = 5,
+        top_styles: int = 5,
+        store: Optional[LabelEmbeddingStore] = None
+    ) -> List[Dict]:
+        """
+        Rank items, colors, styles and any extra vocabularies for a batch of image embeddings
+
+        Args:
+            image_embeds: Image embeddings of shape (n_images, dim)
+            top_items: Number of top fashion items to return
+            top_colors: Number of top colors to return
+            top_styles: Number of top styles to return
+            store: Label store to score against (default: the current one);
+                pass the store whose version is in the cache key
+
+        Returns:
+            One dictionary per image containing items, colors, styles and
+            one entry per extra vocabulary
+        """
+        store = store or self.label_store
+        limits = {name: DEFAULT_ATTRIBUTE_LIMIT for name in store.vocabularies}
+        limits.update({"items": top_items, "colors": top_colors, "styles": top_styles})
+        return [format_ranked(ranked) for ranked in store.rank(image_embeds, limits)]
+
+    def analyze(self, images: List[Image.Image], top_items: int = 10, top_colors: int = 5, top_styles: int = 5) -> List[Dict]:
+        """Encode and score a batch of images"""
+        return self.score(self.encode(images), top_items, top_colors, top_styles)
+
+    def analyze_paths(
+        self,
+        paths: Iterable[str],
+        batch_size: int = 32,
+        workers: int = 4,
+        top_items: int = 10,
+        top_colors: int = 5,
+        top_styles: int = 5
+    ) -> Iterator[Tuple[str, Optional[Dict], Optional[str]]]:
+        """
+        Stream image files through the engine in batches
+
+        A thread pool decodes the next batches while the current one is
+        being encoded, so the model does not wait on disk or JPEG decoding.
+        Paths are consumed lazily and at most two batches are decoded
+        ahead, so memory stays flat however many files there are.
+
+        Args:
+            paths: Image file paths, in output order
+            batch_size: Images per forward pass
+            workers: Decode threads
+            top_items: Number of top fashion items to return
+            top_colors: Number of top colors to return
+            top_styles: Number of top styles to return
+
+        Yields:
+            (path, result, None) per analysed file, or (path, None, error)
+            for files that could not be read or decoded, in input order
+        """
+        paths = iter(paths)
+        pending = deque()
+        with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="decode") as pool:
+            def prefetch():
+                while len(pending) < 2 * batch_size:
+                    path = next(paths, None)
+                    if path is None:
+                        return
+                    pending.append((path, pool.submit(load_image_file, path)))
+
+            prefetch()
+            while pending:
+                entries = []
+                while pending and len(entries) < batch_size:
+                    path, future = pending.popleft()
+                    try:
+                        entries.append((path, future.result(), None))
+                    except Exception as e:
+                        entries.append((path, None, str(e)))
+                prefetch()
+
+                images = [image for _, image, _ in entries if image is not None]
+                results = iter(self.analyze(images, top_items, top_colors, top_styles) if images else [])
+                for path, image, error in entries:
+                    if image is None:
+                        yield path, None, error
+                    else:
+                        yield path, next(results), None
+
+
+@functools.lru_cache(maxsize=None)
+def default_engine(engine: str = config.FASHION_ENGINE) -> AnalysisEngine:
+    """Process-wide engine, loaded on first use"""
+    return AnalysisEngine.load(engine)
@@ -0,0 +1,141 @@
+"""
+Dynamic micro-batching for model inference
+Collects concurrent requests into batches so the model sees one call per batch
+"""
+
+import asyncio
+import logging
+from typing import Any, Callable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class MicroBatcher:
+    """
+    Background worker that groups submitted items into batches
+
+    Callers `await submit(item)` and get back their own result. The worker
+    flushes a batch once it holds `max_batch_size` items or `max_wait_ms`
+    after the first item arrived, runs `process_batch` on it off the event
+    loop, and resolves each caller's future with the matching result.
+    """
+
+    def __init__(
+        self,
+        process_batch: Callable[[List[Any]], List[Any]],
+        max_batch_size: int = 16,
+        max_wait_ms: float = 10,
+        executor=None,
+        name: str = "batcher"
+    ):
+        """
+        Args:
+            process_batch: Blocking function mapping a list of items to a
+                list of results in the same order
+            max_batch_size: Largest batch handed to process_batch
+            max_wait_ms: Longest time the first item of a batch waits for
+                more items to arrive
+            executor: Executor that runs process_batch (default loop executor if None)
+            name: Name used in log messages
+        """
+        self.process_batch = process_batch
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000
+        self.executor = executor
+        self.name = name
+        self._pending = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._full: Optional[asyncio.Event] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._inflight = []
+
+    @property
+    def queue_depth(self) -> int:
+        """Number of items waiting for a batch"""
+        return len(self._pending)
+
+    def start(self):
+        """Start the background worker on the running event loop"""
+        if self._worker is not None:
+            return
+        self._wakeup = asyncio.Event()
+        self._full = asyncio.Event()
+        self._worker = asyncio.create_task(self._run())
+        logger.info(f"{self.name} started (max batch {self.max_batch_size}, max wait {self.max_wait * 1000:.0f}ms)")
+
+    async def stop(self):
+        """Stop the worker and fail any items still waiting"""
+        if self._worker is None:
+            return
+        self._worker.cancel()
+        try:
+            await self._worker
+        except asyncio.CancelledError:
+            pass
+        self._worker = None
+        for _, future in self._inflight + self._pending:
+            if not future.done():
+                future.set_exception(RuntimeError(f"{self.name} stopped"))
+        self._pending = []
+        self._inflight = []
+
+    async def submit(self, item: Any) -> Any:
+        """
+        Queue an item and wait for its result
+
+        Args:
+            item: Single input for process_batch
+
+        Returns:
+            The result process_batch produced for this item
+        """
+        if self._worker is None:
+            raise RuntimeError(f"{self.name} is not running")
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((item, future))
+        self._wakeup.set()
+        if len(self._pending) >= self.max_batch_size:
+            self._full.set()
+        return await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await self._wakeup.wait()
+
+            # Give other requests a short window to join this batch
+            if len(self._pending) < self.max_batch_size and self.max_wait > 0:
+                try:
+                    await asyncio.wait_for(self._full.wait(), self.max_wait)
+                except asyncio.TimeoutError:
+                    pass
+
+            batch = self._pending[:self.max_batch_size]
+            self._pending = self._pending[self.max_batch_size:]
+            if len(self._pending) < self.max_batch_size:
+                self._full.clear()
+            if not self._pending:
+                self._wakeup.clear()
+
+            # Skip callers that gave up while waiting
+            batch = [(item, future) for item, future in batch if not future.done()]
+            if not batch:
+                continue
+
+            self._inflight = batch
+            try:
+                results = await loop.run_in_executor(
+                    self.executor, self.process_batch, [item for item, _ in batch]
+                )
+            except Exception as e:
+                self._inflight = []
+                logger.error(f"{self.name} batch of {len(batch)} failed: {e}")
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            self._inflight = []
+
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
@@ -0,0 +1,493 @@
+"""
+Offline benchmark suite for the analysis and caption pipelines
+Runs the real FastAPI app in-process with stub models and a stub shopping API,
+over a fixed synthetic image corpus, and writes the results as JSON
+
+Usage:
+    python benchmark.py [--output results.json] [--compare baseline.json]
+"""
+
+import os
+import tempfile
+
+# The stubs replace the models; keep the run independent of local caches
+os.environ.setdefault("EMBEDDING_STORE_DIR", "")
+os.environ.setdefault("PRODUCT_INDEX_DIR", tempfile.mkdtemp(prefix="sherlock-bench-products-"))
+os.environ.setdefault("VOCABULARY_FILE", "")
+os.environ.setdefault("PRELOAD_MODELS", "false")
+# The shopping API is stubbed too, so no real key or endpoint is needed
+os.environ.setdefault("SCRAPINGDOG_API", "benchmark")
+os.environ.setdefault("SCRAPING_ENDPOINT", "http://shopping.invalid/search")
+
+from typing import Callable, Dict, List
+import argparse
+import asyncio
+import base64
+import hashlib
+import io
+import json
+import platform
+import resource
+import subprocess
+import sys
+import time
+import tracemalloc
+import httpx
+import numpy as np
+from PIL import Image
+
+from metrics import STAGE_SECONDS
+
+# Image sizes in the corpus: phone photo, web image, thumbnail
+CORPUS_SIZES = [(3024, 4032), (1200, 1600), (480, 640)]
+
+
+def synthetic_corpus(count: int, seed: int = 0) -> List[bytes]:
+    """
+    Deterministic JPEG corpus with a mix of image sizes
+
+    Images are smooth gradients plus noise, so JPEG sizes and decode times
+    resemble photos more closely than pure noise would.
+
+    Args:
+        count: Number of images
+        seed: Random seed; the same seed always gives the same bytes
+
+    Returns:
+        Encoded JPEG files
+    """
+    rng = np.random.default_rng(seed)
+    corpus = []
+    for i in range(count):
+        width, height = CORPUS_SIZES[i % len(CORPUS_SIZES)]
+        small = rng.integers(0, 256, (8, 8, 3), dtype=np.uint8)
+        img = Image.fromarray(small, "RGB").resize((width, height), Image.BILINEAR)
+        noise = rng.integers(-12, 13, (height, width, 3))
+        pixels = np.clip(np.asarray(img, dtype=np.int16) + noise, 0, 255).astype(np.uint8)
+        buffer = io.BytesIO()
+        Image.fromarray(pixels, "RGB").save(buffer, "JPEG", quality=90)
+        corpus.append(buffer.getvalue())
+    return corpus
+
+
+class StubFashionModel:
+    """
+    Stand-in for FashionCLIP with deterministic embeddings and a fixed cost model
+
+    Each encode_images call sleeps for a fixed overhead plus a per-image
+    cost, which is roughly how a batched forward pass scales, so batching
+    and queueing effects show up without loading any weights.
+    """
+
+    def __init__(self, dim: int = 512, call_ms: float = 10, image_ms: float = 4):
+        self.dim = dim
+        self.call_ms = call_ms
+        self.image_ms = image_ms
+        self.projection = np.random.default_rng(1).standard_normal((16 * 16 * 3, dim)).astype(np.float32)
+
+    def encode_images(self, images: List[Image.Image], batch_size: int = 32) -> np.ndarray:
+        time.sleep((self.call_ms + self.image_ms * len(images)) / 1000)
+        pixels = np.stack([
+            np.asarray(img.convert("RGB").resize((16, 16)), dtype=np.float32).ravel() / 255
+            for img in images
+        ])
+        return pixels @ self.projection
+
+    def encode_text(self, text: List[str], batch_size: int = 32) -> np.ndarray:
+        embeds = []
+        for label in text:
+            seed = int.from_bytes(hashlib.blake2b(label.encode(), digest_size=4).digest(), "little")
+            embeds.append(np.random.default_rng(seed).standard_normal(self.dim))
+        return np.asarray(embeds, dtype=np.float32)
+
+
+class StubCaptionEngine:
+    """Stand-in for CaptionEngine with a fixed cost per generate call and per image"""
+
+    def __init__(self, call_ms: float = 50, image_ms: float = 30):
+        self.call_ms = call_ms
+        self.image_ms = image_ms
+
+    def caption_batch(self, requests: List) -> List[Dict[str, str]]:
+        time.sleep((self.call_ms + self.image_ms * len(requests)) / 1000)
+        return [
+            {
+                "<CAPTION>": f"A {image.width}x{image.height} photo.",
+                "<DETAILED_CAPTION>": f"A detailed description of a {image.width}x{image.height} photo."
+            }
+            for image, _ in requests
+        ]
+
+    def detect_objects(self, images: List[Image.Image]) -> List[Dict]:
+        """Fixed upper-body, legs and feet boxes, at the cost of one generate call"""
+        time.sleep((self.call_ms + self.image_ms * len(images)) / 1000)
+        return [
+            {
+                "bboxes": [
+                    [0.2 * image.width, 0.1 * image.height, 0.8 * image.width, 0.5 * image.height],
+                    [0.25 * image.width, 0.45 * image.height, 0.75 * image.width, 0.9 * image.height],
+                    [0.25 * image.width, 0.85 * image.height, 0.75 * image.width, image.height]
+                ],
+                "labels": ["jacket", "jeans", "boots"]
+            }
+            for image in images
+        ]
+
+
+def stub_thumbnail(i: int) -> str:
+    """Small solid-colour JPEG as a data: URI, the way the shopping API inlines thumbnails"""
+    buffer = io.BytesIO()
+    Image.new("RGB", (96, 96), ((i * 53) % 256, (i * 97) % 256, (i * 151) % 256)).save(buffer, "JPEG")
+    return "data:image/jpeg;base64," + base64.b64encode(buffer.getvalue()).decode()
+
+
+def stub_shopping_transport(latency_ms: float = 20) -> httpx.MockTransport:
+    """Shopping API stand-in returning a fixed result list after a delay"""
+    results = [
+        {
+            "title": f"Product {i}",
+            "price": f"£{10 + i * 7}.99",
+            "link": f"https://shop.example/{i}",
+            "thumbnail": stub_thumbnail(i)
+        }
+        for i in range(20)
+    ]
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        await asyncio.sleep(latency_ms / 1000)
+        return httpx.Response(200, json={"shopping_results": results})
+
+    return httpx.MockTransport(handler)
+
+
+def install_stubs(main, args):
+    """Swap the model loaders and shopping client of the imported app for stubs"""
+    main.load_fashion_engine = lambda engine: StubFashionModel(
+        call_ms=args.model_call_ms, image_ms=args.model_image_ms
+    )
+
+    def load_stub_caption_model():
+        main.caption_engine = StubCaptionEngine(call_ms=args.caption_call_ms, image_ms=args.caption_image_ms)
+        return main.caption_engine
+
+    main.caption_slot.loader = load_stub_caption_model
+    main.shopping_client._client = httpx.AsyncClient(transport=stub_shopping_transport(args.shopping_ms))
+
+
+def clear_caches(main):
+    """Make the next scenario start cold"""
+    for cache in (main.analysis_cache, main.caption_cache, main.prepared_cache,
+                  main.shopping_client.cache, main.image_fetcher.url_cache):
+        cache.clear()
+
+
+def latency_summary(seconds: List[float]) -> Dict:
+    ms = np.asarray(seconds) * 1000
+    return {
+        "count": len(ms),
+        "mean_ms": round(float(ms.mean()), 3),
+        "p50_ms": round(float(np.percentile(ms, 50)), 3),
+        "p90_ms": round(float(np.percentile(ms, 90)), 3),
+        "p99_ms": round(float(np.percentile(ms, 99)), 3),
+        "max_ms": round(float(ms.max()), 3)
+    }
+
+
+def stage_summary(histogram) -> Dict:
+    """Count and mean of each stage recorded so far"""
+    stages = {}
+    for name, labels, value in histogram.samples():
+        if name.endswith("_sum") or name.endswith("_count"):
+            stage = stages.setdefault(labels["stage"], {})
+            stage[name.rsplit("_", 1)[1]] = value
+    return {
+        stage: {"count": int(v["count"]), "mean_ms": round(v["sum"] / v["count"] * 1000, 3)}
+        for stage, v in sorted(stages.items()) if v.get("count")
+    }
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    scale = 1 if sys.platform == "darwin" else 1024
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / (1024 * 1024), 1)
+
+
+async def measure(name: str, fn: Callable, iterations: int) -> Dict:
+    """
+    Run a scenario sequentially and record latency and memory
+
+    Args:
+        name: Scenario name used in progress output
+        fn: Coroutine function taking the iteration index
+        iterations: Number of sequential calls
+
+    Returns:
+        Latency summary plus the Python heap peak and process RSS high-water mark
+    """
+    print(f"  {name} ({iterations} requests)...")
+    seconds = []
+    for i in range(iterations):
+        start = time.perf_counter()
+        await fn(i)
+        seconds.append(time.perf_counter() - start)
+
+    # Heap tracing slows allocation down, so it gets a few extra calls of its own
+    tracemalloc.start()
+    for i in range(iterations, iterations + min(5, iterations)):
+        await fn(i)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        **latency_summary(seconds),
+        "python_heap_peak_mb": round(peak / (1024 * 1024), 1),
+        "rss_high_water_mb": peak_rss_mb()
+    }
+
+
+async def measure_throughput(name: str, fn: Callable, total: int, concurrency: int) -> Dict:
+    """
+    Run `total` calls with `concurrency` in flight at once
+
+    Returns:
+        Images per second plus the latency summary of the individual calls
+    """
+    print(f"  {name} ({total} requests, concurrency {concurrency})...")
+    queue = asyncio.Queue()
+    for i in range(total):
+        queue.put_nowait(i)
+    seconds = []
+
+    async def worker():
+        while not queue.empty():
+            i = queue.get_nowait()
+            start = time.perf_counter()
+            await fn(i)
+            seconds.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    return {
+        "concurrency": concurrency,
+        "throughput_per_s": round(total / elapsed, 2),
+        **latency_summary(seconds),
+        "rss_high_water_mb": peak_rss_mb()
+    }
+
+
+def check(response: httpx.Response) -> httpx.Response:
+    if response.status_code != 200:
+        raise RuntimeError(f"{response.request.url.path} returned {response.status_code}: {response.text[:200]}")
+    return response
+
+
+async def run_benchmarks(args) -> Dict:
+    results = {}
+
+    # Cold start: import, then load and warm up both (stub) models
+    start = time.perf_counter()
+    import main
+    results["import_seconds"] = round(time.perf_counter() - start, 3)
+    install_stubs(main, args)
+
+    start = time.perf_counter()
+    await main.load_model()
+    await main.model_loading_task
+    results["cold_start"] = {
+        "ready_seconds": round(time.perf_counter() - start, 3),
+        "models": {slot.name: slot.status() for slot in main.model_slots}
+    }
+
+    corpus = synthetic_corpus(args.corpus_size, seed=args.seed)
+    print(f"Corpus: {len(corpus)} images, {sum(map(len, corpus)) / 1024 / 1024:.1f}MB")
+
+    # Every request index gets distinct bytes, so each one misses the caches;
+    # decoders ignore the bytes appended after the JPEG end marker
+    def image(i: int) -> bytes:
+        return corpus[i % len(corpus)] + i.to_bytes(4, "little")
+
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as client:
+        scenarios = {}
+
+        def post_file(path: str, contents: bytes, **params):
+            return client.post(path, files={"file": ("bench.jpg", contents, "image/jpeg")}, params=params)
+
+        print("Single requests:")
+        clear_caches(main)
+        decoded = [main.PreparedImage(contents).for_clip() for contents in corpus[:args.iterations]]
+
+        async def direct(i):
+            main.analyze_fashion_image(decoded[i % len(decoded)])
+        scenarios["analyze_fashion_image"] = await measure("analyze_fashion_image", direct, args.iterations)
+
+        clear_caches(main)
+        scenarios["analyze"] = await measure(
+            "/analyze", lambda i: checked(post_file("/analyze", image(i))), args.iterations
+        )
+
+        clear_caches(main)
+        scenarios["analyze_cached"] = await measure(
+            "/analyze (cached)", lambda i: checked(post_file("/analyze", image(0))), args.iterations
+        )
+
+        # Region crops share one forward pass with the whole image, so these
+        # should cost well under one extra pass per region
+        for mode in ("grid", "detect"):
+            clear_caches(main)
+            scenarios[f"analyze_regions_{mode}"] = await measure(
+                f"/analyze?regions={mode}",
+                lambda i, mode=mode: checked(post_file("/analyze", image(i), regions=mode)),
+                args.iterations
+            )
+
+        clear_caches(main)
+        scenarios["analyseCaption"] = await measure(
+            "/analyseCaption", lambda i: checked(post_file("/analyseCaption", image(i))), args.caption_iterations
+        )
+
+        clear_caches(main)
+        scenarios["analyze_and_shop"] = await measure(
+            "/analyze_and_shop", lambda i: checked(post_file("/analyze_and_shop", image(i))), args.iterations
+        )
+
+        # The first pass embeds every thumbnail; repeats find them in the product index
+        clear_caches(main)
+        scenarios["analyze_and_shop_visual"] = await measure(
+            "/analyze_and_shop?sort=visual",
+            lambda i: checked(post_file("/analyze_and_shop", image(i), sort="visual")),
+            args.iterations
+        )
+        results["single_request"] = scenarios
+
+        print("Throughput:")
+        throughput = {"analyze_batch": {}, "analyze_concurrent": {}, "analyseCaption_concurrent": {}}
+        for batch_size in args.batch_sizes:
+            clear_caches(main)
+            files = [("files", (f"bench{i}.jpg", image(i), "image/jpeg")) for i in range(batch_size)]
+            start = time.perf_counter()
+            response = check(await client.post("/analyze/batch", files=files))
+            elapsed = time.perf_counter() - start
+            assert len(response.json()["results"]) == batch_size
+            throughput["analyze_batch"][str(batch_size)] = {
+                "seconds": round(elapsed, 3),
+                "images_per_s": round(batch_size / elapsed, 2),
+                "rss_high_water_mb": peak_rss_mb()
+            }
+            print(f"  /analyze/batch x{batch_size}: {batch_size / elapsed:.1f} images/s")
+
+        for concurrency in args.concurrency:
+            clear_caches(main)
+            throughput["analyze_concurrent"][str(concurrency)] = await measure_throughput(
+                "/analyze", lambda i: checked(post_file("/analyze", image(i))),
+                max(args.iterations, concurrency * 4), concurrency
+            )
+            clear_caches(main)
+            throughput["analyseCaption_concurrent"][str(concurrency)] = await measure_throughput(
+                "/analyseCaption", lambda i: checked(post_file("/analyseCaption", image(i))),
+                max(args.caption_iterations, concurrency * 2), min(concurrency, main.config.CAPTION_MAX_CONCURRENT)
+            )
+        results["throughput"] = throughput
+
+    results["stages"] = stage_summary(STAGE_SECONDS)
+    results["rss_high_water_mb"] = peak_rss_mb()
+    await main.stop_workers()
+    return results
+
+
+async def checked(request) -> httpx.Response:
+    return check(await request)
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def flatten(results: Dict, prefix: str = "") -> Dict[str, float]:
+    """Numeric leaves of a results dict, keyed by their dotted path"""
+    flat = {}
+    for key, value in results.items():
+        path = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(flatten(value, f"{path}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[path] = value
+    return flat
+
+
+def compare(baseline: Dict, current: Dict, threshold: float = 0.1) -> List[str]:
+    """
+    Latency, throughput and memory metrics that got worse by more than threshold
+
+    Args:
+        baseline: Results of an earlier run
+        current: Results of this run
+        threshold: Relative change treated as a regression
+
+    Returns:
+        One line per regression
+    """
+    old, new = flatten(baseline["results"]), flatten(current["results"])
+    regressions = []
+    for path, value in new.items():
+        before = old.get(path)
+        if not before or not path.endswith(("_ms", "_mb", "_per_s", "seconds")):
+            continue
+        change = (value - before) / before
+        # Throughput regresses when it drops, everything else when it grows
+        worse = -change if path.endswith("_per_s") else change
+        if worse > threshold:
+            regressions.append(f"{path}: {before} -> {value} ({change:+.1%})")
+    return regressions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Offline benchmark of the SherlockCombs backend")
+    parser.add_argument("--output", default="benchmark_results.json", help="Where to write the JSON results")
+    parser.add_argument("--compare", help="Earlier results file to check for regressions")
+    parser.add_argument("--threshold", type=float, default=0.1, help="Relative change reported as a regression")
+    parser.add_argument("--seed", type=int, default=0, help="Corpus random seed")
+    parser.add_argument("--corpus-size", type=int, default=24, help="Distinct images in the corpus")
+    parser.add_argument("--iterations", type=int, default=50, help="Sequential requests per analysis scenario")
+    parser.add_argument("--caption-iterations", type=int, default=20, help="Sequential requests per caption scenario")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 4, 16, 64], help="/analyze/batch sizes")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32], help="Concurrent clients")
+    parser.add_argument("--model-call-ms", type=float, default=10, help="Stub Fashion-CLIP cost per call")
+    parser.add_argument("--model-image-ms", type=float, default=4, help="Stub Fashion-CLIP cost per image")
+    parser.add_argument("--caption-call-ms", type=float, default=50, help="Stub Florence-2 cost per call")
+    parser.add_argument("--caption-image-ms", type=float, default=30, help="Stub Florence-2 cost per image")
+    parser.add_argument("--shopping-ms", type=float, default=20, help="Stub shopping API latency")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    results = asyncio.run(run_benchmarks(args))
+
+    report = {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "parameters": vars(args),
+        "results": results
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2, default=str)
+    print(f"Results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(json.load(f), report, args.threshold)
+        if regressions:
+            print(f"Regressions against {args.compare}:")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print(f"No regressions against {args.compare}")
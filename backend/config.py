@@ -0,0 +1,126 @@
+"""
+Runtime configuration for the Fashion API
+Every setting can be overridden with an environment variable of the same name
+"""
+
+import os
+
+
+# Micro-batching for /analyze: a batch is flushed when it reaches
+# ANALYZE_MAX_BATCH_SIZE images or ANALYZE_MAX_WAIT_MS after its first image
+ANALYZE_MAX_BATCH_SIZE = int(os.environ.get("ANALYZE_MAX_BATCH_SIZE", 16))
+ANALYZE_MAX_WAIT_MS = float(os.environ.get("ANALYZE_MAX_WAIT_MS", 10))
+
+# Threads in the inference pool that runs all blocking model work
+INFERENCE_WORKERS = int(os.environ.get("INFERENCE_WORKERS", 2))
+
+# Florence-2 captioning: requests are batched like /analyze, and each batch
+# runs both caption tasks in one generate call with the chosen preset
+CAPTION_MAX_BATCH_SIZE = int(os.environ.get("CAPTION_MAX_BATCH_SIZE", 4))
+CAPTION_MAX_WAIT_MS = float(os.environ.get("CAPTION_MAX_WAIT_MS", 20))
+CAPTION_PRESET = os.environ.get("CAPTION_PRESET", "fast")
+
+# Server-side result caches (analysis and caption each get their own bound)
+RESULT_CACHE_MB = float(os.environ.get("RESULT_CACHE_MB", 64))
+RESULT_CACHE_TTL_S = float(os.environ.get("RESULT_CACHE_TTL_S", 3600))
+
+# On-disk Fashion-CLIP image embeddings shared by all workers; empty disables it
+EMBEDDING_STORE_DIR = os.environ.get("EMBEDDING_STORE_DIR", ".cache/embeddings/fashion-clip")
+# Threads for embedding store and product index file I/O, kept off the event loop
+STORE_IO_WORKERS = int(os.environ.get("STORE_IO_WORKERS", 4))
+
+# Shopping search client
+SHOPPING_TIMEOUT_S = float(os.environ.get("SHOPPING_TIMEOUT_S", 10))
+SHOPPING_CACHE_TTL_S = float(os.environ.get("SHOPPING_CACHE_TTL_S", 3600))
+SHOPPING_CACHE_MB = float(os.environ.get("SHOPPING_CACHE_MB", 32))
+SHOPPING_MAX_CONNECTIONS = int(os.environ.get("SHOPPING_MAX_CONNECTIONS", 20))
+
+# Server-side image downloads for /analyze_url
+IMAGE_FETCH_MAX_BYTES = int(os.environ.get("IMAGE_FETCH_MAX_BYTES", 15 * 1024 * 1024))
+IMAGE_FETCH_TIMEOUT_S = float(os.environ.get("IMAGE_FETCH_TIMEOUT_S", 10))
+IMAGE_FETCH_MAX_CONNECTIONS = int(os.environ.get("IMAGE_FETCH_MAX_CONNECTIONS", 20))
+IMAGE_FETCH_ALLOW_PRIVATE = os.environ.get("IMAGE_FETCH_ALLOW_PRIVATE", "false").lower() == "true"
+
+# Fashion-CLIP inference engine: "torch" (eager PyTorch) or "onnx" (ONNX Runtime)
+FASHION_ENGINE = os.environ.get("FASHION_ENGINE", "torch")
+ONNX_MODEL_DIR = os.environ.get("ONNX_MODEL_DIR", ".cache/onnx/fashion-clip")
+ONNX_QUANTIZE = os.environ.get("ONNX_QUANTIZE", "true").lower() == "true"
+ONNX_INTRA_OP_THREADS = int(os.environ.get("ONNX_INTRA_OP_THREADS", 0))
+ONNX_INTER_OP_THREADS = int(os.environ.get("ONNX_INTER_OP_THREADS", 1))
+ONNX_PARITY_THRESHOLD = float(os.environ.get("ONNX_PARITY_THRESHOLD", 0.9))
+
+# Model loading: "eager" (in parallel at startup), "lazy" (on first request)
+# or "disabled" (routes needing the model return 503)
+FASHION_MODEL_LOAD = os.environ.get("FASHION_MODEL_LOAD", "eager")
+CAPTION_MODEL_LOAD = os.environ.get("CAPTION_MODEL_LOAD", "eager")
+
+# Run synthetic inputs through each model before reporting it ready
+WARMUP_ENABLED = os.environ.get("WARMUP_ENABLED", "true").lower() == "true"
+
+# Pre-fork multi-worker serving (see gunicorn_conf.py): load model weights in
+# the master so workers share them copy-on-write. SERVER_WORKERS=0 means one
+# worker per core; TORCH_THREADS_PER_WORKER=0 splits the cores evenly.
+PRELOAD_MODELS = os.environ.get("PRELOAD_MODELS", "false").lower() == "true"
+SERVER_WORKERS = int(os.environ.get("SERVER_WORKERS", 0))
+TORCH_THREADS_PER_WORKER = int(os.environ.get("TORCH_THREADS_PER_WORKER", 0))
+
+# /analyze/batch: upload caps (file count and total upload size), and chunking
+# of each batched forward pass by image count and decoded pixel memory
+ANALYZE_BATCH_MAX_FILES = int(os.environ.get("ANALYZE_BATCH_MAX_FILES", 1000))
+ANALYZE_BATCH_MAX_MB = float(os.environ.get("ANALYZE_BATCH_MAX_MB", 256))
+ANALYZE_BATCH_CHUNK_SIZE = int(os.environ.get("ANALYZE_BATCH_CHUNK_SIZE", 32))
+ANALYZE_BATCH_CHUNK_MB = float(os.environ.get("ANALYZE_BATCH_CHUNK_MB", 512))
+
+# Upload limits checked before any pixel is decoded, and the cache of decoded
+# images shared between the analysis and caption paths
+MAX_UPLOAD_BYTES = int(os.environ.get("MAX_UPLOAD_BYTES", 20 * 1024 * 1024))
+MAX_IMAGE_PIXELS = int(os.environ.get("MAX_IMAGE_PIXELS", 40_000_000))
+PREPARED_CACHE_MB = float(os.environ.get("PREPARED_CACHE_MB", 64))
+PREPARED_CACHE_TTL_S = float(os.environ.get("PREPARED_CACHE_TTL_S", 120))
+
+# Admission control: requests holding a slot on each model, requests allowed to
+# queue for one (beyond that the route answers 429 with Retry-After), and the
+# deadline after which a request is abandoned with 504. Captions run on their
+# own inference threads so long generate calls cannot starve /analyze.
+ANALYZE_MAX_CONCURRENT = int(os.environ.get("ANALYZE_MAX_CONCURRENT", 32))
+ANALYZE_MAX_QUEUE = int(os.environ.get("ANALYZE_MAX_QUEUE", 64))
+ANALYZE_DEADLINE_S = float(os.environ.get("ANALYZE_DEADLINE_S", 30))
+CAPTION_MAX_CONCURRENT = int(os.environ.get("CAPTION_MAX_CONCURRENT", 4))
+CAPTION_MAX_QUEUE = int(os.environ.get("CAPTION_MAX_QUEUE", 8))
+CAPTION_DEADLINE_S = float(os.environ.get("CAPTION_DEADLINE_S", 60))
+CAPTION_WORKERS = int(os.environ.get("CAPTION_WORKERS", 1))
+
+# Label vocabularies: JSON file mapping vocabulary name to labels, watched for
+# changes (the built-in labels are used while it does not exist). The admin
+# API (/admin/vocabularies) is disabled unless ADMIN_TOKEN is set.
+VOCABULARY_FILE = os.environ.get("VOCABULARY_FILE", "vocabularies.json")
+VOCABULARY_POLL_S = float(os.environ.get("VOCABULARY_POLL_S", 2))
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN", "")
+
+# Prompt ensembling: each label is embedded under several prompt templates and
+# the centroid is stored, at no request-time cost. PROMPT_TEMPLATES_FILE is an
+# optional JSON file mapping vocabulary name (or "*" for the default) to
+# templates containing "{}"; without it the built-in templates are used.
+PROMPT_ENSEMBLE = os.environ.get("PROMPT_ENSEMBLE", "true").lower() == "true"
+PROMPT_TEMPLATES_FILE = os.environ.get("PROMPT_TEMPLATES_FILE", "")
+
+# Region mode (?regions=grid|detect): candidate garment crops are encoded in
+# one batch with the whole image. The grid is REGION_GRID_ROWS x
+# REGION_GRID_COLS tiles, each grown by REGION_OVERLAP of a tile on every
+# side; detections (Florence-2 <OD>) smaller than REGION_MIN_AREA of the
+# image are dropped, and at most REGION_MAX regions are kept.
+REGION_GRID_ROWS = int(os.environ.get("REGION_GRID_ROWS", 3))
+REGION_GRID_COLS = int(os.environ.get("REGION_GRID_COLS", 1))
+REGION_OVERLAP = float(os.environ.get("REGION_OVERLAP", 0.15))
+REGION_MIN_AREA = float(os.environ.get("REGION_MIN_AREA", 0.02))
+REGION_MAX = int(os.environ.get("REGION_MAX", 6))
+
+# Visual re-ranking of shopping results (sort=visual): thumbnails of the first
+# VISUAL_RERANK_CANDIDATES results are fetched (waiting at most
+# VISUAL_RERANK_TIMEOUT_S), embedded in one batch and ordered by similarity to
+# the query image. Thumbnail embeddings are kept in an on-disk product index
+# (empty disables it); PRODUCT_INDEX_NPROBE is how many IVF lists a search scans.
+VISUAL_RERANK_CANDIDATES = int(os.environ.get("VISUAL_RERANK_CANDIDATES", 20))
+VISUAL_RERANK_TIMEOUT_S = float(os.environ.get("VISUAL_RERANK_TIMEOUT_S", 3))
+PRODUCT_INDEX_DIR = os.environ.get("PRODUCT_INDEX_DIR", ".cache/products/fashion-clip")
+PRODUCT_INDEX_NPROBE = int(os.environ.get("PRODUCT_INDEX_NPROBE", 8))
@@ -0,0 +1,146 @@
+"""
+Persistent on-disk store for Fashion-CLIP image embeddings
+A memory-mapped float16 matrix plus an append-only hash -> row index
+"""
+
+from typing import Dict, List, Optional, Tuple
+import fcntl
+import json
+import logging
+import os
+import threading
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class EmbeddingStore:
+    """
+    Image embeddings keyed on content hash, shared across processes
+
+    Rows are appended to `embeddings.f16` and read back through a read-only
+    memory map, so every worker on a host shares the same page cache
+    instead of holding its own copy. `index.txt` maps each hash to its row
+    and is appended under an exclusive file lock; readers pick up rows
+    written by other processes by re-reading the tail of the index.
+    """
+
+    def __init__(self, directory: str, dim: int):
+        """
+        Args:
+            directory: Directory holding the store files (created if missing)
+            dim: Embedding dimension
+        """
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.dim = dim
+        self.row_bytes = dim * np.dtype(np.float16).itemsize
+        self.matrix_path = os.path.join(directory, "embeddings.f16")
+        self.index_path = os.path.join(directory, "index.txt")
+        self.lock_path = os.path.join(directory, "store.lock")
+
+        meta_path = os.path.join(directory, "meta.json")
+        if os.path.exists(meta_path):
+            with open(meta_path) as f:
+                meta = json.load(f)
+            if meta.get("dim") != dim:
+                raise ValueError(f"Embedding store at {directory} has dim {meta.get('dim')}, expected {dim}")
+        else:
+            with open(meta_path, "w") as f:
+                json.dump({"dim": dim, "dtype": "float16"}, f)
+
+        for path in (self.matrix_path, self.index_path):
+            open(path, "ab").close()
+
+        self._index: Dict[str, int] = {}
+        self._index_offset = 0
+        self._mmap = None
+        self._mapped_rows = 0
+        self._lock = threading.Lock()
+
+        self._refresh_index()
+        logger.info(f"Embedding store at {directory}: {len(self._index)} embeddings")
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        """
+        Look up an embedding by content hash
+
+        Returns:
+            float32 embedding vector, or None if the hash is unknown
+        """
+        with self._lock:
+            row = self._index.get(key)
+            if row is None:
+                self._refresh_index()
+                row = self._index.get(key)
+                if row is None:
+                    return None
+            return self._read_row(row)
+
+    def put(self, key: str, vector) -> None:
+        """
+        Append an embedding unless the hash is already stored
+
+        Args:
+            key: Content hash
+            vector: Embedding of length dim
+        """
+        vector = np.asarray(vector, dtype=np.float16).reshape(self.dim)
+        with self._lock, open(self.lock_path, "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                self._refresh_index()
+                if key in self._index:
+                    return
+
+                # Drop a partial row left behind by a crashed writer
+                size = os.path.getsize(self.matrix_path)
+                if size % self.row_bytes:
+                    size -= size % self.row_bytes
+                    os.truncate(self.matrix_path, size)
+                row = size // self.row_bytes
+
+                with open(self.matrix_path, "ab") as f:
+                    f.write(vector.tobytes())
+                with open(self.index_path, "a") as f:
+                    f.write(f"{key} {row}\n")
+                self._refresh_index()
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def snapshot(self) -> Tuple[List[str], np.ndarray]:
+        """
+        Every stored embedding with its key, in row order
+
+        Returns:
+            Tuple of (keys, float32 matrix of shape (len(keys), dim))
+        """
+        with self._lock:
+            self._refresh_index()
+            entries = sorted(self._index.items(), key=lambda entry: entry[1])
+            if not entries:
+                return [], np.zeros((0, self.dim), dtype=np.float32)
+            self._read_row(entries[-1][1])
+            rows = [row for _, row in entries]
+            return [key for key, _ in entries], np.array(self._mmap[rows], dtype=np.float32)
+
+    def _refresh_index(self):
+        """Read index lines appended since the last refresh"""
+        with open(self.index_path, "rb") as f:
+            f.seek(self._index_offset)
+            data = f.read()
+        end = data.rfind(b"\n") + 1
+        for line in data[:end].splitlines():
+            key, row = line.decode().split()
+            self._index[key] = int(row)
+        self._index_offset += end
+
+    def _read_row(self, row: int) -> np.ndarray:
+        if row >= self._mapped_rows:
+            rows = os.path.getsize(self.matrix_path) // self.row_bytes
+            self._mmap = np.memmap(self.matrix_path, dtype=np.float16, mode="r", shape=(rows, self.dim))
+            self._mapped_rows = rows
+        return np.array(self._mmap[row], dtype=np.float32)
@@ -0,0 +1,47 @@
+"""
+Gunicorn config for multi-worker serving with shared model weights
+
+Models are loaded once in the master process (preload_app), then workers
+are forked and share the weights and label embeddings copy-on-write, so
+adding workers does not multiply model memory.
+
+Usage:
+    gunicorn -c gunicorn_conf.py main:app
+
+Pre-fork loading is meant for CPU nodes; CUDA cannot be used in forked
+workers once the master has initialised it.
+"""
+
+import gc
+import multiprocessing
+import os
+
+# Must be set before main (and config) are imported by preload_app
+os.environ.setdefault("PRELOAD_MODELS", "true")
+
+import config
+
+cores = multiprocessing.cpu_count()
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 8000)}"
+workers = config.SERVER_WORKERS or cores
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = True
+timeout = 300
+graceful_timeout = 30
+
+
+def when_ready(server):
+    # Move everything loaded so far out of the garbage collector's reach, so
+    # collections in the workers do not touch (and copy) the shared pages
+    gc.freeze()
+    server.log.info(f"Models preloaded, forking {workers} workers")
+
+
+def post_fork(server, worker):
+    import torch
+
+    # Split the cores between workers instead of oversubscribing them
+    threads = config.TORCH_THREADS_PER_WORKER or max(1, cores // workers)
+    torch.set_num_threads(threads)
+    server.log.info(f"Worker {worker.pid} using {threads} torch threads")
@@ -0,0 +1,264 @@
+"""
+Server-side image download for URL-based analysis
+Streams images through a pooled client with size limits and a URL -> hash cache
+"""
+
+from typing import List, Optional, Tuple
+from urllib.parse import urljoin, urlparse
+import asyncio
+import base64
+import binascii
+import hashlib
+import ipaddress
+import logging
+import re
+import httpcore
+import httpx
+
+import config
+from result_cache import ResultCache
+from singleflight import SingleFlight
+from metrics import stage_timer
+
+logger = logging.getLogger(__name__)
+
+# Redirects are followed by hand so every hop passes the URL check
+MAX_REDIRECTS = 5
+
+
+class ImageFetchError(Exception):
+    """Raised when an image URL cannot be fetched; carries an HTTP status code"""
+
+    def __init__(self, message: str, status_code: int = 400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+async def resolve_host(host: str) -> List[str]:
+    """IP addresses a host name resolves to"""
+    try:
+        infos = await asyncio.get_running_loop().getaddrinfo(host, None)
+    except OSError:
+        raise ImageFetchError("Image host could not be resolved", 400)
+    return list(dict.fromkeys(info[4][0].split("%")[0] for info in infos))
+
+
+async def public_address(host: str) -> str:
+    """
+    Resolve a host once and return an address to connect to, if all are public
+
+    Raises:
+        ImageFetchError: The host does not resolve or has a non-public address
+    """
+    try:
+        addresses = [str(ipaddress.ip_address(host))]
+    except ValueError:
+        addresses = await resolve_host(host)
+    if not addresses or not all(ipaddress.ip_address(address).is_global for address in addresses):
+        raise ImageFetchError("Image host is not publicly reachable", 400)
+    return addresses[0]
+
+
+class PublicAddressBackend(httpcore.AsyncNetworkBackend):
+    """
+    Network backend that connects only to vetted public addresses
+
+    The host is resolved once, every address is checked, and the socket is
+    opened to the checked address itself. A host that answers with a
+    public address for the check and a private one for the connection
+    (DNS rebinding) therefore cannot slip through. TLS and the Host header
+    still use the host name, which httpcore takes from the URL.
+    """
+
+    def __init__(self, backend: Optional[httpcore.AsyncNetworkBackend] = None):
+        self._backend = backend or httpcore.AnyIOBackend()
+
+    async def connect_tcp(self, host, port, timeout=None, local_address=None, socket_options=None):
+        address = await public_address(host)
+        return await self._backend.connect_tcp(address, port, timeout, local_address, socket_options)
+
+    async def connect_unix_socket(self, path, timeout=None, socket_options=None):
+        raise ImageFetchError("Only http and https image URLs are supported", 400)
+
+    async def sleep(self, seconds: float):
+        await self._backend.sleep(seconds)
+
+
+def decode_data_uri(uri: str, max_bytes: int = config.IMAGE_FETCH_MAX_BYTES) -> bytes:
+    """
+    Image bytes of a base64 data: URI, the form shopping results carry thumbnails in
+
+    Hex escapes such as \\x3d that the shopping API leaves in the string
+    are undone first.
+
+    Raises:
+        ImageFetchError: Not a base64 image URI, or too large
+    """
+    uri = re.sub(r"\\x([0-9A-Fa-f]{2})", lambda m: chr(int(m.group(1), 16)), uri)
+    header, _, data = uri.partition(",")
+    if not header.startswith("data:image/") or not header.endswith(";base64"):
+        raise ImageFetchError("Only base64 image data URIs are supported", 400)
+    if len(data) * 3 // 4 > max_bytes:
+        raise ImageFetchError("Image is too large", 413)
+    try:
+        return base64.b64decode(data)
+    except (binascii.Error, ValueError):
+        raise ImageFetchError("Invalid base64 image data", 400)
+
+
+class ImageFetcher:
+    """
+    Downloads images by URL and remembers which content hash each URL had
+
+    Bodies are streamed and hashed chunk by chunk, and the download is
+    aborted as soon as it exceeds `max_bytes`. A URL seen before resolves
+    straight to its content hash, so callers can serve it from the content
+    caches without downloading it again.
+    """
+
+    def __init__(
+        self,
+        max_bytes: int = config.IMAGE_FETCH_MAX_BYTES,
+        timeout: float = config.IMAGE_FETCH_TIMEOUT_S,
+        max_connections: int = config.IMAGE_FETCH_MAX_CONNECTIONS,
+        url_cache_ttl: float = config.RESULT_CACHE_TTL_S,
+        allow_private: bool = config.IMAGE_FETCH_ALLOW_PRIVATE,
+        network_backend: Optional[httpcore.AsyncNetworkBackend] = None
+    ):
+        """
+        Args:
+            max_bytes: Largest image accepted
+            timeout: Seconds per request
+            max_connections: Pooled connections
+            url_cache_ttl: Seconds a URL -> hash entry lives
+            allow_private: Also fetch from private and loopback addresses
+            network_backend: Backend that opens the vetted connections
+                (default: httpcore's own)
+        """
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self.allow_private = allow_private
+        self.network_backend = network_backend
+        self.url_cache = ResultCache(8, url_cache_ttl, name="url")
+        self.inflight = SingleFlight()
+        self._client = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            limits = httpx.Limits(
+                max_connections=self.max_connections,
+                max_keepalive_connections=self.max_connections
+            )
+            transport = httpx.AsyncHTTPTransport(limits=limits)
+            if not self.allow_private or self.network_backend is not None:
+                # httpx has no public hook for the network backend, so the
+                # pool's is replaced before it opens any connection
+                backend = self.network_backend
+                if not self.allow_private:
+                    backend = PublicAddressBackend(backend)
+                transport._pool._network_backend = backend
+            self._client = httpx.AsyncClient(
+                timeout=self.timeout,
+                follow_redirects=False,
+                transport=transport,
+                # Proxies from the environment would connect on our behalf, unchecked
+                trust_env=self.allow_private,
+                headers={"User-Agent": "SherlockCombs/1.0"}
+            )
+        return self._client
+
+    async def resolve(self, url: str) -> Tuple[str, Optional[bytes]]:
+        """
+        Content hash for a URL, downloading only if the URL is unknown
+
+        Args:
+            url: Image URL
+
+        Returns:
+            Tuple of (content hash, image bytes or None if served from the URL cache)
+        """
+        image_hash = self.url_cache.get(url)
+        if image_hash is not None:
+            return image_hash, None
+        return await self.download(url)
+
+    async def download(self, url: str) -> Tuple[str, bytes]:
+        """
+        Download an image, sharing concurrent downloads of the same URL
+
+        Returns:
+            Tuple of (content hash, image bytes)
+        """
+        return await self.inflight.do(url, lambda: self._download(url))
+
+    async def _download(self, url: str) -> Tuple[str, bytes]:
+        with stage_timer("image_fetch"):
+            return await self._fetch(url)
+
+    async def _fetch(self, url: str) -> Tuple[str, bytes]:
+        target = url
+        for _ in range(MAX_REDIRECTS + 1):
+            await self._check_url(target)
+            result = await self._fetch_once(target)
+            if isinstance(result, str):
+                target = result
+                continue
+            image_hash, contents = result
+            self.url_cache.put(url, image_hash, size=len(url) + len(image_hash))
+            return image_hash, contents
+        raise ImageFetchError("Image URL redirected too many times", 502)
+
+    async def _fetch_once(self, url: str):
+        """
+        One GET without following redirects
+
+        Returns:
+            The redirect target URL, or a tuple of (content hash, image bytes)
+        """
+        digest = hashlib.blake2b(digest_size=16)
+        chunks = []
+        size = 0
+        try:
+            async with self.client.stream("GET", url) as response:
+                if response.is_redirect:
+                    location = response.headers.get("location")
+                    if not location:
+                        raise ImageFetchError("Image URL redirected without a location", 502)
+                    return urljoin(url, location)
+                if response.status_code != 200:
+                    raise ImageFetchError(f"Image URL returned status {response.status_code}", 502)
+                content_type = response.headers.get("content-type", "")
+                if content_type and not content_type.startswith("image/"):
+                    raise ImageFetchError("URL does not point to an image", 400)
+                if int(response.headers.get("content-length") or 0) > self.max_bytes:
+                    raise ImageFetchError("Image is too large", 413)
+
+                async for chunk in response.aiter_bytes():
+                    size += len(chunk)
+                    if size > self.max_bytes:
+                        raise ImageFetchError("Image is too large", 413)
+                    digest.update(chunk)
+                    chunks.append(chunk)
+        except httpx.TimeoutException:
+            raise ImageFetchError("Image download timed out", 504)
+        except httpx.HTTPError as e:
+            raise ImageFetchError(f"Image download failed: {str(e)}", 502)
+
+        return digest.hexdigest(), b"".join(chunks)
+
+    async def _check_url(self, url: str):
+        """
+        Only allow http(s) URLs; called again for every redirect hop
+
+        Public addresses are enforced when connecting, by PublicAddressBackend.
+        """
+        parsed = urlparse(url)
+        if parsed.scheme not in ("http", "https") or not parsed.hostname:
+            raise ImageFetchError("Only http and https image URLs are supported", 400)
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
@@ -0,0 +1,43 @@
+"""
+Dedicated executor for blocking model work
+Keeps PyTorch inference and image decoding off the asyncio event loop
+"""
+
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
+
+
+class InferenceExecutor(ThreadPoolExecutor):
+    """
+    Bounded thread pool that all model work goes through
+
+    PyTorch and PIL release the GIL for their heavy lifting, so a small
+    pool of threads lets inference run in parallel with the event loop,
+    which stays free to answer cheap routes such as /health.
+    """
+
+    def __init__(self, max_workers: int = 2, name: str = "inference"):
+        """
+        Args:
+            max_workers: Number of inference threads
+            name: Thread name prefix
+        """
+        super().__init__(max_workers=max(1, max_workers), thread_name_prefix=name)
+        self.size = max(1, max_workers)
+
+    async def run(self, fn: Callable, *args, **kwargs) -> Any:
+        """
+        Run a blocking function in the pool and await its result
+
+        Args:
+            fn: Blocking callable
+            *args: Positional arguments for fn
+            **kwargs: Keyword arguments for fn
+
+        Returns:
+            Whatever fn returns
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self, functools.partial(fn, *args, **kwargs))
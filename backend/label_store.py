@@ -0,0 +1,221 @@
+"""
+Precomputed label embeddings for Fashion-CLIP zero-shot scoring
+Encodes every vocabulary once, optionally as prompt-ensemble centroids, and
+scores images with a single matmul
+"""
+
+from typing import Dict, List, Optional, Tuple
+import hashlib
+import json
+import torch
+import numpy as np
+
+
+def to_tensor(embeds) -> torch.Tensor:
+    """Convert Fashion-CLIP output (numpy or torch) to a float tensor"""
+    if isinstance(embeds, np.ndarray):
+        embeds = torch.from_numpy(embeds)
+    return embeds.float()
+
+
+def normalize(embeds: torch.Tensor) -> torch.Tensor:
+    """L2-normalise embeddings along the last dimension"""
+    return embeds / embeds.norm(dim=-1, keepdim=True)
+
+
+# Bare label text, i.e. no prompt ensembling
+BARE_TEMPLATE = ("{}",)
+
+
+def vocabulary_version(vocabularies: Dict[str, List[str]], templates: Optional[Dict[str, List[str]]] = None) -> str:
+    """
+    Content hash of a label set and its prompt templates, identical across
+    processes for the same configuration
+    """
+    content = vocabularies if not templates else {"vocabularies": vocabularies, "templates": templates}
+    return hashlib.blake2b(json.dumps(content, sort_keys=True).encode(), digest_size=8).hexdigest()
+
+
+def templates_for(templates: Optional[Dict[str, List[str]]], name: str) -> Tuple[str, ...]:
+    """Prompt templates of a vocabulary; "*" holds the default for vocabularies without their own"""
+    if not templates:
+        return BARE_TEMPLATE
+    return tuple(templates.get(name) or templates.get("*") or BARE_TEMPLATE)
+
+
+def encode_centroids(fashion_model, keys: List[Tuple[Tuple[str, ...], str]], batch_size: int) -> torch.Tensor:
+    """
+    Prompt-ensemble embedding for each (templates, label) key
+
+    Every label is written into each of its templates, all prompts are
+    encoded together, and each label's normalised prompt embeddings are
+    averaged into one centroid. With the single bare template this is
+    just the label's own embedding.
+
+    Returns:
+        Normalised centroids of shape (len(keys), dim)
+    """
+    prompts = [template.format(label) for templates, label in keys for template in templates]
+    embeds = normalize(to_tensor(fashion_model.encode_text(prompts, batch_size=batch_size)))
+    centroids = []
+    offset = 0
+    for templates, _ in keys:
+        centroids.append(embeds[offset:offset + len(templates)].mean(0))
+        offset += len(templates)
+    return normalize(torch.stack(centroids))
+
+
+class LabelEmbeddingStore:
+    """
+    Normalised text embeddings for a set of label vocabularies
+
+    Every distinct (templates, label) pair has one row in `matrix`, so an
+    image is scored against every label with one matmul; `indices` maps
+    each vocabulary name to its rows. With prompt templates, a row is the
+    centroid of the label's embeddings under every template of its
+    vocabulary, so ensembling costs nothing at request time. A store is
+    never modified once built:
+    `updated()` returns a new store that reuses the rows of this one,
+    encodes only the labels it has not seen, and appends them to the
+    matrix. Callers swap the new store in with a single assignment, so
+    requests in flight keep scoring against a consistent label set.
+    """
+
+    def __init__(
+        self,
+        fashion_model,
+        vocabularies: Dict[str, List[str]],
+        batch_size: int = 32,
+        templates: Optional[Dict[str, List[str]]] = None
+    ):
+        """
+        Encode all vocabularies with the given model
+
+        Args:
+            fashion_model: Loaded FashionCLIP instance
+            vocabularies: Mapping of vocabulary name to its labels
+            batch_size: Text encoder batch size
+            templates: Mapping of vocabulary name (or "*" for the default)
+                to prompt templates containing "{}"; None encodes bare labels
+        """
+        self.templates = templates
+        self._build(fashion_model, vocabularies, batch_size, None, {}, 1)
+
+    def updated(self, fashion_model, vocabularies: Dict[str, List[str]], batch_size: int = 32) -> "LabelEmbeddingStore":
+        """
+        A new store for the given vocabularies, encoding only unseen labels
+
+        Args:
+            fashion_model: The model this store was built with
+            vocabularies: Complete new mapping of vocabulary name to labels
+            batch_size: Text encoder batch size
+
+        Returns:
+            New store with generation incremented; this store is unchanged
+        """
+        store = object.__new__(LabelEmbeddingStore)
+        store.templates = self.templates
+        store._build(fashion_model, vocabularies, batch_size, self.matrix, self.rows, self.generation + 1)
+        return store
+
+    def _build(
+        self,
+        fashion_model,
+        vocabularies: Dict[str, List[str]],
+        batch_size: int,
+        matrix: Optional[torch.Tensor],
+        rows: Dict[Tuple[Tuple[str, ...], str], int],
+        generation: int
+    ):
+        self.vocabularies = {name: list(dict.fromkeys(labels)) for name, labels in vocabularies.items()}
+        self.generation = generation
+
+        # Rows are keyed on (templates, label): the same string under
+        # another vocabulary's templates is a different prompt ensemble
+        keys = {
+            name: [(templates_for(self.templates, name), label) for label in labels]
+            for name, labels in self.vocabularies.items()
+        }
+
+        # Identifies the label set, so cached scores from another vocabulary are never reused
+        used_templates = {name: list(templates_for(self.templates, name)) for name in keys} if self.templates else None
+        self.version = vocabulary_version(self.vocabularies, used_templates)
+
+        wanted = list(dict.fromkeys(key for name_keys in keys.values() for key in name_keys))
+
+        # Rows of removed labels stay in the matrix until they outnumber the
+        # live ones; then the matrix is compacted instead of growing forever
+        if matrix is not None and len(rows) - sum(1 for key in wanted if key in rows) > len(rows) // 2:
+            kept = [key for key in wanted if key in rows]
+            matrix = matrix[torch.tensor([rows[key] for key in kept], dtype=torch.long)] if kept else None
+            rows = {key: row for row, key in enumerate(kept)}
+
+        new_keys = [key for key in wanted if key not in rows]
+        rows = dict(rows)
+        if new_keys:
+            new_embeds = encode_centroids(fashion_model, new_keys, batch_size)
+            offset = 0 if matrix is None else matrix.shape[0]
+            matrix = new_embeds if matrix is None else torch.cat([matrix, new_embeds])
+            for i, key in enumerate(new_keys):
+                rows[key] = offset + i
+
+        self.matrix = matrix
+        self.rows = rows
+        self.encoded = len(new_keys)
+        self.indices = {
+            name: torch.tensor([rows[key] for key in name_keys], dtype=torch.long)
+            for name, name_keys in keys.items()
+        }
+
+    def share_memory(self):
+        """Move the label matrix into shared memory so forked workers reuse one copy"""
+        self.matrix.share_memory_()
+        return self
+
+    @property
+    def dim(self) -> int:
+        """Embedding dimension"""
+        return self.matrix.shape[1]
+
+    @property
+    def size(self) -> int:
+        """Number of live labels across all vocabularies"""
+        return sum(len(labels) for labels in self.vocabularies.values())
+
+    def score(self, image_embeds) -> torch.Tensor:
+        """
+        Cosine similarity of each image against every label row
+
+        Args:
+            image_embeds: Image embeddings of shape (n_images, dim)
+
+        Returns:
+            Similarity matrix of shape (n_images, n_rows)
+        """
+        image_embeds = normalize(to_tensor(image_embeds))
+        return image_embeds @ self.matrix.T
+
+    def rank(self, image_embeds, limits: Dict[str, int]) -> List[Dict[str, List[Tuple[str, float]]]]:
+        """
+        Top labels per vocabulary for each image
+
+        Args:
+            image_embeds: Image embeddings of shape (n_images, dim)
+            limits: Mapping of vocabulary name to number of labels to
+                return; vocabularies this store does not have are skipped
+
+        Returns:
+            One dictionary per image mapping vocabulary name to
+            (label, score) pairs sorted by score
+        """
+        similarities = self.score(image_embeds)
+        ranked = [{} for _ in range(similarities.shape[0])]
+        for name, k in limits.items():
+            labels = self.vocabularies.get(name)
+            if not labels:
+                continue
+            # One top-k over the whole batch per vocabulary
+            scores, positions = torch.topk(similarities[:, self.indices[name]], min(k, len(labels)), dim=1)
+            for result, row_scores, row_positions in zip(ranked, scores.tolist(), positions.tolist()):
+                result[name] = [(labels[pos], score) for pos, score in zip(row_positions, row_scores)]
+        return ranked
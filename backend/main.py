@@ -3,20 +3,48 @@ Fashion-CLIP FastAPI Backend
 Analyze fashion images via REST API endpoints
 """
 
-from fastapi import FastAPI, File, UploadFile, HTTPException
+from fastapi import FastAPI, File, Form, Header, Request, UploadFile, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
-from typing import List, Dict
+from typing import Any, Awaitable, Callable, List, Dict, Optional, Tuple
 import torch
 import numpy as np
 from PIL import Image
-from fashion_clip.fashion_clip import FashionCLIP
 from transformers import AutoProcessor, AutoModelForCausalLM
-import io
+import json
+import asyncio
 import logging
+import httpx
+import hmac
+import os
 
-from scraper import make_shopping_request
+from scraper import ShoppingClient, build_shopping_query, sort_by_price
+from analysis_engine import AnalysisEngine, VOCABULARIES, configured_templates
+from label_store import LabelEmbeddingStore
+from vocabulary import (
+    CORE_VOCABULARIES, RESERVED_NAMES, VocabularyError, VocabularyWatcher,
+    validate_vocabularies, load_vocabulary_file, save_vocabulary_file
+)
+from batching import MicroBatcher
+from inference import InferenceExecutor
+from captioning import CaptionEngine, DECODING_PRESETS
+from result_cache import ResultCache, hash_bytes, make_cache_key
+from embedding_store import EmbeddingStore
+from singleflight import SingleFlight
+from image_fetcher import ImageFetcher, ImageFetchError, decode_data_uri
+from product_index import ProductIndex
+from onnx_engine import load_fashion_engine
+from model_registry import ModelSlot, ModelNotReady, load_eager
+from warmup import warmup_batch_sizes, warmup_fashion, warmup_caption
+from admission import AdmissionController, AdmissionError, ClientDisconnected, run_with_deadline
+from metrics import (
+    REGISTRY, BATCH_SIZE, MetricsMiddleware, stage_timer, gauge, counter_family,
+    parameter_bytes, process_resident_bytes
+)
+from regions import REGION_MODES, grid_boxes, detection_boxes, crop_regions
+from preprocessing import PreparedImage, ImageRejected, open_checked, CLIP_INPUT_SIZE, FLORENCE_INPUT_SIZE
+import config
 
 # Setup logging
 logging.basicConfig(level=logging.INFO)
@@ -38,32 +66,58 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Per-route latency histograms for /metrics
+app.add_middleware(MetricsMiddleware)
+
 # Global model variable
 fashion_model = None
 florence_model = None
 florence_processor = None
+caption_engine = None
+analysis_engine = None
+image_batcher = None
+caption_batcher = None
+embedding_store = None
+product_index = None
+model_loading_task = None
+vocabulary_watcher = None
+
+# Vocabulary changes (admin API and file watcher) are applied one at a time
+vocabulary_lock = asyncio.Lock()
 
-# Fashion categories
-CATEGORIES = [
-    "short sleeve top", "long sleeve top", "t-shirt", "shirt", "blouse",
-    "jacket", "coat", "hoodie", "cardigan", "blazer",
-    "pants", "jeans", "trousers", "shorts", "skirt",
-    "dress", "short sleeve dress", "long sleeve dress", "maxi dress",
-    "bag", "handbag", "backpack", "shoes", "sneakers", "boots",
-    "hat", "cap", "sunglasses", "watch", "belt",
-    "sweater", "vest", "scarf", "tie"
-]
-
-COLORS = [
-    "red", "blue", "green", "black", "white", 
-    "yellow", "pink", "purple", "brown", "gray",
-    "orange", "navy", "beige"
-]
-
-STYLES = [
-    "casual", "formal", "sporty", "elegant", 
-    "vintage", "modern", "streetwear"
-]
+# All blocking model work and image decoding runs in this pool; captioning
+# gets its own threads so long generate calls cannot starve /analyze
+inference_executor = InferenceExecutor(config.INFERENCE_WORKERS)
+caption_executor = InferenceExecutor(config.CAPTION_WORKERS, name="caption")
+
+# Embedding store and product index reads and writes touch files and take
+# cross-process locks, so they run here instead of on the event loop
+store_executor = InferenceExecutor(config.STORE_IO_WORKERS, name="store-io")
+
+# Bounded queues per model; overflow is refused with 429 and Retry-After
+analyze_admission = AdmissionController(
+    "fashion_model", config.ANALYZE_MAX_CONCURRENT, config.ANALYZE_MAX_QUEUE
+)
+caption_admission = AdmissionController(
+    "caption_model", config.CAPTION_MAX_CONCURRENT, config.CAPTION_MAX_QUEUE
+)
+
+# Results keyed on image content hash and request parameters
+analysis_cache = ResultCache(config.RESULT_CACHE_MB, config.RESULT_CACHE_TTL_S, name="analysis")
+caption_cache = ResultCache(config.RESULT_CACHE_MB, config.RESULT_CACHE_TTL_S, name="caption")
+
+# Decoded uploads shared between the analysis and caption paths
+prepared_cache = ResultCache(config.PREPARED_CACHE_MB, config.PREPARED_CACHE_TTL_S, name="prepared")
+PREPARED_IMAGE_BYTES = 2 * FLORENCE_INPUT_SIZE * FLORENCE_INPUT_SIZE * 3
+
+# Identical concurrent model work (same image, same caption request) runs once
+inflight = SingleFlight()
+
+# Pooled, cached client for the shopping search API
+shopping_client = ShoppingClient()
+
+# Pooled client for /analyze_url downloads
+image_fetcher = ImageFetcher()
 
 
 # Response models
@@ -82,14 +136,40 @@ class StyleResult(BaseModel):
     confidence: float
 
 
+class RegionResult(BaseModel):
+    box: List[float]
+    label: str = ""
+    items: List[FashionItem]
+    colors: List[ColorResult]
+    styles: List[StyleResult]
+    attributes: Dict[str, List[FashionItem]] = {}
+    query: str = ""
+    shopping_results: List[Dict[str, Any]] = []
+
+
 class AnalysisResponse(BaseModel):
     success: bool
     items: List[FashionItem]
     colors: List[ColorResult]
     styles: List[StyleResult]
+    attributes: Dict[str, List[FashionItem]] = {}
+    regions: List[RegionResult] = []
     message: str = ""
 
 
+class AnalyzeAndShopResponse(AnalysisResponse):
+    query: str
+    shopping_results: List[Dict[str, Any]]
+
+
+class ImageUrlRequest(BaseModel):
+    url: str
+    top_items: int = 10
+    top_colors: int = 5
+    top_styles: int = 5
+    regions: Optional[str] = None
+
+
 class CaptionResponse(BaseModel):
     success: bool
     caption: str
@@ -97,31 +177,210 @@ class CaptionResponse(BaseModel):
     message: str = ""
 
 
+class LabelEdit(BaseModel):
+    add: List[str] = []
+    remove: List[str] = []
+
+
+def attribute_results(results: Dict) -> Dict[str, List[FashionItem]]:
+    """Rankings for the extra vocabularies (material, pattern, ...) of one analysis"""
+    return {
+        name: [FashionItem(**item) for item in ranked]
+        for name, ranked in results.items() if name not in CORE_VOCABULARIES and name not in RESERVED_NAMES
+    }
+
+
+def region_results(results: Dict) -> List[RegionResult]:
+    """Per-region rankings of one analysis, empty unless region mode was requested"""
+    return [
+        RegionResult(
+            box=region['box'],
+            label=region['label'],
+            items=[FashionItem(**item) for item in region['analysis']['items']],
+            colors=[ColorResult(**color) for color in region['analysis']['colors']],
+            styles=[StyleResult(**style) for style in region['analysis']['styles']],
+            attributes=attribute_results(region['analysis']),
+            query=region.get('query', ""),
+            shopping_results=region.get('shopping_results', [])
+        )
+        for region in results.get('regions', [])
+    ]
+
+
+# /analyze_and_shop result orders
+SORT_ORDERS = ("price", "visual")
+
+
+def check_region_mode(regions: Optional[str]):
+    if regions and regions not in REGION_MODES:
+        raise HTTPException(status_code=400, detail=f"Unknown region mode, expected one of: {', '.join(REGION_MODES)}")
+
+
+def initial_vocabularies() -> Dict[str, List[str]]:
+    """Vocabularies from VOCABULARY_FILE, or the built-in labels if it is missing or invalid"""
+    if config.VOCABULARY_FILE and os.path.exists(config.VOCABULARY_FILE):
+        try:
+            return load_vocabulary_file(config.VOCABULARY_FILE)
+        except (OSError, VocabularyError) as e:
+            logger.error(f"Using built-in vocabularies, cannot load {config.VOCABULARY_FILE}: {e}")
+    return VOCABULARIES
+
+
+def load_fashion_model():
+    """Load Fashion-CLIP, its label embeddings and the embedding store"""
+    global fashion_model, analysis_engine, embedding_store, product_index
+    logger.info(f"Loading Fashion-CLIP model ({config.FASHION_ENGINE} engine)...")
+    model = load_fashion_engine(config.FASHION_ENGINE)
+    logger.info("Fashion-CLIP model loaded successfully!")
+    
+    logger.info("Precomputing label embeddings...")
+    engine = AnalysisEngine(model, initial_vocabularies(), configured_templates())
+    store = engine.label_store
+    logger.info(
+        f"Label embeddings ready ({store.size} labels, "
+        f"{'prompt ensembles' if store.templates else 'bare labels'}, version {store.version})"
+    )
+    
+    if config.EMBEDDING_STORE_DIR:
+        # Quantised embeddings differ slightly, so each engine keeps its own store
+        store_dir = config.EMBEDDING_STORE_DIR
+        if config.FASHION_ENGINE != "torch":
+            store_dir = f"{store_dir}-{config.FASHION_ENGINE}"
+        embedding_store = EmbeddingStore(store_dir, store.dim)
+    
+    if config.PRODUCT_INDEX_DIR:
+        index_dir = config.PRODUCT_INDEX_DIR
+        if config.FASHION_ENGINE != "torch":
+            index_dir = f"{index_dir}-{config.FASHION_ENGINE}"
+        product_index = ProductIndex(index_dir, store.dim, nprobe=config.PRODUCT_INDEX_NPROBE)
+    
+    analysis_engine = engine
+    fashion_model = model
+    return model
+
+
+def load_caption_model():
+    """Load Florence-2 and its caption engine"""
+    global florence_model, florence_processor, caption_engine
+    logger.info("Loading Florence-2 model for image captioning...")
+    processor = AutoProcessor.from_pretrained("microsoft/Florence-2-base", trust_remote_code=True)
+    model = AutoModelForCausalLM.from_pretrained(
+        "microsoft/Florence-2-base", 
+        trust_remote_code=True,
+        attn_implementation="eager"  # Use eager attention to avoid SDPA issues
+    )
+    
+    # Move to GPU if available
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    model = model.to(device)
+    logger.info(f"Florence-2 model loaded successfully on {device}!")
+    
+    caption_engine = CaptionEngine(model, processor, device)
+    florence_processor = processor
+    florence_model = model
+    return caption_engine
+
+
+def warm_fashion_model(model):
+    """Encode synthetic images at every batch size the image batcher can form"""
+    warmup_fashion(model, warmup_batch_sizes(config.ANALYZE_MAX_BATCH_SIZE))
+
+
+# Each model loads eagerly, lazily on first use, or not at all, and is
+# only reported ready once its warmup pass has run
+fashion_slot = ModelSlot(
+    "fashion_model", load_fashion_model, config.FASHION_MODEL_LOAD,
+    warmup=warm_fashion_model if config.WARMUP_ENABLED else None
+)
+caption_slot = ModelSlot(
+    "caption_model", load_caption_model, config.CAPTION_MODEL_LOAD,
+    warmup=warmup_caption if config.WARMUP_ENABLED else None
+)
+model_slots = [fashion_slot, caption_slot]
+
+
+async def require_model(slot: ModelSlot):
+    """Make sure a route's model is ready, loading it first if it is lazy"""
+    try:
+        await slot.ensure()
+    except ModelNotReady as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "10"})
+
+
+def preload_models():
+    """
+    Load every eager model's weights in this process before workers fork
+    
+    Used by the pre-fork serving mode (see gunicorn_conf.py): forked workers
+    share the loaded weights and label embeddings copy-on-write instead of
+    each loading their own copy. Warmup is left to each worker, since kernel
+    and allocator state is per process.
+    """
+    # Keep the master single-threaded so no OpenMP pool exists when workers fork
+    torch.set_num_threads(1)
+    for slot in model_slots:
+        if slot.mode == "eager":
+            slot.load(warm=False)
+    if analysis_engine is not None:
+        analysis_engine.label_store.share_memory()
+
+
+def caption_batch(requests: List) -> List[Dict[str, str]]:
+    """Caption batch function for the caption batcher"""
+    BATCH_SIZE.observe(len(requests), batcher="caption")
+    with stage_timer("caption_generate"):
+        return caption_engine.caption_batch(requests)
+
+
 @app.on_event("startup")
 async def load_model():
-    """Load the Fashion-CLIP model on startup"""
-    global fashion_model, florence_model, florence_processor
-    try:
-        logger.info("Loading Fashion-CLIP model...")
-        fashion_model = FashionCLIP('fashion-clip')
-        logger.info("Fashion-CLIP model loaded successfully!")
-        
-        logger.info("Loading Florence-2 model for image captioning...")
-        florence_processor = AutoProcessor.from_pretrained("microsoft/Florence-2-base", trust_remote_code=True)
-        florence_model = AutoModelForCausalLM.from_pretrained(
-            "microsoft/Florence-2-base", 
-            trust_remote_code=True,
-            attn_implementation="eager"  # Use eager attention to avoid SDPA issues
+    """Start inference workers and begin loading eager models"""
+    global image_batcher, caption_batcher, model_loading_task, vocabulary_watcher
+    image_batcher = MicroBatcher(
+        encode_image_batch,
+        max_batch_size=config.ANALYZE_MAX_BATCH_SIZE,
+        max_wait_ms=config.ANALYZE_MAX_WAIT_MS,
+        executor=inference_executor,
+        name="image-batcher"
+    )
+    image_batcher.start()
+    
+    caption_batcher = MicroBatcher(
+        caption_batch,
+        max_batch_size=config.CAPTION_MAX_BATCH_SIZE,
+        max_wait_ms=config.CAPTION_MAX_WAIT_MS,
+        executor=caption_executor,
+        name="caption-batcher"
+    )
+    caption_batcher.start()
+    
+    # Eager models load in parallel in the background, so the server
+    # answers /health straight away and each route opens once its model is ready
+    model_loading_task = asyncio.create_task(load_eager(model_slots))
+    
+    # Every worker follows the vocabulary file, so an admin edit made
+    # through one worker reaches all of them
+    if config.VOCABULARY_FILE:
+        vocabulary_watcher = VocabularyWatcher(
+            config.VOCABULARY_FILE, apply_vocabularies, config.VOCABULARY_POLL_S
         )
-        
-        # Move to GPU if available
-        device = "cuda" if torch.cuda.is_available() else "cpu"
-        florence_model = florence_model.to(device)
-        logger.info(f"Florence-2 model loaded successfully on {device}!")
-        
-    except Exception as e:
-        logger.error(f"Failed to load model: {e}")
-        raise
+        vocabulary_watcher.start()
+
+
+@app.on_event("shutdown")
+async def stop_workers():
+    """Stop background inference workers"""
+    if vocabulary_watcher is not None:
+        await vocabulary_watcher.stop()
+    if image_batcher is not None:
+        await image_batcher.stop()
+    if caption_batcher is not None:
+        await caption_batcher.stop()
+    await shopping_client.close()
+    await image_fetcher.close()
+    inference_executor.shutdown(wait=False)
+    caption_executor.shutdown(wait=False)
+    store_executor.shutdown(wait=False)
 
 
 @app.get("/")
@@ -133,8 +392,14 @@ async def root():
         "status": "running",
         "endpoints": {
             "/analyze": "POST - Analyze fashion image",
+            "/analyze_url": "POST - Analyze fashion image by URL",
+            "/analyze_and_shop": "POST - Analyze fashion image and find matching products",
             "/analyseCaption": "POST - Generate image caption",
+            "/similar_products": "POST - Find seen products that look like an image",
             "/health": "GET - Health check",
+            "/metrics": "GET - Prometheus metrics",
+            "/categories": "GET - Current label vocabularies",
+            "/admin/vocabularies": "GET/PUT/POST/DELETE - Edit label vocabularies (admin token)",
             "/docs": "GET - API documentation"
         }
     }
@@ -142,14 +407,184 @@ async def root():
 
 @app.get("/health")
 async def health_check():
-    """Health check endpoint"""
-    model_status = "loaded" if fashion_model is not None else "not loaded"
-    florence_status = "loaded" if florence_model is not None else "not loaded"
+    """Health check endpoint with per-model readiness"""
     return {
         "status": "healthy",
-        "fashion_model": model_status,
-        "caption_model": florence_status
+        "ready": all(slot.ready for slot in model_slots if slot.mode != "disabled"),
+        "models": {slot.name: slot.status() for slot in model_slots},
+        "caches": {
+            "analysis": analysis_cache.stats(),
+            "caption": caption_cache.stats(),
+            "shopping": shopping_client.cache.stats(),
+            "url": image_fetcher.url_cache.stats(),
+            "prepared": prepared_cache.stats()
+        },
+        "coalescing": {
+            "model": inflight.stats(),
+            "shopping": shopping_client.inflight.stats()
+        },
+        "admission": {
+            "analyze": analyze_admission.stats(),
+            "caption": caption_admission.stats()
+        },
+        "vocabularies": vocabulary_info() if analysis_engine is not None else None,
+        "product_index": {"products": len(product_index)} if product_index is not None else None
+    }
+
+
+def collect_service_metrics():
+    """Scrape-time gauges and counters for state owned by other objects"""
+    batchers = [("image", image_batcher), ("caption", caption_batcher)]
+    admissions = [("analyze", analyze_admission), ("caption", caption_admission)]
+    yield gauge("sherlock_batcher_queue_depth", "Items waiting for a model batch", [
+        ("sherlock_batcher_queue_depth", {"batcher": name}, batcher.queue_depth)
+        for name, batcher in batchers if batcher is not None
+    ])
+    yield gauge("sherlock_admission_active", "Requests holding an admission slot", [
+        ("sherlock_admission_active", {"model": name}, controller.active)
+        for name, controller in admissions
+    ])
+    yield gauge("sherlock_admission_queued", "Requests waiting for an admission slot", [
+        ("sherlock_admission_queued", {"model": name}, controller.queued)
+        for name, controller in admissions
+    ])
+    yield counter_family("sherlock_admission_rejected_total", "Requests refused because the queue was full", [
+        ("sherlock_admission_rejected_total", {"model": name}, controller.rejected)
+        for name, controller in admissions
+    ])
+    
+    caches = {
+        "analysis": analysis_cache.stats(),
+        "caption": caption_cache.stats(),
+        "shopping": shopping_client.cache.stats(),
+        "url": image_fetcher.url_cache.stats(),
+        "prepared": prepared_cache.stats()
     }
+    for result in ("hits", "misses"):
+        yield counter_family(f"sherlock_cache_{result}_total", f"Cache {result}", [
+            (f"sherlock_cache_{result}_total", {"cache": name}, stats[result])
+            for name, stats in caches.items()
+        ])
+    yield gauge("sherlock_cache_hit_ratio", "Cache hits over lookups since start", [
+        ("sherlock_cache_hit_ratio", {"cache": name}, stats["hit_ratio"])
+        for name, stats in caches.items()
+    ])
+    yield gauge("sherlock_cache_size_bytes", "Approximate memory held by each cache", [
+        ("sherlock_cache_size_bytes", {"cache": name}, stats["size_mb"] * 1024 * 1024)
+        for name, stats in caches.items()
+    ])
+    
+    yield gauge("sherlock_model_ready", "1 when the model serves requests", [
+        ("sherlock_model_ready", {"model": slot.name}, int(slot.ready)) for slot in model_slots
+    ])
+    models = [("fashion_model", fashion_model), ("caption_model", florence_model)]
+    yield gauge("sherlock_model_parameter_bytes", "Memory held by model weights (torch engines only)", [
+        ("sherlock_model_parameter_bytes", {"model": name}, parameter_bytes(model))
+        for name, model in models if model is not None
+    ])
+    yield gauge("sherlock_process_resident_bytes", "Resident memory of this worker process", [
+        ("sherlock_process_resident_bytes", {}, process_resident_bytes())
+    ])
+
+
+REGISTRY.add_collector(collect_service_metrics)
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Prometheus metrics for this worker process"""
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+
+async def run_request(http_request: Request, fn: Callable[[], Awaitable[Any]], timeout: float) -> Any:
+    """
+    Run a route's work under its deadline, dropping it if the client disconnects
+    
+    Clients may shorten the deadline with an X-Request-Timeout-Ms header.
+    
+    Args:
+        http_request: Incoming request, watched for disconnects
+        fn: Zero-argument coroutine function doing the work
+        timeout: Route deadline in seconds
+        
+    Returns:
+        Whatever fn returns
+    """
+    requested = http_request.headers.get("x-request-timeout-ms")
+    if requested:
+        try:
+            timeout = min(timeout, max(0.0, float(requested) / 1000))
+        except ValueError:
+            raise HTTPException(status_code=400, detail="X-Request-Timeout-Ms must be a number")
+    return await run_with_deadline(fn, timeout, http_request.is_disconnected)
+
+
+def get_prepared(image_hash: str, contents: bytes) -> PreparedImage:
+    """
+    Shared decoded image for an upload
+    
+    The analysis and caption paths for the same image hash reuse one
+    PreparedImage, so the upload is decoded once at most per model size.
+    
+    Args:
+        image_hash: Content hash of the image bytes
+        contents: Raw image file bytes
+        
+    Returns:
+        PreparedImage for the upload
+    """
+    prepared = prepared_cache.get(image_hash)
+    if prepared is None:
+        prepared = PreparedImage(contents)
+        prepared_cache.put(image_hash, prepared, size=len(contents) + PREPARED_IMAGE_BYTES)
+    return prepared
+
+
+def encode_image_batch(pil_images: List[Image.Image]) -> List[np.ndarray]:
+    """
+    Encode a batch of images with Fashion-CLIP in one forward pass
+    
+    Args:
+        pil_images: List of PIL Image objects
+        
+    Returns:
+        One embedding vector per image, in input order
+    """
+    if analysis_engine is None:
+        raise HTTPException(status_code=503, detail="Model not loaded")
+    
+    BATCH_SIZE.observe(len(pil_images), batcher="image")
+    with stage_timer("encode"):
+        return list(analysis_engine.encode(pil_images))
+
+
+def score_image_embeddings(
+    image_embeds,
+    top_items: int = 10,
+    top_colors: int = 5,
+    top_styles: int = 5,
+    store: LabelEmbeddingStore = None
+) -> List[Dict]:
+    """
+    Rank items, colors, styles and extra attributes for a batch of image embeddings
+    
+    Args:
+        image_embeds: Image embeddings of shape (n_images, dim)
+        top_items: Number of top fashion items to return
+        top_colors: Number of top colors to return
+        top_styles: Number of top styles to return
+        store: Label store snapshot to score against (default: the current one)
+        
+    Returns:
+        One dictionary per image containing items, colors, styles and
+        one entry per extra vocabulary
+    """
+    if analysis_engine is None:
+        raise HTTPException(status_code=503, detail="Model not loaded")
+    
+    # Score against every precomputed label in one matmul
+    with stage_timer("score"):
+        return analysis_engine.score(image_embeds, top_items, top_colors, top_styles, store)
 
 
 def analyze_fashion_image(pil_image: Image.Image, top_items: int = 10, top_colors: int = 5, top_styles: int = 5) -> Dict:
@@ -165,76 +600,336 @@ def analyze_fashion_image(pil_image: Image.Image, top_items: int = 10, top_color
     Returns:
         Dictionary containing items, colors, and styles
     """
-    if fashion_model is None:
-        raise HTTPException(status_code=503, detail="Model not loaded")
+    with stage_timer("analyze"):
+        image_embeds = np.stack(encode_image_batch([pil_image]))
+        return score_image_embeddings(image_embeds, top_items, top_colors, top_styles)[0]
+
+
+async def get_image_embedding(image_hash: str, load_contents: Callable[[], Awaitable[bytes]]) -> np.ndarray:
+    """
+    Fashion-CLIP embedding for an image, from the store or a fresh encode
     
-    # Ensure RGB mode
-    if pil_image.mode != 'RGB':
-        pil_image = pil_image.convert('RGB')
+    Args:
+        image_hash: Content hash of the image bytes
+        load_contents: Coroutine function returning the raw image bytes,
+            only called when the embedding is not stored
+        
+    Returns:
+        Image embedding vector
+    """
+    # A stored embedding skips decoding and encoding; only scoring reruns
+    if embedding_store is not None:
+        image_embed = await store_executor.run(embedding_store.get, image_hash)
+        if image_embed is not None:
+            return image_embed
     
-    # Get image embeddings
-    image_embeds = fashion_model.encode_images([pil_image], batch_size=1)
+    contents = await load_contents()
+    prepared = get_prepared(image_hash, contents)
+    pil_image = await inference_executor.run(prepared.for_clip)
     
-    # Convert to torch if needed
-    if isinstance(image_embeds, np.ndarray):
-        image_embeds = torch.from_numpy(image_embeds)
+    # The embedding comes from a shared micro-batch
+    image_embed = await image_batcher.submit(pil_image)
+    if embedding_store is not None:
+        await store_executor.run(embedding_store.put, image_hash, image_embed)
+    return image_embed
+
+
+async def admitted_image_embedding(image_hash: str, load_contents: Callable[[], Awaitable[bytes]]) -> np.ndarray:
+    """
+    Image embedding under an analysis admission slot
     
-    # Normalize
-    image_embeds = image_embeds / image_embeds.norm(dim=-1, keepdim=True)
+    Concurrent requests for the same image share one embedding pass, and
+    only the request doing it takes a slot; the others just wait for it.
+    This is the only place an image embedding takes a slot, so a request
+    never holds one slot while waiting for another.
+    """
+    async def embed_admitted():
+        async with analyze_admission.slot():
+            # The store is checked again: the embedding may have been
+            # written while this request was queued
+            return await get_image_embedding(image_hash, load_contents)
     
-    results = {}
+    return await inflight.do(("embed", image_hash), embed_admitted)
+
+
+async def analyze_hashed(
+    image_hash: str,
+    load_contents: Callable[[], Awaitable[bytes]],
+    top_items: int = 10,
+    top_colors: int = 5,
+    top_styles: int = 5,
+    regions: Optional[str] = None
+) -> Dict:
+    """Analyze an image identified by its content hash; see analyze_embedded"""
+    results, _ = await analyze_embedded(image_hash, load_contents, top_items, top_colors, top_styles, regions)
+    return results
+
+
+async def analyze_embedded(
+    image_hash: str,
+    load_contents: Callable[[], Awaitable[bytes]],
+    top_items: int = 10,
+    top_colors: int = 5,
+    top_styles: int = 5,
+    regions: Optional[str] = None
+) -> Tuple[Dict, Optional[np.ndarray]]:
+    """
+    Analyze an image identified by its content hash, serving repeats from the cache
     
-    # Analyze fashion items
-    text_embeds = fashion_model.encode_text(CATEGORIES, batch_size=32)
-    if isinstance(text_embeds, np.ndarray):
-        text_embeds = torch.from_numpy(text_embeds)
+    Args:
+        image_hash: Content hash of the image bytes
+        load_contents: Coroutine function returning the raw image bytes,
+            only called when neither the result nor the embedding is cached
+        top_items: Number of top fashion items to return
+        top_colors: Number of top colors to return
+        top_styles: Number of top styles to return
+        regions: Region mode ("grid" or "detect") to also analyze garment
+            regions, or None for the whole image only
+        
+    Returns:
+        Tuple of the dictionary containing items, colors, and styles (plus
+        regions when requested) and the image embedding it was scored from,
+        or None when the result came from the cache
+    """
+    if regions:
+        # The whole image and the region crops usually share one forward
+        # pass; regions start first so the whole image can reuse their
+        # larger decode instead of decoding twice
+        region_list, (results, image_embed) = await asyncio.gather(
+            analyze_regions(image_hash, load_contents, regions, top_items, top_colors, top_styles),
+            analyze_embedded(image_hash, load_contents, top_items, top_colors, top_styles)
+        )
+        return {**results, "regions": region_list}, image_embed
     
-    text_embeds = text_embeds / text_embeds.norm(dim=-1, keepdim=True)
-    similarities = (image_embeds @ text_embeds.T).squeeze(0)
-    scores, indices = torch.topk(similarities, min(top_items, len(CATEGORIES)))
+    await require_model(fashion_slot)
     
-    results['items'] = [
-        {"name": CATEGORIES[idx], "confidence": float(score.item())}
-        for idx, score in zip(indices, scores)
-    ]
+    # Score against the store whose version is in the cache key, even if
+    # the vocabularies change while the image is being encoded
+    store = analysis_engine.label_store
+    cache_key = make_cache_key(
+        "analyze", image_hash, top_items, top_colors, top_styles, store.version
+    )
+    results = analysis_cache.get(cache_key)
+    if results is not None:
+        return results, None
     
-    # Analyze colors
-    color_embeds = fashion_model.encode_text(COLORS, batch_size=32)
-    if isinstance(color_embeds, np.ndarray):
-        color_embeds = torch.from_numpy(color_embeds)
+    # Only cache misses take an admission slot, inside the embedding flight
+    image_embed = await admitted_image_embedding(image_hash, load_contents)
     
-    color_embeds = color_embeds / color_embeds.norm(dim=-1, keepdim=True)
-    color_sims = (image_embeds @ color_embeds.T).squeeze(0)
-    color_scores, color_indices = torch.topk(color_sims, min(top_colors, len(COLORS)))
+    # Scoring is a single small matmul, so it stays on the loop rather
+    # than queueing behind long captions in the inference pool
+    results = score_image_embeddings(np.stack([image_embed]), top_items, top_colors, top_styles, store)[0]
     
-    results['colors'] = [
-        {"color": COLORS[idx], "confidence": float(score.item())}
-        for idx, score in zip(color_indices, color_scores)
-    ]
+    analysis_cache.put(cache_key, results)
+    return results, image_embed
+
+
+def detect_batch(images: List[Image.Image]) -> List[Dict]:
+    """Florence-2 object detection for a batch of images"""
+    with stage_timer("detect"):
+        return caption_engine.detect_objects(images)
+
+
+async def analyze_regions(
+    image_hash: str,
+    load_contents: Callable[[], Awaitable[bytes]],
+    mode: str,
+    top_items: int = 10,
+    top_colors: int = 5,
+    top_styles: int = 5
+) -> List[Dict]:
+    """
+    Analyze candidate garment regions of an image
     
-    # Analyze styles
-    style_embeds = fashion_model.encode_text(STYLES, batch_size=32)
-    if isinstance(style_embeds, np.ndarray):
-        style_embeds = torch.from_numpy(style_embeds)
+    Regions come from a fixed grid or from Florence-2 <OD> boxes. Crops are
+    cut from a decode at twice the Fashion-CLIP size (or the Florence-2
+    image the boxes were detected on), so a garment keeps enough pixels,
+    and all of them are submitted to the image batcher at once, so they
+    are encoded together in one forward pass rather than one pass each.
     
-    style_embeds = style_embeds / style_embeds.norm(dim=-1, keepdim=True)
-    style_sims = (image_embeds @ style_embeds.T).squeeze(0)
-    style_scores, style_indices = torch.topk(style_sims, min(top_styles, len(STYLES)))
+    Args:
+        image_hash: Content hash of the image bytes
+        load_contents: Coroutine function returning the raw image bytes
+        mode: "grid" or "detect"
+        top_items: Number of top fashion items to return per region
+        top_colors: Number of top colors to return per region
+        top_styles: Number of top styles to return per region
+        
+    Returns:
+        One dictionary per region with its normalised box, detector label
+        and analysis (items, colors, and styles)
+    """
+    await require_model(fashion_slot)
+    if mode == "detect":
+        await require_model(caption_slot)
     
-    results['styles'] = [
-        {"style": STYLES[idx], "confidence": float(score.item())}
-        for idx, score in zip(style_indices, style_scores)
-    ]
+    store = analysis_engine.label_store
+    cache_key = make_cache_key(
+        "regions", image_hash, mode, top_items, top_colors, top_styles, store.version
+    )
+    region_list = analysis_cache.get(cache_key)
+    if region_list is not None:
+        return region_list
     
-    return results
+    prepared = get_prepared(image_hash, await load_contents())
+    if mode == "detect":
+        # Detection is a Florence-2 generate call, so it queues with captions
+        image = await caption_executor.run(prepared.for_florence)
+        
+        async def detect_admitted():
+            async with caption_admission.slot():
+                return await caption_executor.run(detect_batch, [image])
+        
+        detections = await inflight.do(("detect", image_hash), detect_admitted)
+        boxes = detection_boxes(detections[0], image.width, image.height)
+    else:
+        image = await inference_executor.run(prepared.for_regions)
+        boxes = [(box, "") for box in grid_boxes()]
+    
+    region_list = []
+    if boxes:
+        crops = crop_regions(image, [box for box, _ in boxes])
+        async with analyze_admission.slot():
+            with stage_timer("regions"):
+                image_embeds = await asyncio.gather(*(image_batcher.submit(crop) for crop in crops))
+        analyses = score_image_embeddings(np.stack(image_embeds), top_items, top_colors, top_styles, store)
+        region_list = [
+            {"box": [round(v, 4) for v in box], "label": label, "analysis": analysis}
+            for (box, label), analysis in zip(boxes, analyses)
+        ]
+    
+    analysis_cache.put(cache_key, region_list)
+    return region_list
+
+
+UPLOAD_READ_CHUNK = 64 * 1024
+
+
+async def read_upload(file: UploadFile) -> bytes:
+    """
+    Read an uploaded file, refusing it before buffering more than MAX_UPLOAD_BYTES
+    
+    Raises:
+        ImageRejected: The file is larger than MAX_UPLOAD_BYTES (413)
+    """
+    limit = config.MAX_UPLOAD_BYTES
+    if file.size is not None:
+        # The multipart parser recorded the size, so one read is safe
+        if file.size > limit:
+            raise ImageRejected(f"Image file exceeds {limit} bytes")
+        with stage_timer("upload_read"):
+            return await file.read()
+    
+    # Otherwise read in chunks: read(limit + 1) would reserve the whole limit up front
+    chunks = []
+    size = 0
+    with stage_timer("upload_read"):
+        while True:
+            chunk = await file.read(UPLOAD_READ_CHUNK)
+            if not chunk:
+                break
+            size += len(chunk)
+            if size > limit:
+                raise ImageRejected(f"Image file exceeds {limit} bytes")
+            chunks.append(chunk)
+    return b"".join(chunks)
+
+
+# Smaller payloads hash in well under a millisecond, less than a thread hop
+INLINE_HASH_BYTES = 256 * 1024
+
+
+async def hash_contents(contents: bytes) -> str:
+    """
+    Content hash of image bytes, computed off the event loop for large payloads
+    
+    Hashing a multi-megabyte upload takes milliseconds of CPU; it runs on the
+    store I/O threads, where it does not queue behind model work and
+    hashlib releases the GIL.
+    """
+    if len(contents) <= INLINE_HASH_BYTES:
+        return hash_bytes(contents)
+    return await store_executor.run(hash_bytes, contents)
+
+
+async def upload_source(contents: bytes) -> Tuple[str, Callable[[], Awaitable[bytes]]]:
+    """Content hash and bytes loader for uploaded image bytes"""
+    async def load_contents():
+        return contents
+    
+    return await hash_contents(contents), load_contents
+
+
+async def url_source(url: str) -> Tuple[str, Callable[[], Awaitable[bytes]]]:
+    """Content hash and bytes loader for an image URL, downloading only if the URL is unknown"""
+    image_hash, contents = await image_fetcher.resolve(url)
+    
+    async def load_contents():
+        if contents is not None:
+            return contents
+        # Known URL whose result and embedding have both been evicted
+        _, downloaded = await image_fetcher.download(url)
+        return downloaded
+    
+    return image_hash, load_contents
+
+
+async def analyze_contents(
+    contents: bytes,
+    top_items: int = 10,
+    top_colors: int = 5,
+    top_styles: int = 5,
+    regions: Optional[str] = None
+) -> Dict:
+    """
+    Analyze uploaded image bytes, serving repeated images from the cache
+    
+    Args:
+        contents: Raw image file bytes
+        top_items: Number of top fashion items to return
+        top_colors: Number of top colors to return
+        top_styles: Number of top styles to return
+        regions: Optional region mode, see analyze_hashed
+        
+    Returns:
+        Dictionary containing items, colors, and styles
+    """
+    image_hash, load_contents = await upload_source(contents)
+    return await analyze_hashed(image_hash, load_contents, top_items, top_colors, top_styles, regions)
+
+
+async def analyze_url_source(
+    url: str,
+    top_items: int = 10,
+    top_colors: int = 5,
+    top_styles: int = 5,
+    regions: Optional[str] = None
+) -> Dict:
+    """
+    Analyze an image by URL, downloading it only when its content is unknown
+    
+    Args:
+        url: Image URL
+        top_items: Number of top fashion items to return
+        top_colors: Number of top colors to return
+        top_styles: Number of top styles to return
+        regions: Optional region mode, see analyze_hashed
+        
+    Returns:
+        Dictionary containing items, colors, and styles
+    """
+    image_hash, load_contents = await url_source(url)
+    return await analyze_hashed(image_hash, load_contents, top_items, top_colors, top_styles, regions)
 
 
 @app.post("/analyze", response_model=AnalysisResponse)
 async def analyze_image(
+    http_request: Request,
     file: UploadFile = File(...),
     top_items: int = 10,
     top_colors: int = 5,
-    top_styles: int = 5
+    top_styles: int = 5,
+    regions: str = None
 ):
     """
     Analyze a fashion image
@@ -244,6 +939,7 @@ async def analyze_image(
         top_items: Number of top fashion items to return (default: 10)
         top_colors: Number of top colors to return (default: 5)
         top_styles: Number of top styles to return (default: 5)
+        regions: Also analyze garment regions - "grid" or "detect" (Florence-2 boxes)
         
     Returns:
         JSON response with detected items, colors, and styles
@@ -251,15 +947,19 @@ async def analyze_image(
     # Validate file type
     if not file.content_type.startswith('image/'):
         raise HTTPException(status_code=400, detail="File must be an image")
+    check_region_mode(regions)
     
     try:
         # Read image
-        contents = await file.read()
-        pil_image = Image.open(io.BytesIO(contents))
+        contents = await read_upload(file)
         
         # Analyze
         logger.info(f"Analyzing image: {file.filename}")
-        results = analyze_fashion_image(pil_image, top_items, top_colors, top_styles)
+        results = await run_request(
+            http_request,
+            lambda: analyze_contents(contents, top_items, top_colors, top_styles, regions),
+            config.ANALYZE_DEADLINE_S
+        )
         
         logger.info(f"Analysis complete for {file.filename}")
         
@@ -268,76 +968,344 @@ async def analyze_image(
             items=[FashionItem(**item) for item in results['items']],
             colors=[ColorResult(**color) for color in results['colors']],
             styles=[StyleResult(**style) for style in results['styles']],
+            attributes=attribute_results(results),
+            regions=region_results(results),
             message="Analysis completed successfully"
         )
         
+    except ImageRejected as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    except AdmissionError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e), headers=e.headers)
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Analysis failed: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Analysis failed: {str(e)}")
 
 
+@app.post("/analyze_url", response_model=AnalysisResponse)
+async def analyze_image_url(request: ImageUrlRequest, http_request: Request):
+    """
+    Analyze a fashion image by URL
+    
+    The backend downloads the image itself, so clients do not have to
+    re-upload it. Repeated URLs are served from the caches without
+    downloading them again.
+    
+    Args:
+        request: Image URL and the same top_* options as /analyze
+        
+    Returns:
+        JSON response with detected items, colors, and styles
+    """
+    check_region_mode(request.regions)
+    try:
+        logger.info(f"Analyzing image URL: {request.url}")
+        results = await run_request(
+            http_request,
+            lambda: analyze_url_source(
+                request.url, request.top_items, request.top_colors, request.top_styles, request.regions
+            ),
+            config.ANALYZE_DEADLINE_S
+        )
+        
+        return AnalysisResponse(
+            success=True,
+            items=[FashionItem(**item) for item in results['items']],
+            colors=[ColorResult(**color) for color in results['colors']],
+            styles=[StyleResult(**style) for style in results['styles']],
+            attributes=attribute_results(results),
+            regions=region_results(results),
+            message="Analysis completed successfully"
+        )
+        
+    except (ImageFetchError, ImageRejected) as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    except AdmissionError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e), headers=e.headers)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Analysis failed: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Analysis failed: {str(e)}")
+
+
+def decoded_size(contents: bytes) -> int:
+    """
+    Upper bound on the memory a reduced-size decode for Fashion-CLIP takes,
+    read from the image header only; oversized images are rejected here
+    """
+    img = open_checked(contents)
+    # Draft decoding lands between 1x and 2x the target short side
+    scale = min(1.0, 2 * CLIP_INPUT_SIZE / min(img.width, img.height))
+    return int(img.width * img.height * 3 * scale * scale)
+
+
+def batch_result(index: int, filename: str, analysis: Dict = None, error: str = None) -> Dict:
+    """One /analyze/batch entry"""
+    if error is not None:
+        return {"index": index, "filename": filename, "success": False, "error": error}
+    return {
+        "index": index,
+        "filename": filename,
+        "success": True,
+        "items": analysis['items'],
+        "colors": analysis['colors'],
+        "styles": analysis['styles'],
+        "attributes": {
+            name: ranked for name, ranked in analysis.items()
+            if name not in CORE_VOCABULARIES and name not in RESERVED_NAMES
+        }
+    }
+
+
+async def iter_batch_analysis(
+    uploads: List[Tuple[str, bytes, str]],
+    top_items: int,
+    top_colors: int,
+    top_styles: int,
+    is_disconnected: Optional[Callable[[], Awaitable[bool]]] = None
+):
+    """
+    Analyze many images, yielding each result as soon as it is known
+    
+    Cached results come first, then images with a stored embedding, then
+    the rest in chunks: each chunk is decoded concurrently and encoded in
+    one batched forward pass. Chunks hold at most ANALYZE_BATCH_CHUNK_SIZE
+    images and ANALYZE_BATCH_CHUNK_MB of decoded pixels. Each chunk takes
+    an analysis admission slot and runs under ANALYZE_DEADLINE_S, so a
+    batch queues with single-image requests instead of bypassing them;
+    once the queue refuses a chunk, the remaining images get that error.
+    
+    Args:
+        uploads: (filename, contents, error) per file; error is set for
+            files that were rejected up front
+        top_items: Number of top fashion items to return
+        top_colors: Number of top colors to return
+        top_styles: Number of top styles to return
+        is_disconnected: Coroutine function reporting whether the client is gone
+        
+    Yields:
+        Result dictionaries tagged with the file's index
+    """
+    store = analysis_engine.label_store
+    
+    # Every upload is hashed in one trip to a worker thread
+    image_hashes = await store_executor.run(
+        lambda: [hash_bytes(contents) if error is None else None for _, contents, error in uploads]
+    )
+    
+    misses = []
+    for index, (filename, contents, error) in enumerate(uploads):
+        if error is not None:
+            yield batch_result(index, filename, error=error)
+            continue
+        
+        image_hash = image_hashes[index]
+        cache_key = make_cache_key(
+            "analyze", image_hash, top_items, top_colors, top_styles, store.version
+        )
+        analysis = analysis_cache.get(cache_key)
+        if analysis is not None:
+            yield batch_result(index, filename, analysis)
+            continue
+        
+        misses.append((index, filename, contents, image_hash, cache_key))
+    
+    # One trip to the store thread for every lookup in the batch
+    if embedding_store is not None and misses:
+        image_embeds = await store_executor.run(lambda: [embedding_store.get(entry[3]) for entry in misses])
+    else:
+        image_embeds = [None] * len(misses)
+    stored = [(entry, embed) for entry, embed in zip(misses, image_embeds) if embed is not None]
+    to_encode = [entry for entry, embed in zip(misses, image_embeds) if embed is None]
+    
+    def finish(entries, image_embeds):
+        analyses = score_image_embeddings(np.stack(image_embeds), top_items, top_colors, top_styles, store)
+        for (index, filename, _, _, cache_key), analysis in zip(entries, analyses):
+            analysis_cache.put(cache_key, analysis)
+            yield batch_result(index, filename, analysis)
+    
+    # Stored embeddings only need scoring
+    if stored:
+        for result in finish([entry for entry, _ in stored], [embed for _, embed in stored]):
+            yield result
+    
+    # Plan chunks by count and decoded size
+    chunks = []
+    chunk, chunk_bytes = [], 0
+    budget = config.ANALYZE_BATCH_CHUNK_MB * 1024 * 1024
+    for entry in to_encode:
+        try:
+            size = decoded_size(entry[2])
+        except Exception as e:
+            yield batch_result(entry[0], entry[1], error=str(e))
+            continue
+        if chunk and (len(chunk) >= config.ANALYZE_BATCH_CHUNK_SIZE or chunk_bytes + size > budget):
+            chunks.append(chunk)
+            chunk, chunk_bytes = [], 0
+        chunk.append(entry)
+        chunk_bytes += size
+    if chunk:
+        chunks.append(chunk)
+    
+    async def encode_chunk(chunk):
+        async with analyze_admission.slot():
+            images = await asyncio.gather(
+                *(inference_executor.run(PreparedImage(entry[2]).for_clip) for entry in chunk),
+                return_exceptions=True
+            )
+            decoded = [image for image in images if not isinstance(image, Exception)]
+            image_embeds = await inference_executor.run(encode_image_batch, decoded) if decoded else []
+        return images, image_embeds
+    
+    refused = None
+    for chunk in chunks:
+        if refused is not None:
+            for entry in chunk:
+                yield batch_result(entry[0], entry[1], error=str(refused))
+            continue
+        
+        try:
+            images, image_embeds = await run_with_deadline(
+                lambda: encode_chunk(chunk), config.ANALYZE_DEADLINE_S, is_disconnected
+            )
+        except ClientDisconnected:
+            return
+        except Exception as e:
+            if isinstance(e, AdmissionError):
+                refused = e
+            for entry in chunk:
+                yield batch_result(entry[0], entry[1], error=str(e))
+            continue
+        
+        decoded = []
+        for entry, image in zip(chunk, images):
+            if isinstance(image, Exception):
+                yield batch_result(entry[0], entry[1], error=str(image))
+            else:
+                decoded.append(entry)
+        if not decoded:
+            continue
+        
+        entries = decoded
+        if embedding_store is not None:
+            def put_all(entries=entries, image_embeds=image_embeds):
+                for (_, _, _, image_hash, _), image_embed in zip(entries, image_embeds):
+                    embedding_store.put(image_hash, image_embed)
+            
+            await store_executor.run(put_all)
+        for result in finish(entries, image_embeds):
+            yield result
+
+
 @app.post("/analyze/batch")
-async def analyze_batch(files: List[UploadFile] = File(...)):
+async def analyze_batch(
+    http_request: Request,
+    files: List[UploadFile] = File(...),
+    top_items: int = 10,
+    top_colors: int = 5,
+    top_styles: int = 5,
+    stream: bool = False
+):
     """
     Analyze multiple fashion images
     
     Args:
         files: List of image files
+        top_items: Number of top fashion items to return (default: 10)
+        top_colors: Number of top colors to return (default: 5)
+        top_styles: Number of top styles to return (default: 5)
+        stream: Return NDJSON, one line per image as soon as it finishes
         
     Returns:
-        JSON response with analysis for each image
+        JSON response with analysis for each image, in upload order, or an
+        NDJSON stream in completion order when stream is set
     """
-    if len(files) > 10:
-        raise HTTPException(status_code=400, detail="Maximum 10 images allowed per batch")
+    if len(files) > config.ANALYZE_BATCH_MAX_FILES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Maximum {config.ANALYZE_BATCH_MAX_FILES} images allowed per batch"
+        )
     
-    results = []
+    await require_model(fashion_slot)
     
+    # Read everything up front; upload files are closed once the handler
+    # returns. Each file is capped on its own and the batch as a whole.
+    budget = int(config.ANALYZE_BATCH_MAX_MB * 1024 * 1024)
+    total = 0
+    uploads = []
     for file in files:
         if not file.content_type.startswith('image/'):
-            results.append({
-                "filename": file.filename,
-                "success": False,
-                "error": "Not an image file"
-            })
+            uploads.append((file.filename, None, "Not an image file"))
             continue
-        
         try:
-            contents = await file.read()
-            pil_image = Image.open(io.BytesIO(contents))
-            
-            analysis = analyze_fashion_image(pil_image)
-            
-            results.append({
-                "filename": file.filename,
-                "success": True,
-                "items": analysis['items'],
-                "colors": analysis['colors'],
-                "styles": analysis['styles']
-            })
-            
-        except Exception as e:
-            results.append({
-                "filename": file.filename,
-                "success": False,
-                "error": str(e)
-            })
+            contents = await read_upload(file)
+        except ImageRejected as e:
+            uploads.append((file.filename, None, str(e)))
+            continue
+        total += len(contents)
+        if total > budget:
+            raise HTTPException(
+                status_code=413,
+                detail=f"Batch exceeds {config.ANALYZE_BATCH_MAX_MB:g} MB of uploads"
+            )
+        uploads.append((file.filename, contents, None))
+    
+    logger.info(f"Analyzing batch of {len(uploads)} images")
+    results = iter_batch_analysis(
+        uploads, top_items, top_colors, top_styles, http_request.is_disconnected
+    )
     
-    return {"results": results}
+    if stream:
+        async def ndjson():
+            async for result in results:
+                yield json.dumps(result) + "\n"
+        return StreamingResponse(ndjson(), media_type="application/x-ndjson")
+    
+    ordered = [None] * len(uploads)
+    async for result in results:
+        ordered[result["index"]] = result
+    return {"results": ordered}
+
+
+async def generate_captions(image_hash: str, contents: bytes, preset: str) -> Dict[str, str]:
+    """
+    Caption uploaded image bytes with Florence-2
+    
+    Args:
+        image_hash: Content hash of the image bytes
+        contents: Raw image file bytes
+        preset: Decoding preset name
+        
+    Returns:
+        Mapping of caption task token to caption text
+    """
+    prepared = get_prepared(image_hash, contents)
+    pil_image = await caption_executor.run(prepared.for_florence)
+    
+    # Both caption tasks, and captions for concurrent requests, share one generate call
+    return await caption_batcher.submit((pil_image, preset))
 
 
 @app.post("/analyseCaption", response_model=CaptionResponse)
-async def analyze_caption(file: UploadFile = File(...)):
+async def analyze_caption(http_request: Request, file: UploadFile = File(...), preset: str = None):
     """
     Generate a caption for the image using Florence-2
     
     Args:
         file: Image file (jpg, png, etc.)
+        preset: Decoding preset - "fast", "quality" or "short" (default: CAPTION_PRESET)
         
     Returns:
         JSON response with generated caption and detailed caption
     """
-    if florence_model is None or florence_processor is None:
-        raise HTTPException(status_code=503, detail="Caption model not loaded")
+    await require_model(caption_slot)
+    
+    preset = preset or config.CAPTION_PRESET
+    if preset not in DECODING_PRESETS:
+        raise HTTPException(status_code=400, detail=f"Unknown preset, expected one of: {', '.join(DECODING_PRESETS)}")
     
     # Validate file type
     if not file.content_type.startswith('image/'):
@@ -345,56 +1313,42 @@ async def analyze_caption(file: UploadFile = File(...)):
     
     try:
         # Read image
-        contents = await file.read()
-        pil_image = Image.open(io.BytesIO(contents))
-        
-        # Ensure RGB mode
-        if pil_image.mode != 'RGB':
-            pil_image = pil_image.convert('RGB')
-        
-        logger.info(f"Generating caption for image: {file.filename}, size: {pil_image.size}")
-        
-        device = "cuda" if torch.cuda.is_available() else "cpu"
+        contents = await read_upload(file)
         
-        # Generate simple caption
-        prompt = "<CAPTION>"
-        inputs = florence_processor(text=prompt, images=pil_image, return_tensors="pt")
-        
-        # Move all inputs to device
-        inputs = {k: v.to(device) for k, v in inputs.items()}
-        
-        logger.info(f"Generating caption...")
-        generated_ids = florence_model.generate(
-            **inputs,
-            max_new_tokens=1024,
-            num_beams=3
-        )
-        generated_text = florence_processor.batch_decode(generated_ids, skip_special_tokens=False)[0]
-        caption = florence_processor.post_process_generation(generated_text, task=prompt, image_size=(pil_image.width, pil_image.height))
-        
-        # Generate detailed caption
-        detailed_prompt = "<DETAILED_CAPTION>"
-        inputs_detailed = florence_processor(text=detailed_prompt, images=pil_image, return_tensors="pt")
-        inputs_detailed = {k: v.to(device) for k, v in inputs_detailed.items()}
-        
-        logger.info(f"Generating detailed caption...")
-        generated_ids_detailed = florence_model.generate(
-            **inputs_detailed,
-            max_new_tokens=1024,
-            num_beams=3
-        )
-        generated_text_detailed = florence_processor.batch_decode(generated_ids_detailed, skip_special_tokens=False)[0]
-        detailed_caption = florence_processor.post_process_generation(generated_text_detailed, task=detailed_prompt, image_size=(pil_image.width, pil_image.height))
+        image_hash = await hash_contents(contents)
+        cache_key = make_cache_key("caption", image_hash, preset)
+        captions = caption_cache.get(cache_key)
+        if captions is None:
+            logger.info(f"Generating caption for image: {file.filename}")
+            
+            async def caption_admitted():
+                # Only the request generating the captions holds a slot
+                async with caption_admission.slot():
+                    captions = caption_cache.get(cache_key)
+                    if captions is None:
+                        captions = await generate_captions(image_hash, contents, preset)
+                        caption_cache.put(cache_key, captions)
+                    return captions
+            
+            captions = await run_request(
+                http_request, lambda: inflight.do(cache_key, caption_admitted), config.CAPTION_DEADLINE_S
+            )
         
         logger.info(f"Caption generation complete for {file.filename}")
         
         return CaptionResponse(
             success=True,
-            caption=caption.get("<CAPTION>", ""),
-            detailed_caption=detailed_caption.get("<DETAILED_CAPTION>", ""),
+            caption=captions["<CAPTION>"],
+            detailed_caption=captions["<DETAILED_CAPTION>"],
             message="Caption generated successfully"
         )
         
+    except ImageRejected as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    except AdmissionError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e), headers=e.headers)
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Caption generation failed: {str(e)}")
         import traceback
@@ -403,20 +1357,432 @@ async def analyze_caption(file: UploadFile = File(...)):
 
 @app.get("/get_shopping")
 async def get_shopping_request(query: str):
-    print(query)
-    res = make_shopping_request(query)
-    return (res.json())
+    """Find products matching the query, served from cache when possible"""
+    logger.info(f"Shopping query: {query}")
+    try:
+        return await shopping_client.search(query)
+    except httpx.TimeoutException:
+        raise HTTPException(status_code=504, detail="Shopping search timed out")
+    except httpx.HTTPError as e:
+        raise HTTPException(status_code=502, detail=f"Shopping search failed: {str(e)}")
+
+async def fetch_thumbnail(product: Dict) -> Optional[Tuple[str, Optional[bytes], Optional[np.ndarray]]]:
+    """
+    Content hash and bytes of a shopping result's thumbnail, or its stored embedding
+    
+    Thumbnails are inline data: URIs or URLs; either way they are keyed on
+    their content hash, and one already in the product index is not
+    downloaded or embedded again.
+    
+    Returns:
+        Tuple of (content hash, image bytes, stored embedding) with exactly
+        one of the last two set, or None if the result has no thumbnail
+    """
+    thumbnail = product.get("thumbnail")
+    if not thumbnail:
+        return None
+    if thumbnail.startswith("data:"):
+        contents = decode_data_uri(thumbnail)
+        key = await hash_contents(contents)
+    else:
+        key, contents = await image_fetcher.resolve(thumbnail)
+    
+    if product_index is not None:
+        image_embed = await store_executor.run(product_index.get, key)
+        if image_embed is not None:
+            return key, None, image_embed
+    
+    if contents is None:
+        _, contents = await image_fetcher.download(thumbnail)
+    return key, contents, None
+
+
+async def embed_thumbnails(contents: List[bytes]) -> List[Optional[np.ndarray]]:
+    """
+    Fashion-CLIP embeddings of thumbnail bytes under one analysis admission slot
+    
+    Returns:
+        One embedding per thumbnail, None for thumbnails that do not decode
+    """
+    async with analyze_admission.slot():
+        images = await asyncio.gather(
+            *(inference_executor.run(PreparedImage(data).for_clip) for data in contents),
+            return_exceptions=True
+        )
+        decoded = [image for image in images if not isinstance(image, Exception)]
+        # Submitted together, so they share micro-batches
+        embeds = iter(await asyncio.gather(*(image_batcher.submit(image) for image in decoded)))
+    return [None if isinstance(image, Exception) else next(embeds) for image in images]
+
+
+async def rerank_visually(image_embed: np.ndarray, products: List[Dict]) -> List[Dict]:
+    """
+    Order shopping results by how much their thumbnail looks like the query image
+    
+    Thumbnails are fetched concurrently without holding an admission slot,
+    since that time is spent waiting on shopping CDNs; only the Fashion-CLIP
+    pass over the new ones takes a slot. Results whose thumbnail is
+    missing, broken or slower than VISUAL_RERANK_TIMEOUT_S keep their
+    original order after the ranked ones, as do all new thumbnails when
+    the model is too busy to embed them.
+    
+    Args:
+        image_embed: Fashion-CLIP embedding of the query image
+        products: Shopping results in the scraper's order
+        
+    Returns:
+        Copies of the results, with visual_similarity where known, most similar first
+    """
+    async def fetch(product):
+        try:
+            return await asyncio.wait_for(fetch_thumbnail(product), config.VISUAL_RERANK_TIMEOUT_S)
+        except (asyncio.TimeoutError, ImageFetchError) as e:
+            logger.warning(f"Skipping thumbnail of {product.get('title', 'shopping result')}: {str(e) or 'timed out'}")
+            return None
+    
+    with stage_timer("visual_rerank"):
+        fetched = await asyncio.gather(*(fetch(product) for product in products))
+        thumbnail_embeds = [entry[2] if entry is not None else None for entry in fetched]
+        
+        new = [i for i, entry in enumerate(fetched) if entry is not None and entry[2] is None]
+        if new:
+            try:
+                embeds = await embed_thumbnails([fetched[i][1] for i in new])
+            except AdmissionError as e:
+                logger.warning(f"Skipping {len(new)} new thumbnails: {str(e)}")
+                embeds = [None] * len(new)
+            
+            indexed = []
+            for i, embed in zip(new, embeds):
+                thumbnail_embeds[i] = embed
+                if embed is not None:
+                    indexed.append((fetched[i][0], embed, products[i]))
+            if product_index is not None and indexed:
+                await store_executor.run(lambda: [product_index.add(*entry) for entry in indexed])
+    
+    query = image_embed / max(np.linalg.norm(image_embed), 1e-12)
+    ranked = []
+    for product, thumbnail_embed in zip(products, thumbnail_embeds):
+        product = dict(product)
+        if thumbnail_embed is not None:
+            norm = max(np.linalg.norm(thumbnail_embed), 1e-12)
+            product["visual_similarity"] = float(query @ thumbnail_embed / norm)
+        ranked.append(product)
+    # Stable sort: results without a similarity keep their order at the end
+    return sorted(ranked, key=lambda product: -product.get("visual_similarity", float("-inf")))
+
+
+@app.post("/similar_products")
+async def similar_products(
+    http_request: Request,
+    file: UploadFile = File(None),
+    url: str = Form(None),
+    k: int = 10
+):
+    """
+    Find previously seen products that look like an image
+    
+    Searches the product index, which holds every shopping-result thumbnail
+    embedded for visual re-ranking so far.
+    
+    Args:
+        file: Image file (jpg, png, etc.), or
+        url: Image URL for the backend to fetch
+        k: Number of products to return (default: 10)
+        
+    Returns:
+        Products with their visual_similarity, most similar first
+    """
+    if file is None and not url:
+        raise HTTPException(status_code=400, detail="Provide an image file or url")
+    if file is not None and not file.content_type.startswith('image/'):
+        raise HTTPException(status_code=400, detail="File must be an image")
+    await require_model(fashion_slot)
+    if product_index is None:
+        raise HTTPException(status_code=503, detail="Product index disabled (set PRODUCT_INDEX_DIR)")
+    
+    try:
+        if file is not None:
+            contents = await read_upload(file)
+            source = lambda: upload_source(contents)
+        else:
+            source = lambda: url_source(url)
+        
+        async def embed_then_search():
+            image_hash, load_contents = await source()
+            image_embed = await admitted_image_embedding(image_hash, load_contents)
+            return await inference_executor.run(product_index.search, image_embed, k)
+        
+        matches = await run_request(http_request, embed_then_search, config.ANALYZE_DEADLINE_S)
+        return {
+            "success": True,
+            "products": [dict(product, visual_similarity=score) for product, score in matches]
+        }
+        
+    except (ImageFetchError, ImageRejected) as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    except AdmissionError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e), headers=e.headers)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Similar products search failed: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Similar products search failed: {str(e)}")
+
+
+@app.post("/analyze_and_shop", response_model=AnalyzeAndShopResponse)
+async def analyze_and_shop(
+    http_request: Request,
+    file: UploadFile = File(None),
+    url: str = Form(None),
+    top_items: int = 10,
+    top_colors: int = 5,
+    top_styles: int = 5,
+    max_results: int = 10,
+    regions: str = None,
+    sort: str = "price"
+):
+    """
+    Analyze a fashion image and find matching products in one call
+    
+    Args:
+        file: Image file (jpg, png, etc.), or
+        url: Image URL for the backend to fetch
+        top_items: Number of top fashion items to return (default: 10)
+        top_colors: Number of top colors to return (default: 5)
+        top_styles: Number of top styles to return (default: 5)
+        max_results: Number of shopping results to return (default: 10)
+        regions: Also analyze garment regions ("grid" or "detect") and search
+            products for each one
+        sort: "price" (default) or "visual" to order results by how much
+            their thumbnail looks like the image
+        
+    Returns:
+        Analysis response plus the shopping query and its results, sorted by
+        price or visual similarity
+    """
+    if file is None and not url:
+        raise HTTPException(status_code=400, detail="Provide an image file or url")
+    if file is not None and not file.content_type.startswith('image/'):
+        raise HTTPException(status_code=400, detail="File must be an image")
+    check_region_mode(regions)
+    if sort not in SORT_ORDERS:
+        raise HTTPException(status_code=400, detail=f"Unknown sort, expected one of: {', '.join(SORT_ORDERS)}")
+    
+    try:
+        if file is not None:
+            contents = await read_upload(file)
+            logger.info(f"Analyzing image for shopping: {file.filename}")
+            source = lambda: upload_source(contents)
+        else:
+            logger.info(f"Analyzing image URL for shopping: {url}")
+            source = lambda: url_source(url)
+        
+        # The query only needs the top item and color, so the lookup starts
+        # straight from the analysis without a client round trip
+        async def analyze_then_search():
+            image_hash, load_contents = await source()
+            results, image_embed = await analyze_embedded(
+                image_hash, load_contents, top_items, top_colors, top_styles, regions
+            )
+            query = build_shopping_query(results)
+            
+            # One search per region, run together with the main one; repeated
+            # queries are shared by the shopping client's cache and coalescing
+            region_list = [
+                dict(region, query=build_shopping_query(region['analysis'])) for region in results.get('regions', [])
+            ]
+            searches = await asyncio.gather(
+                shopping_client.search(query),
+                *(shopping_client.search(region['query']) for region in region_list)
+            )
+            for region, found in zip(region_list, searches[1:]):
+                region['shopping_results'] = sort_by_price(found.get("shopping_results", [])[:max_results])
+            if region_list:
+                results = {**results, "regions": region_list}
+            
+            found = searches[0].get("shopping_results", [])
+            if sort == "visual":
+                # Reuse the embedding the analysis was scored from; only a
+                # cached analysis needs it looked up (usually in the store)
+                if image_embed is None:
+                    image_embed = await admitted_image_embedding(image_hash, load_contents)
+                candidates = found[:max(max_results, config.VISUAL_RERANK_CANDIDATES)]
+                return results, query, (await rerank_visually(image_embed, candidates))[:max_results]
+            return results, query, sort_by_price(found[:max_results])
+        
+        results, query, shopping_results = await run_request(
+            http_request, analyze_then_search, config.ANALYZE_DEADLINE_S
+        )
+        
+        return AnalyzeAndShopResponse(
+            success=True,
+            items=[FashionItem(**item) for item in results['items']],
+            colors=[ColorResult(**color) for color in results['colors']],
+            styles=[StyleResult(**style) for style in results['styles']],
+            attributes=attribute_results(results),
+            regions=region_results(results),
+            query=query,
+            shopping_results=shopping_results,
+            message="Analysis and shopping search completed successfully"
+        )
+        
+    except (ImageFetchError, ImageRejected) as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    except AdmissionError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e), headers=e.headers)
+    except httpx.TimeoutException:
+        raise HTTPException(status_code=504, detail="Shopping search timed out")
+    except httpx.HTTPError as e:
+        raise HTTPException(status_code=502, detail=f"Shopping search failed: {str(e)}")
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Analyze and shop failed: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Analyze and shop failed: {str(e)}")
+
 
 @app.get("/categories")
 async def get_categories():
-    """Get available fashion categories"""
+    """Get available fashion categories, plus any extra vocabularies"""
+    vocabularies = analysis_engine.vocabularies if analysis_engine is not None else initial_vocabularies()
     return {
-        "items": CATEGORIES,
-        "colors": COLORS,
-        "styles": STYLES
+        "items": vocabularies["items"],
+        "colors": vocabularies["colors"],
+        "styles": vocabularies["styles"],
+        "attributes": {name: labels for name, labels in vocabularies.items() if name not in CORE_VOCABULARIES},
+        "version": analysis_engine.version if analysis_engine is not None else None
     }
 
 
+def vocabulary_info() -> Dict[str, Any]:
+    """Version and size of the label set currently in use"""
+    store = analysis_engine.label_store
+    return {
+        "version": store.version,
+        "generation": store.generation,
+        "labels": store.size,
+        "last_encoded": store.encoded,
+        "prompt_ensemble": store.templates is not None,
+        "vocabularies": {name: len(labels) for name, labels in store.vocabularies.items()}
+    }
+
+
+async def apply_vocabularies(vocabularies: Dict[str, List[str]], persist: bool = False) -> bool:
+    """
+    Switch the analysis engine to new vocabularies
+    
+    Only labels the engine has not embedded before are encoded, in the
+    inference pool; the new label store is then swapped in atomically.
+    Cached results stay valid for the old version and simply stop being hit.
+    
+    Args:
+        vocabularies: Complete, validated mapping of vocabulary name to labels
+        persist: Also write VOCABULARY_FILE, so other workers follow
+        
+    Returns:
+        False while the model is still loading. The load may already have
+        read an older file, so the watcher offers the change again later.
+    """
+    if analysis_engine is None:
+        if persist and config.VOCABULARY_FILE:
+            save_vocabulary_file(config.VOCABULARY_FILE, vocabularies)
+        return False
+    
+    async with vocabulary_lock:
+        await swap_vocabularies(vocabularies, persist)
+    return True
+
+
+async def swap_vocabularies(vocabularies: Dict[str, List[str]], persist: bool):
+    """Body of apply_vocabularies; the caller holds vocabulary_lock"""
+    if vocabularies != analysis_engine.vocabularies:
+        store = await inference_executor.run(analysis_engine.update_vocabularies, vocabularies)
+        logger.info(
+            f"Vocabularies updated to version {store.version} "
+            f"({store.size} labels, {store.encoded} newly encoded)"
+        )
+    if persist and config.VOCABULARY_FILE:
+        save_vocabulary_file(config.VOCABULARY_FILE, vocabularies)
+
+
+async def require_admin(token: str):
+    """Admin routes need ADMIN_TOKEN configured and sent in X-Admin-Token"""
+    if not config.ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Admin API disabled (set ADMIN_TOKEN)")
+    if not hmac.compare_digest(token or "", config.ADMIN_TOKEN):
+        raise HTTPException(status_code=401, detail="Invalid admin token")
+    await require_model(fashion_slot)
+
+
+async def edit_vocabularies(edit: Callable[[Dict[str, List[str]]], None]) -> Dict[str, Any]:
+    """
+    Apply an edit to a copy of the current vocabularies, validate, swap in and persist it
+    
+    The whole read-modify-write runs under vocabulary_lock, so concurrent
+    edits apply one after another instead of overwriting each other.
+    """
+    async with vocabulary_lock:
+        vocabularies = {name: list(labels) for name, labels in analysis_engine.vocabularies.items()}
+        edit(vocabularies)
+        try:
+            vocabularies = validate_vocabularies(vocabularies)
+        except VocabularyError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        await swap_vocabularies(vocabularies, persist=True)
+        return vocabulary_info()
+
+
+@app.get("/admin/vocabularies")
+async def get_vocabularies(x_admin_token: str = Header(None)):
+    """Current vocabularies with their version"""
+    await require_admin(x_admin_token)
+    return {**vocabulary_info(), "labels": analysis_engine.vocabularies}
+
+
+@app.put("/admin/vocabularies")
+async def replace_vocabularies(vocabularies: Dict[str, List[str]], x_admin_token: str = Header(None)):
+    """Replace the whole label set; labels already embedded are reused"""
+    await require_admin(x_admin_token)
+    
+    def replace(current):
+        current.clear()
+        current.update(vocabularies)
+    
+    return await edit_vocabularies(replace)
+
+
+@app.post("/admin/vocabularies/{name}")
+async def edit_vocabulary(name: str, edit: LabelEdit, x_admin_token: str = Header(None)):
+    """Add and remove labels in one vocabulary, creating it if it does not exist"""
+    await require_admin(x_admin_token)
+    
+    def apply(current):
+        removed = set(edit.remove)
+        labels = [label for label in current.get(name, []) if label not in removed]
+        current[name] = labels + [label for label in edit.add if label not in removed]
+    
+    return await edit_vocabularies(apply)
+
+
+@app.delete("/admin/vocabularies/{name}")
+async def delete_vocabulary(name: str, x_admin_token: str = Header(None)):
+    """Remove a whole vocabulary; the core ones cannot be removed"""
+    await require_admin(x_admin_token)
+    
+    def delete(current):
+        if name not in current:
+            raise HTTPException(status_code=404, detail=f"Unknown vocabulary: {name}")
+        del current[name]
+    
+    return await edit_vocabularies(delete)
+
+
+# Pre-fork serving loads weights once in the master process
+if config.PRELOAD_MODELS:
+    preload_models()
+
+
 if __name__ == "__main__":
     import uvicorn
     
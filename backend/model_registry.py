@@ -0,0 +1,156 @@
+"""
+Per-model loading lifecycle
+Each model can be loaded eagerly at startup, lazily on first use, or disabled
+"""
+
+from typing import Any, Callable, Dict, Iterable, Optional
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+LOAD_MODES = ("eager", "lazy", "disabled")
+
+
+class ModelNotReady(Exception):
+    """Raised when a route needs a model that is disabled, loading or failed"""
+
+
+class ModelSlot:
+    """
+    A model together with its load mode and readiness state
+
+    States: "disabled", "pending" (not loaded yet), "loading", "loaded"
+    (weights in memory, not yet warmed up), "warming" (running the
+    optional warmup pass), "ready" and "failed". Eager slots
+    are loaded in the background at startup and refuse requests until
+    ready; lazy slots load on the first request that needs them, and
+    concurrent first requests wait on the same load.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        loader: Callable[[], Any],
+        mode: str = "eager",
+        warmup: Optional[Callable[[Any], None]] = None
+    ):
+        """
+        Args:
+            name: Model name reported by /health
+            loader: Blocking function that loads the model and returns it
+            mode: "eager", "lazy" or "disabled"
+            warmup: Optional blocking function run on the loaded model
+                before the slot reports ready
+        """
+        if mode not in LOAD_MODES:
+            raise ValueError(f"Unknown load mode for {name}: {mode}, expected one of {LOAD_MODES}")
+        self.name = name
+        self.loader = loader
+        self.mode = mode
+        self.warmup = warmup
+        self.state = "disabled" if mode == "disabled" else "pending"
+        self.value: Any = None
+        self.error: Optional[str] = None
+        self.load_seconds: Optional[float] = None
+        self.warmup_seconds: Optional[float] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def ready(self) -> bool:
+        return self.state == "ready"
+
+    def load(self, warm: bool = True) -> Any:
+        """
+        Load the model in the calling thread
+
+        Args:
+            warm: Run the warmup pass and mark the slot ready. Pass False
+                to only load weights (state "loaded"), e.g. in a pre-fork
+                master whose workers warm up on their own.
+        """
+        if self.mode == "disabled":
+            raise ModelNotReady(f"{self.name} is disabled")
+        if self.ready:
+            return self.value
+
+        if self.value is None:
+            self.state = "loading"
+            start = time.perf_counter()
+            try:
+                self.value = self.loader()
+            except Exception as e:
+                self.state = "failed"
+                self.error = str(e)
+                logger.error(f"Failed to load {self.name}: {e}")
+                raise
+            self.load_seconds = round(time.perf_counter() - start, 2)
+
+        if not warm:
+            self.state = "loaded"
+            return self.value
+
+        if self.warmup is not None:
+            self.state = "warming"
+            start = time.perf_counter()
+            try:
+                self.warmup(self.value)
+            except Exception as e:
+                # Warmup only affects latency; a cold model still serves correctly
+                logger.error(f"Warmup of {self.name} failed: {e}")
+            self.warmup_seconds = round(time.perf_counter() - start, 2)
+
+        self.state = "ready"
+        self.error = None
+        logger.info(f"{self.name} ready in {self.load_seconds}s (warmup {self.warmup_seconds}s)")
+        return self.value
+
+    async def load_async(self, executor=None) -> Any:
+        """Load the model off the event loop, sharing one load between callers"""
+        if self.ready:
+            return self.value
+        if self._task is None or self._task.done():
+            loop = asyncio.get_running_loop()
+            self._task = asyncio.ensure_future(loop.run_in_executor(executor, self.load))
+        return await asyncio.shield(self._task)
+
+    async def ensure(self, executor=None) -> Any:
+        """
+        Return the loaded model, loading it now if the slot is lazy
+
+        Raises:
+            ModelNotReady: The slot is disabled, an eager load is still in
+                progress, or loading failed
+        """
+        if self.ready:
+            return self.value
+        if self.mode == "disabled":
+            raise ModelNotReady(f"{self.name} is disabled on this server")
+        if self.mode == "eager":
+            if self.state == "failed":
+                raise ModelNotReady(f"{self.name} failed to load: {self.error}")
+            raise ModelNotReady(f"{self.name} is not ready yet ({self.state})")
+        try:
+            return await self.load_async(executor)
+        except ModelNotReady:
+            raise
+        except Exception as e:
+            raise ModelNotReady(f"{self.name} failed to load: {e}")
+
+    def status(self) -> Dict:
+        return {
+            "state": self.state,
+            "mode": self.mode,
+            "load_seconds": self.load_seconds,
+            "warmup_seconds": self.warmup_seconds,
+            "error": self.error
+        }
+
+
+async def load_eager(slots: Iterable[ModelSlot], executor=None):
+    """Load every eager slot in parallel; failures are recorded on the slot"""
+    eager = [slot for slot in slots if slot.mode == "eager"]
+    results = await asyncio.gather(*(slot.load_async(executor) for slot in eager), return_exceptions=True)
+    loaded = sum(1 for result in results if not isinstance(result, Exception))
+    logger.info(f"Eager model loading finished: {loaded}/{len(eager)} ready")
@@ -0,0 +1,235 @@
+"""
+ONNX Runtime engine for Fashion-CLIP on CPU
+Exports the image and text encoders to ONNX, quantises them to int8, and
+serves them behind the same encode_images/encode_text interface as FashionCLIP
+
+Usage:
+    python onnx_engine.py export
+    python onnx_engine.py parity photo1.jpg photo2.jpg ...
+"""
+
+from typing import Dict, List
+import logging
+import os
+import sys
+import numpy as np
+from PIL import Image
+
+import config
+
+logger = logging.getLogger(__name__)
+
+HF_MODEL_NAME = "patrickjohncyh/fashion-clip"
+IMAGE_ENCODER = "image_encoder"
+TEXT_ENCODER = "text_encoder"
+
+
+def model_path(model_dir: str, name: str, quantized: bool) -> str:
+    return os.path.join(model_dir, f"{name}.int8.onnx" if quantized else f"{name}.onnx")
+
+
+def export_onnx(fashion_model, model_dir: str, quantize: bool = True):
+    """
+    Export the Fashion-CLIP encoders to ONNX
+
+    Args:
+        fashion_model: Loaded FashionCLIP instance
+        model_dir: Output directory
+        quantize: Also write int8 dynamically quantised copies
+    """
+    import torch
+
+    class ImageEncoder(torch.nn.Module):
+        def __init__(self, clip):
+            super().__init__()
+            self.clip = clip
+
+        def forward(self, pixel_values):
+            return self.clip.get_image_features(pixel_values=pixel_values)
+
+    class TextEncoder(torch.nn.Module):
+        def __init__(self, clip):
+            super().__init__()
+            self.clip = clip
+
+        def forward(self, input_ids, attention_mask):
+            return self.clip.get_text_features(input_ids=input_ids, attention_mask=attention_mask)
+
+    os.makedirs(model_dir, exist_ok=True)
+    clip = fashion_model.model.eval().to("cpu")
+
+    pixel_values = fashion_model.preprocess(
+        images=[Image.new("RGB", (224, 224))], return_tensors="pt"
+    )["pixel_values"]
+    text_inputs = fashion_model.preprocess(
+        text=["a photo"], return_tensors="pt", padding=True
+    )
+
+    with torch.no_grad():
+        torch.onnx.export(
+            ImageEncoder(clip), (pixel_values,), model_path(model_dir, IMAGE_ENCODER, False),
+            input_names=["pixel_values"], output_names=["embeds"],
+            dynamic_axes={"pixel_values": {0: "batch"}, "embeds": {0: "batch"}},
+            opset_version=17
+        )
+        torch.onnx.export(
+            TextEncoder(clip), (text_inputs["input_ids"], text_inputs["attention_mask"]),
+            model_path(model_dir, TEXT_ENCODER, False),
+            input_names=["input_ids", "attention_mask"], output_names=["embeds"],
+            dynamic_axes={
+                "input_ids": {0: "batch", 1: "sequence"},
+                "attention_mask": {0: "batch", 1: "sequence"},
+                "embeds": {0: "batch"}
+            },
+            opset_version=17
+        )
+    logger.info(f"Exported Fashion-CLIP encoders to {model_dir}")
+
+    if quantize:
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+        for name in (IMAGE_ENCODER, TEXT_ENCODER):
+            quantize_dynamic(
+                model_path(model_dir, name, False),
+                model_path(model_dir, name, True),
+                weight_type=QuantType.QInt8
+            )
+        logger.info("Wrote int8 quantised encoders")
+
+
+class OnnxFashionCLIP:
+    """
+    Drop-in replacement for FashionCLIP backed by ONNX Runtime sessions
+
+    Only the methods the backend uses are provided: encode_images and
+    encode_text, both returning numpy arrays like FashionCLIP does.
+    """
+
+    def __init__(
+        self,
+        model_dir: str = config.ONNX_MODEL_DIR,
+        quantized: bool = config.ONNX_QUANTIZE,
+        intra_op_threads: int = config.ONNX_INTRA_OP_THREADS,
+        inter_op_threads: int = config.ONNX_INTER_OP_THREADS
+    ):
+        """
+        Args:
+            model_dir: Directory written by export_onnx
+            quantized: Use the int8 encoders
+            intra_op_threads: Threads used inside one operator (0 lets ONNX Runtime decide)
+            inter_op_threads: Threads used across independent operators
+        """
+        import onnxruntime as ort
+        from transformers import CLIPProcessor
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        options.intra_op_num_threads = intra_op_threads
+        options.inter_op_num_threads = inter_op_threads
+
+        providers = ["CPUExecutionProvider"]
+        self.image_session = ort.InferenceSession(
+            model_path(model_dir, IMAGE_ENCODER, quantized), options, providers=providers
+        )
+        self.text_session = ort.InferenceSession(
+            model_path(model_dir, TEXT_ENCODER, quantized), options, providers=providers
+        )
+        self.preprocess = CLIPProcessor.from_pretrained(HF_MODEL_NAME)
+
+    def encode_images(self, images: List[Image.Image], batch_size: int = 32) -> np.ndarray:
+        embeds = []
+        for start in range(0, len(images), batch_size):
+            pixel_values = self.preprocess(
+                images=images[start:start + batch_size], return_tensors="np"
+            )["pixel_values"].astype(np.float32)
+            embeds.append(self.image_session.run(["embeds"], {"pixel_values": pixel_values})[0])
+        return np.concatenate(embeds)
+
+    def encode_text(self, text: List[str], batch_size: int = 32) -> np.ndarray:
+        embeds = []
+        for start in range(0, len(text), batch_size):
+            inputs = self.preprocess(
+                text=text[start:start + batch_size], return_tensors="np", padding=True, truncation=True
+            )
+            embeds.append(self.text_session.run(["embeds"], {
+                "input_ids": inputs["input_ids"].astype(np.int64),
+                "attention_mask": inputs["attention_mask"].astype(np.int64)
+            })[0])
+        return np.concatenate(embeds)
+
+
+def load_fashion_engine(engine: str = config.FASHION_ENGINE):
+    """
+    Load the configured Fashion-CLIP engine
+
+    Args:
+        engine: "torch" for eager PyTorch, "onnx" for ONNX Runtime
+
+    Returns:
+        Object exposing encode_images and encode_text
+    """
+    from fashion_clip.fashion_clip import FashionCLIP
+
+    if engine == "torch":
+        return FashionCLIP('fashion-clip')
+    if engine != "onnx":
+        raise ValueError(f"Unknown FASHION_ENGINE: {engine}")
+
+    if not os.path.exists(model_path(config.ONNX_MODEL_DIR, IMAGE_ENCODER, config.ONNX_QUANTIZE)):
+        logger.info("No ONNX export found, exporting Fashion-CLIP...")
+        export_onnx(FashionCLIP('fashion-clip'), config.ONNX_MODEL_DIR, quantize=config.ONNX_QUANTIZE)
+    return OnnxFashionCLIP()
+
+
+def check_parity(reference, candidate, images: List[Image.Image], vocabularies: Dict[str, List[str]], k: int = 3) -> float:
+    """
+    Fraction of top-k labels the candidate engine shares with the reference
+
+    Args:
+        reference: Reference engine (usually PyTorch FashionCLIP)
+        candidate: Engine under test
+        images: Test images
+        vocabularies: Label vocabularies to rank against
+        k: Number of top labels compared per vocabulary
+
+    Returns:
+        Overlap between the two engines' top-k label sets, from 0.0 to 1.0
+    """
+    from label_store import LabelEmbeddingStore
+
+    limits = {name: k for name in vocabularies}
+    ranked = []
+    for engine in (reference, candidate):
+        store = LabelEmbeddingStore(engine, vocabularies)
+        ranked.append(store.rank(engine.encode_images(images, batch_size=len(images)), limits))
+
+    matched = total = 0
+    for expected, actual in zip(*ranked):
+        for name in vocabularies:
+            expected_labels = {label for label, _ in expected[name]}
+            actual_labels = {label for label, _ in actual[name]}
+            matched += len(expected_labels & actual_labels)
+            total += len(expected_labels)
+    return matched / total if total else 1.0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    from fashion_clip.fashion_clip import FashionCLIP
+
+    if len(sys.argv) < 2 or sys.argv[1] not in ("export", "parity"):
+        print("Usage: python onnx_engine.py export")
+        print("       python onnx_engine.py parity <image_path> [<image_path> ...]")
+        sys.exit(1)
+
+    torch_model = FashionCLIP('fashion-clip')
+    if sys.argv[1] == "export":
+        export_onnx(torch_model, config.ONNX_MODEL_DIR, quantize=config.ONNX_QUANTIZE)
+    else:
+        from analysis_engine import VOCABULARIES
+        test_images = [Image.open(path).convert('RGB') for path in sys.argv[2:]]
+        if not test_images:
+            test_images = [Image.new("RGB", (224, 224), color) for color in ("red", "navy", "beige")]
+        overlap = check_parity(torch_model, OnnxFashionCLIP(), test_images, VOCABULARIES)
+        print(f"Top-3 label overlap with PyTorch: {overlap:.1%}")
+        sys.exit(0 if overlap >= config.ONNX_PARITY_THRESHOLD else 1)
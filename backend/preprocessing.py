@@ -0,0 +1,144 @@
+"""
+Image decoding and pre-resizing ahead of model input
+Decodes each upload once, at the smallest size the target model needs
+"""
+
+from typing import Optional
+import io
+import threading
+from PIL import Image
+
+import config
+from metrics import stage_timer
+
+# Model input sizes: Fashion-CLIP resizes the short side to 224 and crops,
+# Florence-2 resizes to 768x768
+CLIP_INPUT_SIZE = 224
+FLORENCE_INPUT_SIZE = 768
+
+# Region crops cover a third or so of the image, so they are cut from a
+# decode at twice the Fashion-CLIP size to keep each crop near model input size
+REGION_INPUT_SIZE = 2 * CLIP_INPUT_SIZE
+
+# PIL's own decompression bomb guard, as a second line of defence
+Image.MAX_IMAGE_PIXELS = config.MAX_IMAGE_PIXELS
+
+
+class ImageRejected(Exception):
+    """Raised for uploads that are too large or not decodable; carries an HTTP status code"""
+
+    def __init__(self, message: str, status_code: int = 413):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def open_checked(contents: bytes) -> Image.Image:
+    """
+    Open an image lazily and reject oversized inputs before any pixel is decoded
+
+    Args:
+        contents: Raw image file bytes
+
+    Returns:
+        PIL image with only its header parsed
+    """
+    if len(contents) > config.MAX_UPLOAD_BYTES:
+        raise ImageRejected(f"Image file exceeds {config.MAX_UPLOAD_BYTES} bytes")
+    try:
+        img = Image.open(io.BytesIO(contents))
+    except Image.DecompressionBombError as e:
+        raise ImageRejected(str(e))
+    except Exception as e:
+        raise ImageRejected(f"Cannot decode image: {str(e)}", 400)
+    if img.width * img.height > config.MAX_IMAGE_PIXELS:
+        raise ImageRejected(f"Image exceeds {config.MAX_IMAGE_PIXELS} pixels")
+    return img
+
+
+def shrink_to(img: Image.Image, short_side: int) -> Image.Image:
+    """Downscale so the short side equals short_side, keeping aspect ratio"""
+    scale = short_side / min(img.width, img.height)
+    if scale >= 1:
+        return img
+    size = (max(1, round(img.width * scale)), max(1, round(img.height * scale)))
+    return img.resize(size, Image.BICUBIC, reducing_gap=2.0)
+
+
+def decode_at(contents: bytes, short_side: int) -> Image.Image:
+    """
+    Decode an image at reduced size for a model with the given input size
+
+    JPEGs use draft mode, which lets libjpeg decode directly at 1/2, 1/4 or
+    1/8 scale, so a multi-megapixel photo is never fully decoded. The result
+    is then resized once so its short side matches the model input.
+
+    Args:
+        contents: Raw image file bytes
+        short_side: Target length of the shorter side
+
+    Returns:
+        RGB image
+    """
+    with stage_timer("decode"):
+        img = open_checked(contents)
+        try:
+            img.draft("RGB", (short_side, short_side))
+            img = img.convert("RGB")
+        except ImageRejected:
+            raise
+        except Image.DecompressionBombError as e:
+            raise ImageRejected(str(e))
+        except Exception as e:
+            raise ImageRejected(f"Cannot decode image: {str(e)}", 400)
+        return shrink_to(img, short_side)
+
+
+class PreparedImage:
+    """
+    One upload decoded once and shared between the analysis and caption paths
+
+    Each variant is decoded on first use. A smaller variant is derived from
+    a larger one that already exists, and otherwise decoded directly at its
+    own size. Safe to use from several inference threads.
+    """
+
+    def __init__(self, contents: bytes):
+        self.contents = contents
+        self._clip: Optional[Image.Image] = None
+        self._regions: Optional[Image.Image] = None
+        self._florence: Optional[Image.Image] = None
+        self._lock = threading.Lock()
+
+    @property
+    def nbytes(self) -> int:
+        """Approximate memory held by the decoded variants"""
+        variants = (self._clip, self._regions, self._florence)
+        return sum(img.width * img.height * 3 for img in variants if img is not None)
+
+    def for_clip(self) -> Image.Image:
+        """RGB image sized for Fashion-CLIP"""
+        with self._lock:
+            if self._clip is None:
+                larger = self._regions or self._florence
+                if larger is not None:
+                    self._clip = shrink_to(larger, CLIP_INPUT_SIZE)
+                else:
+                    self._clip = decode_at(self.contents, CLIP_INPUT_SIZE)
+            return self._clip
+
+    def for_regions(self) -> Image.Image:
+        """RGB image to cut Fashion-CLIP region crops from"""
+        with self._lock:
+            if self._regions is None:
+                if self._florence is not None:
+                    self._regions = shrink_to(self._florence, REGION_INPUT_SIZE)
+                else:
+                    self._regions = decode_at(self.contents, REGION_INPUT_SIZE)
+            return self._regions
+
+    def for_florence(self) -> Image.Image:
+        """RGB image sized for Florence-2"""
+        with self._lock:
+            if self._florence is None:
+                self._florence = decode_at(self.contents, FLORENCE_INPUT_SIZE)
+            return self._florence
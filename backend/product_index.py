@@ -0,0 +1,201 @@
+"""
+Visual index over shopping-result thumbnails
+Fashion-CLIP embeddings of product images kept on disk, with a NumPy IVF index
+for nearest-neighbour search
+"""
+
+from typing import Dict, List, Optional, Tuple
+import fcntl
+import json
+import logging
+import os
+import threading
+import numpy as np
+
+from embedding_store import EmbeddingStore
+
+logger = logging.getLogger(__name__)
+
+# The IVF index is rebuilt once the store has grown by this fraction
+REBUILD_GROWTH = 0.1
+
+# Below this many products a search simply scans them all
+MIN_IVF_SIZE = 1024
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    """L2-normalise along the last axis"""
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+class IVFIndex:
+    """
+    Inverted-file index for cosine similarity
+
+    Vectors are clustered with spherical k-means into `nlist` lists; a
+    query is compared with the centroids and only the vectors in its
+    `nprobe` closest lists are scored. With nlist around sqrt(n) a search
+    touches a small fraction of the vectors at a small recall cost.
+    """
+
+    def __init__(self, vectors: np.ndarray, nlist: Optional[int] = None, iterations: int = 8, seed: int = 0):
+        """
+        Args:
+            vectors: Embeddings of shape (n, dim)
+            nlist: Number of clusters (default: sqrt(n))
+            iterations: k-means iterations
+            seed: Random seed for sampling and initialisation
+        """
+        self.vectors = normalize(np.asarray(vectors, dtype=np.float32))
+        n = len(self.vectors)
+        nlist = max(1, min(n, nlist or int(np.sqrt(n))))
+
+        # Train on a sample; assignment of every vector happens afterwards
+        rng = np.random.default_rng(seed)
+        sample = self.vectors[rng.choice(n, min(n, 64 * nlist), replace=False)]
+        centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+        for _ in range(iterations):
+            assignment = np.argmax(sample @ centroids.T, axis=1)
+            for i in range(nlist):
+                members = sample[assignment == i]
+                if len(members):
+                    centroids[i] = members.mean(axis=0)
+            centroids = normalize(centroids)
+        self.centroids = centroids
+
+        assignment = self._assign(self.vectors)
+        order = np.argsort(assignment, kind="stable")
+        bounds = np.searchsorted(assignment[order], np.arange(nlist + 1))
+        self.lists = [order[bounds[i]:bounds[i + 1]] for i in range(nlist)]
+
+    def __len__(self) -> int:
+        return len(self.vectors)
+
+    def _assign(self, vectors: np.ndarray, chunk: int = 8192) -> np.ndarray:
+        return np.concatenate([
+            np.argmax(vectors[start:start + chunk] @ self.centroids.T, axis=1)
+            for start in range(0, len(vectors), chunk)
+        ])
+
+    def search(self, query: np.ndarray, k: int, nprobe: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Approximate nearest neighbours of one query
+
+        Returns:
+            Tuple of (row ids, cosine similarities), best first
+        """
+        query = normalize(np.asarray(query, dtype=np.float32))
+        probe = np.argsort(-(self.centroids @ query))[:nprobe]
+        candidates = np.concatenate([self.lists[i] for i in probe])
+        scores = self.vectors[candidates] @ query
+        top = np.argsort(-scores)[:k]
+        return candidates[top], scores[top]
+
+
+class ProductIndex:
+    """
+    Fashion-CLIP embeddings of shopping-result thumbnails, keyed on content hash
+
+    Embeddings live in an EmbeddingStore, so a thumbnail seen before, by any
+    worker on the host, is never embedded again. Product details are
+    appended to `products.jsonl` next to it under the same kind of file
+    lock. Searches go through an IVF index that is rebuilt once the store
+    has grown by REBUILD_GROWTH; small indexes are scanned exactly.
+    """
+
+    def __init__(self, directory: str, dim: int, nprobe: int = 8):
+        """
+        Args:
+            directory: Directory holding the index files (created if missing)
+            dim: Embedding dimension
+            nprobe: IVF lists scanned per search
+        """
+        self.store = EmbeddingStore(directory, dim)
+        self.nprobe = nprobe
+        self.products_path = os.path.join(directory, "products.jsonl")
+        self.lock_path = os.path.join(directory, "products.lock")
+        open(self.products_path, "ab").close()
+
+        self._products: Dict[str, Dict] = {}
+        self._products_offset = 0
+        self._ivf: Optional[IVFIndex] = None
+        self._ivf_keys: List[str] = []
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.store)
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        """Stored embedding for a thumbnail content hash, or None"""
+        return self.store.get(key)
+
+    def add(self, key: str, vector, product: Dict):
+        """
+        Store a thumbnail embedding and the product it belongs to
+
+        Args:
+            key: Thumbnail content hash
+            vector: Fashion-CLIP embedding
+            product: Shopping result the thumbnail came from
+        """
+        self.store.put(key, vector)
+        with self._lock, open(self.lock_path, "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                self._refresh_products()
+                if key in self._products:
+                    return
+                with open(self.products_path, "a") as f:
+                    f.write(json.dumps({"key": key, "product": product}) + "\n")
+                self._refresh_products()
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def search(self, query, k: int = 10) -> List[Tuple[Dict, float]]:
+        """
+        Products whose thumbnails look most like the query embedding
+
+        Args:
+            query: Fashion-CLIP image embedding
+            k: Number of products to return
+
+        Returns:
+            (product, cosine similarity) pairs, best first
+        """
+        ivf, keys = self._current_index()
+        if ivf is None:
+            return []
+        rows, scores = ivf.search(query, k, self.nprobe)
+        with self._lock:
+            self._refresh_products()
+            return [
+                (self._products[keys[row]], float(score))
+                for row, score in zip(rows, scores) if keys[row] in self._products
+            ]
+
+    def _current_index(self) -> Tuple[Optional[IVFIndex], List[str]]:
+        """The IVF index, rebuilt first if the store has outgrown it"""
+        with self._build_lock:
+            size = len(self.store)
+            if self._ivf is None or size > len(self._ivf) * (1 + REBUILD_GROWTH):
+                keys, vectors = self.store.snapshot()
+                if not keys:
+                    return None, []
+                # Small indexes get a single list, i.e. an exact scan
+                self._ivf = IVFIndex(vectors, nlist=None if len(keys) >= MIN_IVF_SIZE else 1)
+                self._ivf_keys = keys
+                logger.info(f"Product index rebuilt: {len(keys)} products, {len(self._ivf.lists)} lists")
+            return self._ivf, self._ivf_keys
+
+    def _refresh_products(self):
+        """Read product lines appended since the last refresh"""
+        with open(self.products_path, "rb") as f:
+            f.seek(self._products_offset)
+            data = f.read()
+        end = data.rfind(b"\n") + 1
+        for line in data[:end].splitlines():
+            entry = json.loads(line)
+            self._products[entry["key"]] = entry["product"]
+        self._products_offset += end
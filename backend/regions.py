@@ -0,0 +1,113 @@
+"""
+Candidate garment regions for multi-garment analysis
+Turns a fixed grid or Florence-2 object detections into crop boxes
+"""
+
+from typing import Dict, List, Sequence, Tuple
+from PIL import Image
+
+import config
+
+# Normalised (x0, y0, x1, y1), so boxes do not depend on the decode size
+Box = Tuple[float, float, float, float]
+
+# ?regions= values
+REGION_MODES = ("grid", "detect")
+
+# Detector labels for whole people rather than garments; the whole-image
+# analysis already covers them
+PERSON_LABELS = {"person", "man", "woman", "boy", "girl", "human", "human face", "human head"}
+
+# Detections overlapping an earlier (larger) one by more than this are dropped
+MAX_IOU = 0.6
+
+
+def grid_boxes(
+    rows: int = config.REGION_GRID_ROWS,
+    cols: int = config.REGION_GRID_COLS,
+    overlap: float = config.REGION_OVERLAP
+) -> List[Box]:
+    """
+    Overlapping grid tiles
+
+    The default 3x1 grid gives top, middle and bottom bands, which for a
+    standing outfit roughly separate the upper garment, the legs and the
+    shoes. Overlap keeps a garment on a tile border whole in one tile.
+    """
+    boxes = []
+    for row in range(rows):
+        for col in range(cols):
+            boxes.append((
+                max(0.0, (col - overlap) / cols),
+                max(0.0, (row - overlap) / rows),
+                min(1.0, (col + 1 + overlap) / cols),
+                min(1.0, (row + 1 + overlap) / rows)
+            ))
+    return boxes
+
+
+def box_area(box: Box) -> float:
+    return max(0.0, box[2] - box[0]) * max(0.0, box[3] - box[1])
+
+
+def box_iou(a: Box, b: Box) -> float:
+    """Intersection over union of two boxes"""
+    inter = box_area((max(a[0], b[0]), max(a[1], b[1]), min(a[2], b[2]), min(a[3], b[3])))
+    union = box_area(a) + box_area(b) - inter
+    return inter / union if union > 0 else 0.0
+
+
+def detection_boxes(
+    detections: Dict,
+    width: int,
+    height: int,
+    max_regions: int = config.REGION_MAX,
+    min_area: float = config.REGION_MIN_AREA
+) -> List[Tuple[Box, str]]:
+    """
+    Garment candidates from a Florence-2 <OD> result
+
+    Args:
+        detections: {"bboxes": [[x0, y0, x1, y1], ...], "labels": [...]} in
+            pixel coordinates of the detected image
+        width: Width of the detected image
+        height: Height of the detected image
+        max_regions: Most regions to return
+        min_area: Smallest box kept, as a fraction of the image area
+
+    Returns:
+        (normalised box, detector label) pairs, largest first, with people,
+        tiny boxes and near-duplicates removed
+    """
+    candidates = []
+    for bbox, label in zip(detections.get("bboxes", []), detections.get("labels", [])):
+        label = label.strip().lower()
+        if label in PERSON_LABELS:
+            continue
+        box = (
+            min(max(bbox[0] / width, 0.0), 1.0),
+            min(max(bbox[1] / height, 0.0), 1.0),
+            min(max(bbox[2] / width, 0.0), 1.0),
+            min(max(bbox[3] / height, 0.0), 1.0)
+        )
+        if box_area(box) >= min_area:
+            candidates.append((box, label))
+
+    kept = []
+    for box, label in sorted(candidates, key=lambda c: box_area(c[0]), reverse=True):
+        if all(box_iou(box, other) <= MAX_IOU for other, _ in kept):
+            kept.append((box, label))
+        if len(kept) == max_regions:
+            break
+    return kept
+
+
+def crop_regions(image: Image.Image, boxes: Sequence[Box]) -> List[Image.Image]:
+    """Crop each normalised box out of the image"""
+    crops = []
+    for x0, y0, x1, y1 in boxes:
+        left, top = int(x0 * image.width), int(y0 * image.height)
+        right = max(left + 1, round(x1 * image.width))
+        bottom = max(top + 1, round(y1 * image.height))
+        crops.append(image.crop((left, top, right, bottom)))
+    return crops
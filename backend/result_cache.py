@@ -0,0 +1,118 @@
+"""
+In-process result cache with LRU eviction, TTL and a memory bound
+"""
+
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+import hashlib
+import json
+import threading
+import time
+
+
+def hash_bytes(data: bytes) -> str:
+    """Content hash used to identify an image across requests"""
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def make_cache_key(*parts) -> str:
+    """Build a cache key from a namespace, content hash and request parameters"""
+    return "|".join(str(part) for part in parts)
+
+
+def estimate_size(value: Any) -> int:
+    """Approximate memory footprint of a JSON-like value in bytes"""
+    try:
+        return len(json.dumps(value, default=str))
+    except (TypeError, ValueError):
+        return 1024
+
+
+class ResultCache:
+    """
+    Thread-safe LRU cache bounded by total size in MB
+
+    Entries expire `ttl_seconds` after they were stored. When adding an
+    entry would exceed `max_mb`, least recently used entries are evicted.
+    """
+
+    def __init__(self, max_mb: float = 64, ttl_seconds: float = 3600, name: str = "cache"):
+        """
+        Args:
+            max_mb: Upper bound on the estimated size of all entries
+            ttl_seconds: Lifetime of an entry
+            name: Name reported in stats
+        """
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.ttl = ttl_seconds
+        self.name = name
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Any]:
+        """
+        Look up a key, counting a hit or a miss
+
+        Returns:
+            The cached value, or None if missing or expired
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, size, expires_at = entry
+                if expires_at > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                self._remove(key)
+            self.misses += 1
+            return None
+
+    def put(self, key: str, value: Any, size: Optional[int] = None):
+        """
+        Store a value, evicting least recently used entries as needed
+
+        Args:
+            key: Cache key
+            value: Value to store; must not be mutated afterwards
+            size: Size in bytes if known, estimated otherwise
+        """
+        if size is None:
+            size = estimate_size(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            while self._entries and self.bytes + size > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+            self._entries[key] = (value, size, time.monotonic() + self.ttl)
+            self.bytes += size
+
+    def clear(self):
+        """Drop every entry"""
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def stats(self) -> Dict:
+        """Hit/miss counters and current size"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "size_mb": round(self.bytes / (1024 * 1024), 3),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0
+            }
+
+    def _remove(self, key: str):
+        _, size, _ = self._entries.pop(key)
+        self.bytes -= size
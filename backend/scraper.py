@@ -1,42 +1,210 @@
 import os
+import re
+import time
+import logging
+from typing import Dict, List
 from dotenv import load_dotenv
+import httpx
 import requests
-from requests.models import Response
-import json
+
+import config
+from result_cache import ResultCache
+from singleflight import SingleFlight
+from metrics import SHOPPING_SECONDS, SHOPPING_ERRORS
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 SCRAPINGDOG_API_KEY = os.environ["SCRAPINGDOG_API"]
 SCRAPING_ENDPOINT = os.environ["SCRAPING_ENDPOINT"]
 
-def make_shopping_request(query):
-    params = {
-    "api_key": SCRAPINGDOG_API_KEY,
-    "query": query,
-    "language": "English",
-    "country": "uk"
+# Keep-alive session for the blocking helper below
+session = requests.Session()
+
+
+def normalize_query(query: str) -> str:
+    """Collapse case and whitespace so equivalent queries share a cache entry"""
+    return " ".join(query.lower().split())
+
+
+# Items that make poor shopping queries on their own
+EXCLUDED_ITEMS = ["watch", "tie"]
+
+
+def build_shopping_query(analysis: Dict) -> str:
+    """
+    Build the shopping query for an analysis result
+
+    Uses the top color and the highest-ranked item that is not an excluded
+    accessory, falling back to the top item.
+
+    Args:
+        analysis: Dictionary containing items and colors
+
+    Returns:
+        Query string such as "Buy navy jeans"
+    """
+    selected_item = analysis['items'][0]
+    for item in analysis['items']:
+        item_name = item['name'].lower()
+        if not any(excluded in item_name for excluded in EXCLUDED_ITEMS):
+            selected_item = item
+            break
+    return "Buy " + analysis['colors'][0]['color'] + " " + selected_item['name']
+
+
+def parse_price(result: Dict) -> float:
+    """Numeric price of a shopping result; unknown prices sort last"""
+    price = result.get("extracted_price") or re.sub(r"[^0-9.]", "", str(result.get("price", "")))
+    try:
+        return float(price)
+    except (TypeError, ValueError):
+        return 999999.0
+
+
+def sort_by_price(results: List[Dict]) -> List[Dict]:
+    """Shopping results ordered from lowest to highest price"""
+    return sorted(results, key=parse_price)
+
+
+def build_params(query: str) -> Dict:
+    return {
+        "api_key": SCRAPINGDOG_API_KEY,
+        "query": query,
+        "language": "English",
+        "country": "uk"
     }
-    
-    body = ""
-    
-    with open('make_life_ez.json') as f:
-        body = json.load(f)
-        # print(body)
-  
-    response = requests.get(SCRAPING_ENDPOINT, params=params)
-    
-    # response = Response()
-    # response._content = json.dumps(body).encode('utf-8')
-    # response.status_code = 200
-    
+
+
+def record_shopping_call(start: float, outcome):
+    """
+    Record the latency of one shopping API call, counting failures
+
+    Args:
+        start: perf_counter value when the call started
+        outcome: HTTP status code, "timeout" / "connection" when no
+            response arrived, or "invalid_response" for a non-JSON body
+    """
+    SHOPPING_SECONDS.observe(time.perf_counter() - start, outcome=str(outcome))
+    if outcome != 200:
+        reason = outcome if isinstance(outcome, str) else f"status_{outcome}"
+        SHOPPING_ERRORS.inc(reason=reason)
+
+
+class ShoppingClient:
+    """
+    Async shopping search client with a pooled connection and a response cache
+
+    Queries are normalised before lookup, and successful responses are
+    cached for `cache_ttl` seconds, so repeated "Buy <color> <item>"
+    searches never leave the process. Concurrent misses for the same
+    query share one upstream call.
+    """
+
+    def __init__(
+        self,
+        timeout: float = config.SHOPPING_TIMEOUT_S,
+        cache_ttl: float = config.SHOPPING_CACHE_TTL_S,
+        cache_mb: float = config.SHOPPING_CACHE_MB,
+        max_connections: int = config.SHOPPING_MAX_CONNECTIONS
+    ):
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self.cache = ResultCache(cache_mb, cache_ttl, name="shopping")
+        self.inflight = SingleFlight()
+        self._client = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                timeout=self.timeout,
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_connections
+                )
+            )
+        return self._client
+
+    async def search(self, query: str) -> Dict:
+        """
+        Search for products matching the query
+
+        Args:
+            query: Free-text shopping query
+
+        Returns:
+            Parsed JSON response from the scraping API
+
+        Raises:
+            httpx.HTTPError: The request failed, the API answered with a
+                non-200 status or the body was not JSON; nothing is cached
+        """
+        query = normalize_query(query)
+        cached = self.cache.get(query)
+        if cached is not None:
+            return cached
+        return await self.inflight.do(query, lambda: self._fetch(query))
+
+    async def _fetch(self, query: str) -> Dict:
+        start = time.perf_counter()
+        try:
+            response = await self.client.get(SCRAPING_ENDPOINT, params=build_params(query))
+        except httpx.TimeoutException:
+            record_shopping_call(start, "timeout")
+            raise
+        except httpx.HTTPError:
+            record_shopping_call(start, "connection")
+            raise
+        if response.status_code != 200:
+            record_shopping_call(start, response.status_code)
+            logger.warning(f"Shopping request failed with status code: {response.status_code}")
+            raise httpx.HTTPStatusError(
+                f"Shopping API returned status {response.status_code}",
+                request=response.request,
+                response=response
+            )
+        try:
+            data = response.json()
+        except ValueError:
+            record_shopping_call(start, "invalid_response")
+            raise httpx.DecodingError("Shopping API returned a non-JSON response", request=response.request)
+        record_shopping_call(start, response.status_code)
+
+        self.cache.put(query, data)
+        return data
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+def make_shopping_request(query):
+    """Blocking shopping search, kept for scripts and the CLI below"""
+    start = time.perf_counter()
+    try:
+        response = session.get(
+            SCRAPING_ENDPOINT,
+            params=build_params(normalize_query(query)),
+            timeout=config.SHOPPING_TIMEOUT_S
+        )
+    except requests.Timeout:
+        record_shopping_call(start, "timeout")
+        raise
+    except requests.RequestException:
+        record_shopping_call(start, "connection")
+        raise
+    record_shopping_call(start, response.status_code)
+
     if response.status_code == 200:
-        # data = response.json()
         return response
     else:
         print(f"Request failed with status code: {response.status_code}")
         return response
-    
+
 if __name__ == "__main__":
     res = make_shopping_request("Beige jacket")
     body = res.json()
-    # print(body)
\ No newline at end of file
+    # print(body)
@@ -1,87 +1,140 @@
 """
-Simple CLI version - Analyze a single image file
+Simple CLI version - Analyze a single image file, or tag a whole catalogue
+
+Usage:
+    python simple_analyzer.py photo.jpg
+    python simple_analyzer.py catalogue/ "more/**/*.png" --output tags.jsonl
 """
 
+from typing import Dict, Iterator, List
+import argparse
+import csv
+import glob
+import json
+import os
 import sys
-import torch
-import numpy as np
-from PIL import Image
-from fashion_clip.fashion_clip import FashionCLIP
+import time
+
+from analysis_engine import default_engine, load_image_file
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".gif", ".webp")
 
 
 def analyze_image(image_path):
     """Analyze a fashion image"""
     print("Loading Fashion-CLIP model...")
-    fclip = FashionCLIP('fashion-clip')
-    
-    categories = [
-        "short sleeve top", "long sleeve top", "t-shirt", "shirt", "blouse",
-        "jacket", "coat", "hoodie", "cardigan", "blazer",
-        "pants", "jeans", "trousers", "shorts", "skirt",
-        "dress", "short sleeve dress", "long sleeve dress", "maxi dress",
-        "bag", "handbag", "backpack", "shoes", "sneakers", "boots",
-        "hat", "cap", "sunglasses", "watch", "belt",
-        "sweater", "vest", "scarf", "tie"
-    ]
-    
-    colors = ["red", "blue", "green", "black", "white", "yellow", 
-              "pink", "purple", "brown", "gray", "orange", "navy", "beige"]
-    
-    styles = ["casual", "formal", "sporty", "elegant", "vintage", "modern", "streetwear"]
-    
+    engine = default_engine()
+
     print(f"\nAnalyzing: {image_path}\n")
-    
-    # Load image
-    pil_image = Image.open(image_path).convert('RGB')
-    
-    # Get embeddings
-    image_embeds = fclip.encode_images([pil_image], batch_size=1)
-    
-    # Items
-    text_embeds = fclip.encode_text(categories, batch_size=32)
-    if isinstance(image_embeds, np.ndarray):
-        image_embeds = torch.from_numpy(image_embeds)
-    if isinstance(text_embeds, np.ndarray):
-        text_embeds = torch.from_numpy(text_embeds)
-    
-    image_embeds = image_embeds / image_embeds.norm(dim=-1, keepdim=True)
-    text_embeds = text_embeds / text_embeds.norm(dim=-1, keepdim=True)
-    similarities = (image_embeds @ text_embeds.T).squeeze(0)
-    scores, indices = torch.topk(similarities, 10)
-    
+
+    # Load image at model input size and score against all vocabularies in one pass
+    pil_image = load_image_file(image_path)
+    ranked = engine.rank(engine.encode([pil_image]))[0]
+
     print("Fashion Items:")
-    for i, (idx, score) in enumerate(zip(indices, scores), 1):
-        print(f"  {i}. {categories[idx]:<25} {score.item():.1%}")
-    
-    # Colors
-    color_embeds = fclip.encode_text(colors, batch_size=32)
-    if isinstance(color_embeds, np.ndarray):
-        color_embeds = torch.from_numpy(color_embeds)
-    color_embeds = color_embeds / color_embeds.norm(dim=-1, keepdim=True)
-    color_sims = (image_embeds @ color_embeds.T).squeeze(0)
-    color_scores, color_indices = torch.topk(color_sims, 5)
-    
+    for i, (label, score) in enumerate(ranked['items'], 1):
+        print(f"  {i}. {label:<25} {score:.1%}")
+
     print("\nColors:")
-    for i, (idx, score) in enumerate(zip(color_indices, color_scores), 1):
-        print(f"  {i}. {colors[idx]:<15} {score.item():.1%}")
-    
-    # Styles
-    style_embeds = fclip.encode_text(styles, batch_size=32)
-    if isinstance(style_embeds, np.ndarray):
-        style_embeds = torch.from_numpy(style_embeds)
-    style_embeds = style_embeds / style_embeds.norm(dim=-1, keepdim=True)
-    style_sims = (image_embeds @ style_embeds.T).squeeze(0)
-    style_scores, style_indices = torch.topk(style_sims, 5)
-    
+    for i, (label, score) in enumerate(ranked['colors'], 1):
+        print(f"  {i}. {label:<15} {score:.1%}")
+
     print("\nStyles:")
-    for i, (idx, score) in enumerate(zip(style_indices, style_scores), 1):
-        print(f"  {i}. {styles[idx]:<15} {score.item():.1%}")
+    for i, (label, score) in enumerate(ranked['styles'], 1):
+        print(f"  {i}. {label:<15} {score:.1%}")
     print()
 
 
+def expand_inputs(inputs: List[str]) -> Iterator[str]:
+    """
+    Image paths from files, directories (searched recursively) and glob patterns
+
+    Paths are yielded lazily, so tagging can start before a large tree
+    has been fully listed.
+    """
+    for entry in inputs:
+        if os.path.isdir(entry):
+            for root, dirs, files in os.walk(entry):
+                dirs.sort()
+                for name in sorted(files):
+                    if name.lower().endswith(IMAGE_EXTENSIONS):
+                        yield os.path.join(root, name)
+        elif glob.has_magic(entry):
+            yield from sorted(glob.iglob(entry, recursive=True))
+        else:
+            yield entry
+
+
+def csv_row(path: str, result: Dict, error: str) -> Dict:
+    """Flat CSV record: the top label of each vocabulary plus the full ranking"""
+    row = {"path": path, "error": error or ""}
+    for name, key in (("items", "name"), ("colors", "color"), ("styles", "style")):
+        ranked = result[name] if result else []
+        row[name] = ";".join(f"{entry[key]}:{entry['confidence']:.4f}" for entry in ranked)
+    return row
+
+
+def tag_catalogue(args):
+    """Stream every input image through the engine and write one record per image"""
+    engine = default_engine()
+    output_format = args.format or ("csv" if args.output.endswith(".csv") else "jsonl")
+
+    done = failed = 0
+    start = time.perf_counter()
+    with open(args.output, "w", newline="") as out:
+        writer = None
+        if output_format == "csv":
+            writer = csv.DictWriter(out, fieldnames=["path", "items", "colors", "styles", "error"])
+            writer.writeheader()
+
+        results = engine.analyze_paths(
+            expand_inputs(args.inputs),
+            batch_size=args.batch_size,
+            workers=args.workers,
+            top_items=args.top_items,
+            top_colors=args.top_colors,
+            top_styles=args.top_styles
+        )
+        for path, result, error in results:
+            if writer is not None:
+                writer.writerow(csv_row(path, result, error))
+            else:
+                record = {"path": path, **result} if result else {"path": path, "error": error}
+                out.write(json.dumps(record) + "\n")
+
+            done += 1
+            failed += error is not None
+            if done % args.progress_every == 0:
+                rate = done / (time.perf_counter() - start)
+                print(f"{done} images ({failed} failed), {rate:.1f} images/s", file=sys.stderr)
+
+    elapsed = time.perf_counter() - start
+    print(f"Tagged {done - failed} images ({failed} failed) in {elapsed:.1f}s -> {args.output}", file=sys.stderr)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Tag fashion images with Fashion-CLIP")
+    parser.add_argument("inputs", nargs="+", help="Image files, directories or glob patterns")
+    parser.add_argument("--output", "-o", help="JSONL or CSV output file (enables batch mode)")
+    parser.add_argument("--format", choices=["jsonl", "csv"], help="Output format (default: from the file extension)")
+    parser.add_argument("--batch-size", type=int, default=32, help="Images per forward pass")
+    parser.add_argument("--workers", type=int, default=4, help="Decode prefetch threads")
+    parser.add_argument("--top-items", type=int, default=10)
+    parser.add_argument("--top-colors", type=int, default=5)
+    parser.add_argument("--top-styles", type=int, default=5)
+    parser.add_argument("--progress-every", type=int, default=500, help="Images between progress lines")
+    return parser.parse_args(argv)
+
+
 if __name__ == "__main__":
     if len(sys.argv) < 2:
         print("Usage: python simple_analyzer.py <image_path>")
+        print("       python simple_analyzer.py <dir|glob|file> ... --output tags.jsonl|tags.csv")
         print("Example: python simple_analyzer.py photo.jpg")
     else:
-        analyze_image(sys.argv[1])
+        args = parse_args()
+        if args.output:
+            tag_catalogue(args)
+        else:
+            for image_path in expand_inputs(args.inputs):
+                analyze_image(image_path)
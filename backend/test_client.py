@@ -1,10 +1,24 @@
 """
 Test client for the Fashion API
-Shows how to send images to the API
+Shows how to send images to the API, and doubles as a load generator
+
+Usage:
+    python test_client.py [image_path]
+    python test_client.py load --endpoint /analyze --clients 16 --rate 40 --duration 60 [image_path ...]
+    python test_client.py mock-scraper --port 8100
 """
 
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List
+import argparse
+import asyncio
+import io
+import itertools
+import random
+import time
 import requests
 import json
+import numpy as np
 
 # API endpoint
 API_URL = "http://localhost:8000"
@@ -95,9 +109,242 @@ def get_categories():
     print()
 
 
+LOAD_ENDPOINTS = ("/analyze", "/analyze/batch", "/analyseCaption", "/get_shopping")
+
+SHOPPING_QUERIES = [
+    f"Buy {color} {item}"
+    for color in ("black", "navy", "beige", "red", "white")
+    for item in ("jacket", "jeans", "dress", "sneakers", "hoodie")
+]
+
+
+def load_images(paths: List[str], count: int = 8) -> List[bytes]:
+    """Image files to send, or synthetic JPEGs when no paths are given"""
+    if paths:
+        images = []
+        for path in paths:
+            with open(path, 'rb') as f:
+                images.append(f.read())
+        return images
+    
+    from PIL import Image
+    rng = np.random.default_rng(0)
+    images = []
+    for _ in range(count):
+        small = rng.integers(0, 256, (8, 8, 3), dtype=np.uint8)
+        buffer = io.BytesIO()
+        Image.fromarray(small, "RGB").resize((1200, 1600), Image.BILINEAR).save(buffer, "JPEG", quality=90)
+        images.append(buffer.getvalue())
+    return images
+
+
+class LoadStats:
+    """Latencies and status codes, kept per reporting interval and in total"""
+    
+    def __init__(self):
+        self.interval = []
+        self.total = []
+    
+    def record(self, seconds: float, status: int):
+        self.interval.append((seconds, status))
+        self.total.append((seconds, status))
+    
+    @staticmethod
+    def summarize(samples, elapsed: float) -> Dict:
+        if not samples:
+            return {"requests": 0, "throughput_per_s": 0.0}
+        latencies = np.array([seconds for seconds, _ in samples]) * 1000
+        statuses = [status for _, status in samples]
+        return {
+            "requests": len(samples),
+            "throughput_per_s": round(len(samples) / elapsed, 2),
+            "p50_ms": round(float(np.percentile(latencies, 50)), 1),
+            "p90_ms": round(float(np.percentile(latencies, 90)), 1),
+            "p99_ms": round(float(np.percentile(latencies, 99)), 1),
+            "error_rate": round(sum(1 for s in statuses if s >= 400 or s == 0) / len(samples), 4),
+            "rate_429": round(statuses.count(429) / len(samples), 4),
+            # 0 stands for a connection error or client-side timeout
+            "statuses": {str(status): statuses.count(status) for status in sorted(set(statuses))}
+        }
+    
+    def flush(self, elapsed: float) -> Dict:
+        summary = self.summarize(self.interval, elapsed)
+        self.interval = []
+        return summary
+
+
+def build_request(endpoint: str, images: List[bytes], i: int, batch_size: int, unique: bool) -> Dict:
+    """
+    httpx request arguments for the i-th load request
+    
+    With unique set, every request carries different bytes (or a different
+    query), so the server's caches do not hide model cost.
+    """
+    def image(n):
+        contents = images[n % len(images)]
+        # Decoders ignore bytes after the end-of-image marker
+        return contents + n.to_bytes(8, "little") if unique else contents
+    
+    if endpoint == "/get_shopping":
+        query = SHOPPING_QUERIES[i % len(SHOPPING_QUERIES)]
+        return {"method": "GET", "params": {"query": f"{query} {i}" if unique else query}}
+    if endpoint == "/analyze/batch":
+        files = [
+            ("files", (f"load{n}.jpg", image(n), "image/jpeg"))
+            for n in range(i * batch_size, (i + 1) * batch_size)
+        ]
+        return {"method": "POST", "files": files}
+    return {"method": "POST", "files": {"file": (f"load{i}.jpg", image(i), "image/jpeg")}}
+
+
+async def run_load(args):
+    """
+    Fire requests at a target rate from a fixed number of concurrent clients
+    
+    With --rate, arrivals are scheduled open-loop at that rate, so a slow
+    server builds up a backlog rather than slowing the generator down;
+    arrivals that find every client busy wait for one, and that wait
+    counts towards their latency. Without --rate each client sends its
+    next request as soon as the previous one returns.
+    """
+    import httpx
+    
+    images = load_images(args.images)
+    stats = LoadStats()
+    limits = httpx.Limits(max_connections=args.clients, max_keepalive_connections=args.clients)
+    queue = asyncio.Queue(maxsize=args.clients * 4) if args.rate else None
+    counter = itertools.count()
+    start = time.perf_counter()
+    deadline = start + args.duration
+    
+    async with httpx.AsyncClient(base_url=args.url, limits=limits, timeout=args.timeout) as client:
+        async def send(i: int, scheduled: float):
+            request = build_request(args.endpoint, images, i, args.batch_size, not args.cache_hits)
+            method = request.pop("method")
+            try:
+                response = await client.request(method, args.endpoint, **request)
+                status = response.status_code
+            except httpx.HTTPError:
+                status = 0
+            stats.record(time.perf_counter() - scheduled, status)
+        
+        async def client_loop():
+            while True:
+                if queue is not None:
+                    i, scheduled = await queue.get()
+                    if i is None:
+                        return
+                else:
+                    if time.perf_counter() >= deadline:
+                        return
+                    i, scheduled = next(counter), time.perf_counter()
+                await send(i, scheduled)
+        
+        async def arrivals():
+            # Poisson arrivals at the target rate
+            next_at = start
+            while next_at < deadline:
+                await asyncio.sleep(max(0.0, next_at - time.perf_counter()))
+                await queue.put((next(counter), next_at))
+                next_at += random.expovariate(args.rate)
+            for _ in range(args.clients):
+                await queue.put((None, None))
+        
+        async def reporter():
+            last = start
+            while True:
+                await asyncio.sleep(args.interval)
+                now = time.perf_counter()
+                print(f"[{now - start:6.1f}s] {json.dumps(stats.flush(now - last))}")
+                last = now
+        
+        report_task = asyncio.create_task(reporter())
+        tasks = [client_loop() for _ in range(args.clients)]
+        if queue is not None:
+            tasks.append(arrivals())
+        await asyncio.gather(*tasks)
+        report_task.cancel()
+    
+    elapsed = time.perf_counter() - start
+    summary = stats.summarize(stats.total, elapsed)
+    print("=" * 50)
+    print(f"{args.endpoint}: {args.clients} clients, target rate {args.rate or 'unbounded'}/s, {elapsed:.1f}s")
+    print(json.dumps(summary, indent=2))
+    return summary
+
+
+class MockScraperHandler(BaseHTTPRequestHandler):
+    """ScrapingDog stand-in returning made-up products for any query"""
+    
+    latency_ms = 200
+    
+    def do_GET(self):
+        from urllib.parse import urlparse, parse_qs
+        query = parse_qs(urlparse(self.path).query).get("query", ["item"])[0]
+        time.sleep(self.latency_ms / 1000)
+        body = json.dumps({
+            "shopping_results": [
+                {
+                    "title": f"{query} #{i}",
+                    "price": f"£{random.randint(10, 150)}.99",
+                    "link": f"https://shop.example/{i}",
+                    "source": "Mock Store"
+                }
+                for i in range(20)
+            ]
+        }).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def log_message(self, format, *args):
+        pass
+
+
+def run_mock_scraper(port: int, latency_ms: float):
+    """Serve the mock shopping API until interrupted"""
+    MockScraperHandler.latency_ms = latency_ms
+    server = ThreadingHTTPServer(("127.0.0.1", port), MockScraperHandler)
+    print(f"Mock scraper listening on http://127.0.0.1:{port}/search ({latency_ms:.0f}ms per call)")
+    print(f"Start the API with: SCRAPING_ENDPOINT=http://127.0.0.1:{port}/search python main.py")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+def parse_load_args(argv):
+    parser = argparse.ArgumentParser(prog="test_client.py load", description="Load-test the Fashion API")
+    parser.add_argument("images", nargs="*", help="Images to send (synthetic JPEGs if omitted)")
+    parser.add_argument("--url", default=API_URL, help="API base URL")
+    parser.add_argument("--endpoint", choices=LOAD_ENDPOINTS, default="/analyze")
+    parser.add_argument("--clients", type=int, default=8, help="Concurrent clients (and pooled connections)")
+    parser.add_argument("--rate", type=float, default=0, help="Target requests per second (0 = as fast as the clients go)")
+    parser.add_argument("--duration", type=float, default=30, help="Seconds to generate load for")
+    parser.add_argument("--interval", type=float, default=5, help="Seconds between progress reports")
+    parser.add_argument("--batch-size", type=int, default=16, help="Images per /analyze/batch request")
+    parser.add_argument("--timeout", type=float, default=60, help="Per-request timeout")
+    parser.add_argument("--cache-hits", action="store_true", help="Reuse identical images and queries instead of unique ones")
+    return parser.parse_args(argv)
+
+
 if __name__ == "__main__":
     import sys
     
+    if len(sys.argv) > 1 and sys.argv[1] == "load":
+        asyncio.run(run_load(parse_load_args(sys.argv[2:])))
+        sys.exit(0)
+    
+    if len(sys.argv) > 1 and sys.argv[1] == "mock-scraper":
+        parser = argparse.ArgumentParser(prog="test_client.py mock-scraper")
+        parser.add_argument("--port", type=int, default=8100)
+        parser.add_argument("--latency-ms", type=float, default=200, help="Simulated upstream latency")
+        options = parser.parse_args(sys.argv[2:])
+        run_mock_scraper(options.port, options.latency_ms)
+        sys.exit(0)
+    
     print("="*50)
     print("Fashion API Test Client")
     print("="*50)
@@ -119,4 +366,6 @@ if __name__ == "__main__":
         analyze_image(image_path)
     else:
         print("\nUsage: python test_client.py <image_path>")
+        print("       python test_client.py load [--endpoint /analyze] [--clients N] [--rate R] [image_path ...]")
+        print("       python test_client.py mock-scraper [--port 8100]")
         print("Example: python test_client.py photo.jpg")
@@ -0,0 +1,9 @@
+import os
+import sys
+
+# Backend modules are imported flat, as the server does
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# The benchmark's environment (no local caches, stub shopping API) must be
+# in place before config is first imported
+import benchmark  # noqa: E402,F401
@@ -0,0 +1,93 @@
+"""Admission control under saturation, with stub models"""
+
+import asyncio
+import io
+import types
+import httpx
+import pytest
+from PIL import Image
+
+import benchmark
+from admission import AdmissionController
+from inference import InferenceExecutor
+
+STUB_TIMINGS = types.SimpleNamespace(
+    model_call_ms=50, model_image_ms=1, caption_call_ms=1, caption_image_ms=1, shopping_ms=1
+)
+
+
+def jpeg(color) -> bytes:
+    buffer = io.BytesIO()
+    Image.new("RGB", (64, 64), color).save(buffer, "JPEG")
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def app(monkeypatch):
+    import main
+    benchmark.install_stubs(main, STUB_TIMINGS)
+    monkeypatch.setattr(main, "analyze_admission", AdmissionController("fashion_model", 1, 64))
+    # Shutdown closes the executors, so every app run gets its own
+    for name in ("inference_executor", "caption_executor", "store_executor"):
+        monkeypatch.setattr(main, name, InferenceExecutor(2, name=name))
+    for cache in (main.analysis_cache, main.prepared_cache):
+        cache.clear()
+    return main
+
+
+async def serve(main, scenario):
+    async with main.app.router.lifespan_context(main.app):
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test", timeout=30) as client:
+            while not (await client.get("/health")).json()["ready"]:
+                await asyncio.sleep(0.05)
+            return await scenario(client)
+
+
+def test_analyze_and_similar_products_share_one_slot(app):
+    """
+    With one slot, /analyze queued ahead of /similar_products on the same
+    image must not wait on an embedding that is itself queued behind it
+    """
+    async def scenario(client):
+        async def post(path, image, delay):
+            await asyncio.sleep(delay)
+            return await client.post(path, files={"file": ("a.jpg", image, "image/jpeg")})
+
+        busy, same = jpeg((200, 10, 10)), jpeg((10, 200, 10))
+        responses = await asyncio.wait_for(asyncio.gather(
+            post("/analyze", busy, 0),
+            post("/analyze", same, 0.01),
+            post("/similar_products", same, 0.02),
+            post("/analyze", same, 0.03),
+            post("/similar_products", same, 0.04)
+        ), timeout=10)
+        return [response.status_code for response in responses]
+
+    assert asyncio.run(serve(app, scenario)) == [200] * 5
+
+
+def test_visual_sort_reuses_the_analysis_embedding(app, monkeypatch):
+    """sort=visual ranks with the embedding the analysis computed, not a second encode"""
+    encoded = []
+    get_image_embedding = app.get_image_embedding
+
+    async def counting(image_hash, load_contents):
+        encoded.append(image_hash)
+        return await get_image_embedding(image_hash, load_contents)
+
+    monkeypatch.setattr(app, "get_image_embedding", counting)
+
+    async def scenario(client):
+        response = await client.post(
+            "/analyze_and_shop",
+            params={"sort": "visual"},
+            files={"file": ("a.jpg", jpeg((10, 10, 200)), "image/jpeg")}
+        )
+        return response.status_code, response.json()
+
+    status, body = asyncio.run(serve(app, scenario))
+    assert status == 200, body
+    products = body["shopping_results"]
+    assert all("visual_similarity" in product for product in products)
+    assert len(encoded) == 1
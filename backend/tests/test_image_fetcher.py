@@ -0,0 +1,90 @@
+"""Server-side image download: public-address enforcement"""
+
+import asyncio
+import httpcore
+import pytest
+
+import image_fetcher
+from image_fetcher import ImageFetcher, ImageFetchError
+
+PUBLIC = "93.184.216.34"
+IMAGE_RESPONSE = [b"HTTP/1.1 200 OK\r\nContent-Type: image/png\r\nContent-Length: 3\r\n\r\nabc"]
+
+
+class RecordingBackend(httpcore.AsyncMockBackend):
+    """Mock backend that records which address each connection was opened to"""
+
+    def __init__(self, responses):
+        super().__init__([])
+        self.responses = list(responses)
+        self.connected = []
+
+    async def connect_tcp(self, host, port, timeout=None, local_address=None, socket_options=None):
+        self.connected.append(host)
+        return httpcore.AsyncMockStream([self.responses.pop(0)])
+
+
+def rebinding_resolver(answers):
+    """Resolver returning the next answer on each call, like a rebinding DNS server"""
+    answers = list(answers)
+    calls = []
+
+    async def resolve(host):
+        calls.append(host)
+        return [answers.pop(0)]
+
+    return resolve, calls
+
+
+def fetch(fetcher, url):
+    async def run():
+        try:
+            return await fetcher.download(url)
+        finally:
+            await fetcher.close()
+    return asyncio.run(run())
+
+
+def test_connects_to_the_checked_address(monkeypatch):
+    resolve, calls = rebinding_resolver([PUBLIC, "127.0.0.1"])
+    monkeypatch.setattr(image_fetcher, "resolve_host", resolve)
+    backend = RecordingBackend(IMAGE_RESPONSE)
+
+    _, contents = fetch(ImageFetcher(network_backend=backend), "http://rebind.example/a.png")
+
+    assert contents == b"abc"
+    assert calls == ["rebind.example"]
+    assert backend.connected == [PUBLIC]
+
+
+def test_rejects_private_address(monkeypatch):
+    resolve, _ = rebinding_resolver(["169.254.169.254"])
+    monkeypatch.setattr(image_fetcher, "resolve_host", resolve)
+    backend = RecordingBackend(IMAGE_RESPONSE)
+
+    with pytest.raises(ImageFetchError) as error:
+        fetch(ImageFetcher(network_backend=backend), "http://metadata.example/")
+
+    assert error.value.status_code == 400
+    assert backend.connected == []
+
+
+def test_checks_every_redirect_hop(monkeypatch):
+    resolve, calls = rebinding_resolver([PUBLIC, "10.0.0.5"])
+    monkeypatch.setattr(image_fetcher, "resolve_host", resolve)
+    backend = RecordingBackend([
+        b"HTTP/1.1 302 Found\r\nLocation: http://internal.example/\r\nContent-Length: 0\r\n\r\n"
+    ])
+
+    with pytest.raises(ImageFetchError):
+        fetch(ImageFetcher(network_backend=backend), "http://public.example/a.png")
+
+    assert calls == ["public.example", "internal.example"]
+    assert backend.connected == [PUBLIC]
+
+
+def test_rejects_private_literal():
+    backend = RecordingBackend(IMAGE_RESPONSE)
+    with pytest.raises(ImageFetchError):
+        fetch(ImageFetcher(network_backend=backend), "http://127.0.0.1/a.png")
+    assert backend.connected == []
@@ -0,0 +1,53 @@
+"""Shopping client error handling"""
+
+import asyncio
+import httpx
+import pytest
+
+from scraper import ShoppingClient
+
+
+def client_answering(*responses):
+    """ShoppingClient whose upstream answers with the given responses in turn"""
+    responses = list(responses)
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        return responses.pop(0)
+
+    client = ShoppingClient()
+    client._client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    return client, calls
+
+
+def search(client, query):
+    return asyncio.run(client.search(query))
+
+
+@pytest.mark.parametrize("response", [
+    httpx.Response(503, text="<html>Service Unavailable</html>"),
+    httpx.Response(200, text="<html>maintenance</html>"),
+    httpx.Response(429, json={"error": "quota"})
+])
+def test_upstream_failures_raise_and_are_not_cached(response):
+    client, calls = client_answering(response, httpx.Response(200, json={"shopping_results": []}))
+
+    with pytest.raises(httpx.HTTPError):
+        search(client, "red shirt")
+
+    assert search(client, "red shirt") == {"shopping_results": []}
+    assert len(calls) == 2
+
+
+def test_coalesced_waiters_share_the_failure():
+    client, calls = client_answering(httpx.Response(502, text="Bad Gateway"))
+
+    async def run():
+        return await asyncio.gather(
+            *(client.search("blue jeans") for _ in range(3)), return_exceptions=True
+        )
+
+    results = asyncio.run(run())
+    assert all(isinstance(result, httpx.HTTPStatusError) for result in results)
+    assert len(calls) == 1
@@ -0,0 +1,52 @@
+"""Vocabulary file watching"""
+
+import asyncio
+import os
+
+from vocabulary import VocabularyWatcher, save_vocabulary_file
+
+VOCABULARIES = {"items": ["shirt"], "colors": ["red"], "styles": ["casual"]}
+
+
+def test_watcher_retries_a_change_until_it_is_applied(tmp_path):
+    path = str(tmp_path / "vocabularies.json")
+    save_vocabulary_file(path, VOCABULARIES)
+    calls = []
+
+    async def on_change(vocabularies):
+        calls.append(vocabularies)
+        # The first attempt arrives while the model is still loading
+        return len(calls) > 1
+
+    async def run():
+        watcher = VocabularyWatcher(path, on_change, interval=0.01)
+        watcher.start()
+        save_vocabulary_file(path, {**VOCABULARIES, "material": ["denim"]})
+        os.utime(path, ns=(0, 1))
+        await asyncio.sleep(0.2)
+        await watcher.stop()
+
+    asyncio.run(run())
+    assert len(calls) == 2
+    assert calls[-1]["material"] == ["denim"]
+
+
+def test_watcher_retries_after_a_failed_apply(tmp_path):
+    path = str(tmp_path / "vocabularies.json")
+    save_vocabulary_file(path, VOCABULARIES)
+    calls = []
+
+    async def on_change(vocabularies):
+        calls.append(vocabularies)
+        if len(calls) == 1:
+            raise RuntimeError("encoder busy")
+
+    async def run():
+        watcher = VocabularyWatcher(path, on_change, interval=0.01)
+        watcher.start()
+        os.utime(path, ns=(0, 1))
+        await asyncio.sleep(0.2)
+        await watcher.stop()
+
+    asyncio.run(run())
+    assert len(calls) == 2
@@ -4,10 +4,8 @@ Simple GUI version - upload images and get fashion analysis
 """
 
 import cv2
-import torch
-import numpy as np
 from PIL import Image
-from fashion_clip.fashion_clip import FashionCLIP
+from analysis_engine import AnalysisEngine, load_image_file
 import tkinter as tk
 from tkinter import filedialog, messagebox
 from tkinter import ttk
@@ -17,29 +15,8 @@ class FashionAnalyzerGUI:
     def __init__(self):
         """Initialize the Fashion-CLIP analyzer with GUI"""
         print("Loading Fashion-CLIP model...")
-        self.fclip = FashionCLIP('fashion-clip')
-        
-        # Define fashion categories
-        self.categories = [
-            "short sleeve top", "long sleeve top", "t-shirt", "shirt", "blouse",
-            "jacket", "coat", "hoodie", "cardigan", "blazer",
-            "pants", "jeans", "trousers", "shorts", "skirt",
-            "dress", "short sleeve dress", "long sleeve dress", "maxi dress",
-            "bag", "handbag", "backpack", "shoes", "sneakers", "boots",
-            "hat", "cap", "sunglasses", "watch", "belt",
-            "sweater", "vest", "scarf", "tie"
-        ]
-        
-        self.colors = [
-            "red", "blue", "green", "black", "white", 
-            "yellow", "pink", "purple", "brown", "gray",
-            "orange", "navy", "beige"
-        ]
-        
-        self.styles = [
-            "casual", "formal", "sporty", "elegant", 
-            "vintage", "modern", "streetwear"
-        ]
+        # Loads the model and encodes all labels once instead of on every upload
+        self.engine = AnalysisEngine.load()
         
         print("Model loaded!")
         self.setup_gui()
@@ -156,57 +133,28 @@ class FashionAnalyzerGUI:
     
     def analyze_image(self, image_path):
         """Analyze the uploaded image"""
-        # Load image
-        pil_image = Image.open(image_path).convert('RGB')
+        # Load image at model input size
+        pil_image = load_image_file(image_path)
         
-        # Analyze fashion items
-        image_embeds = self.fclip.encode_images([pil_image], batch_size=1)
-        text_embeds = self.fclip.encode_text(self.categories, batch_size=32)
-        
-        # Convert to torch tensors if needed
-        if isinstance(image_embeds, np.ndarray):
-            image_embeds = torch.from_numpy(image_embeds)
-        if isinstance(text_embeds, np.ndarray):
-            text_embeds = torch.from_numpy(text_embeds)
-        
-        # Normalize and compute similarity
-        image_embeds = image_embeds / image_embeds.norm(dim=-1, keepdim=True)
-        text_embeds = text_embeds / text_embeds.norm(dim=-1, keepdim=True)
-        similarities = (image_embeds @ text_embeds.T).squeeze(0)
-        scores, indices = torch.topk(similarities, 10)
+        # Analyze items, colors and styles against the precomputed labels
+        ranked = self.engine.rank(self.engine.encode([pil_image]))[0]
         
         # Update fashion items
         self.items_text.delete(1.0, tk.END)
-        for i, (idx, score) in enumerate(zip(indices, scores), 1):
-            item_text = f"{i}. {self.categories[idx]:<25} {score.item():.1%}\n"
+        for i, (label, score) in enumerate(ranked['items'], 1):
+            item_text = f"{i}. {label:<25} {score:.1%}\n"
             self.items_text.insert(tk.END, item_text)
         
-        # Analyze colors
-        color_embeds = self.fclip.encode_text(self.colors, batch_size=32)
-        if isinstance(color_embeds, np.ndarray):
-            color_embeds = torch.from_numpy(color_embeds)
-        
-        color_embeds = color_embeds / color_embeds.norm(dim=-1, keepdim=True)
-        color_sims = (image_embeds @ color_embeds.T).squeeze(0)
-        color_scores, color_indices = torch.topk(color_sims, 5)
-        
+        # Update colors
         self.colors_text.delete(1.0, tk.END)
-        for i, (idx, score) in enumerate(zip(color_indices, color_scores), 1):
-            color_text = f"{i}. {self.colors[idx]:<15} {score.item():.1%}\n"
+        for i, (label, score) in enumerate(ranked['colors'], 1):
+            color_text = f"{i}. {label:<15} {score:.1%}\n"
             self.colors_text.insert(tk.END, color_text)
         
-        # Analyze styles
-        style_embeds = self.fclip.encode_text(self.styles, batch_size=32)
-        if isinstance(style_embeds, np.ndarray):
-            style_embeds = torch.from_numpy(style_embeds)
-        
-        style_embeds = style_embeds / style_embeds.norm(dim=-1, keepdim=True)
-        style_sims = (image_embeds @ style_embeds.T).squeeze(0)
-        style_scores, style_indices = torch.topk(style_sims, 5)
-        
+        # Update styles
         self.styles_text.delete(1.0, tk.END)
-        for i, (idx, score) in enumerate(zip(style_indices, style_scores), 1):
-            style_text = f"{i}. {self.styles[idx]:<15} {score.item():.1%}\n"
+        for i, (label, score) in enumerate(ranked['styles'], 1):
+            style_text = f"{i}. {label:<15} {score:.1%}\n"
             self.styles_text.insert(tk.END, style_text)
         
         # Also show image in a popup
@@ -0,0 +1,203 @@
+"""
+Label vocabulary configuration
+Loads, validates and atomically saves the vocabulary file, watches it for
+changes, and loads prompt template files
+"""
+
+from typing import Awaitable, Callable, Dict, List, Optional
+import asyncio
+import json
+import logging
+import os
+import re
+import tempfile
+
+logger = logging.getLogger(__name__)
+
+# Vocabularies every analysis response relies on; they can change but not disappear
+CORE_VOCABULARIES = ("items", "colors", "styles")
+
+# Keys of the analysis response that a vocabulary name would collide with
+RESERVED_NAMES = ("attributes", "regions")
+
+VOCABULARY_NAME = re.compile(r"^[a-z][a-z0-9_]{0,31}$")
+# The text encoder truncates at 77 tokens anyway; this only stops junk input
+MAX_LABEL_LENGTH = 200
+
+
+class VocabularyError(ValueError):
+    """Raised for vocabulary files or edits that would leave an invalid label set"""
+
+
+def validate_vocabularies(vocabularies) -> Dict[str, List[str]]:
+    """
+    Check a vocabulary mapping and return a cleaned copy
+
+    Labels are stripped and de-duplicated, keeping their first position.
+
+    Raises:
+        VocabularyError: The mapping is malformed or a core vocabulary is missing or empty
+    """
+    if not isinstance(vocabularies, dict):
+        raise VocabularyError("Vocabularies must be an object mapping names to label lists")
+
+    cleaned = {}
+    for name, labels in vocabularies.items():
+        if not isinstance(name, str) or not VOCABULARY_NAME.match(name):
+            raise VocabularyError(f"Invalid vocabulary name: {name!r} (lowercase letters, digits and _)")
+        if name in RESERVED_NAMES:
+            raise VocabularyError(f"Reserved vocabulary name: {name}")
+        if not isinstance(labels, list) or not all(isinstance(label, str) for label in labels):
+            raise VocabularyError(f"Vocabulary {name} must be a list of strings")
+        labels = list(dict.fromkeys(label.strip() for label in labels if label.strip()))
+        too_long = [label for label in labels if len(label) > MAX_LABEL_LENGTH]
+        if too_long:
+            raise VocabularyError(f"Labels longer than {MAX_LABEL_LENGTH} characters in {name}: {too_long[:3]}")
+        if not labels:
+            raise VocabularyError(f"Vocabulary {name} has no labels")
+        cleaned[name] = labels
+
+    missing = [name for name in CORE_VOCABULARIES if name not in cleaned]
+    if missing:
+        raise VocabularyError(f"Core vocabularies cannot be removed: {', '.join(missing)}")
+    return cleaned
+
+
+def load_vocabulary_file(path: str) -> Dict[str, List[str]]:
+    """
+    Read and validate a vocabulary JSON file
+
+    Raises:
+        VocabularyError: The file is not valid JSON or not a valid label set
+    """
+    try:
+        with open(path) as f:
+            return validate_vocabularies(json.load(f))
+    except json.JSONDecodeError as e:
+        raise VocabularyError(f"{path} is not valid JSON: {e}")
+
+
+def validate_templates(templates) -> Dict[str, List[str]]:
+    """
+    Check a prompt template mapping and return a cleaned copy
+
+    Raises:
+        VocabularyError: A name is invalid or a template lacks exactly one "{}"
+    """
+    if not isinstance(templates, dict):
+        raise VocabularyError("Templates must be an object mapping vocabulary names to template lists")
+
+    cleaned = {}
+    for name, entries in templates.items():
+        if not isinstance(name, str) or not (name == "*" or VOCABULARY_NAME.match(name)):
+            raise VocabularyError(f"Invalid vocabulary name: {name!r}")
+        if not isinstance(entries, list) or not entries or not all(isinstance(t, str) for t in entries):
+            raise VocabularyError(f"Templates for {name} must be a non-empty list of strings")
+        bad = [t for t in entries if t.count("{}") != 1 or t.replace("{}", "").count("{") or t.replace("{}", "").count("}")]
+        if bad:
+            raise VocabularyError(f"Templates must contain exactly one {{}} placeholder: {bad[:3]}")
+        cleaned[name] = list(dict.fromkeys(entries))
+    return cleaned
+
+
+def load_template_file(path: str) -> Dict[str, List[str]]:
+    """
+    Read and validate a prompt template JSON file
+
+    Raises:
+        VocabularyError: The file is not valid JSON or not a valid template mapping
+    """
+    try:
+        with open(path) as f:
+            return validate_templates(json.load(f))
+    except json.JSONDecodeError as e:
+        raise VocabularyError(f"{path} is not valid JSON: {e}")
+
+
+def save_vocabulary_file(path: str, vocabularies: Dict[str, List[str]]):
+    """Write the vocabulary file atomically, so watchers never read half a file"""
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".vocabularies.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(vocabularies, f, indent=2)
+            f.write("\n")
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+
+class VocabularyWatcher:
+    """
+    Polls the vocabulary file and reports changed contents
+
+    Polling the modification time keeps this dependency-free and works the
+    same on every platform and in containers with bind-mounted config.
+    Invalid files are logged and ignored, so a bad edit never takes the
+    current labels down. A change only counts as seen once `on_change`
+    has applied it; if it raises or returns False, the same file is
+    offered again on the next poll.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        on_change: Callable[[Dict[str, List[str]]], Awaitable[Optional[bool]]],
+        interval: float = 2.0
+    ):
+        """
+        Args:
+            path: Vocabulary file to watch
+            on_change: Coroutine function called with the new vocabularies;
+                returns False if it could not apply them yet
+            interval: Seconds between checks
+        """
+        self.path = path
+        self.on_change = on_change
+        self.interval = interval
+        self._mtime = self._stat()
+        self._task: Optional[asyncio.Task] = None
+
+    def _stat(self) -> Optional[int]:
+        try:
+            return os.stat(self.path).st_mtime_ns
+        except OSError:
+            return None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            mtime = self._stat()
+            if mtime is None or mtime == self._mtime:
+                continue
+            try:
+                vocabularies = load_vocabulary_file(self.path)
+            except (OSError, VocabularyError) as e:
+                # Nothing to retry until the file is edited again
+                self._mtime = mtime
+                logger.error(f"Ignoring invalid vocabulary file: {e}")
+                continue
+            try:
+                applied = await self.on_change(vocabularies)
+            except Exception as e:
+                logger.error(f"Applying vocabulary file failed, will retry: {e}")
+                continue
+            if applied is not False:
+                self._mtime = mtime
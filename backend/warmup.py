@@ -0,0 +1,61 @@
+"""
+Warmup passes run after a model loads and before it reports ready
+Pushes synthetic inputs through every batch shape the server will use, so
+kernel initialisation and allocator growth happen before real traffic
+"""
+
+from typing import List
+import logging
+import time
+import numpy as np
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+
+def warmup_batch_sizes(max_batch_size: int) -> List[int]:
+    """Powers of two up to the scheduler's max batch size, plus the max itself"""
+    sizes = []
+    size = 1
+    while size < max_batch_size:
+        sizes.append(size)
+        size *= 2
+    sizes.append(max(1, max_batch_size))
+    return sizes
+
+
+def synthetic_images(count: int, size: int = 224, seed: int = 0) -> List[Image.Image]:
+    """Deterministic noise images"""
+    rng = np.random.default_rng(seed)
+    return [
+        Image.fromarray(rng.integers(0, 256, (size, size, 3), dtype=np.uint8), "RGB")
+        for _ in range(count)
+    ]
+
+
+def warmup_fashion(fashion_model, batch_sizes: List[int]):
+    """
+    Run Fashion-CLIP image encoding once at each batch size
+
+    Args:
+        fashion_model: Loaded Fashion-CLIP engine
+        batch_sizes: Batch sizes the micro-batcher can produce
+    """
+    start = time.perf_counter()
+    images = synthetic_images(max(batch_sizes))
+    for batch_size in batch_sizes:
+        fashion_model.encode_images(images[:batch_size], batch_size=batch_size)
+    logger.info(f"Fashion-CLIP warmup for batch sizes {batch_sizes} took {time.perf_counter() - start:.2f}s")
+
+
+def warmup_caption(caption_engine, preset: str = "short"):
+    """
+    Run one short Florence-2 generate pass
+
+    Args:
+        caption_engine: Loaded CaptionEngine
+        preset: Decoding preset; a tight token cap keeps the warmup short
+    """
+    start = time.perf_counter()
+    caption_engine.caption_batch([(synthetic_images(1, size=768)[0], preset)])
+    logger.info(f"Florence-2 warmup took {time.perf_counter() - start:.2f}s")
@@ -342,59 +342,61 @@
     });
   }
 
-  async function getShoppingResults(analysisData) {
-    try {
-      // Filter out watches and ties, pick the next available item
-      const excludedItems = ['watch', 'tie'];
-      let selectedItem = analysisData.items[0];
-      
-      for (let item of analysisData.items) {
-        const itemName = item.name.toLowerCase();
-        if (!excludedItems.some(excluded => itemName.includes(excluded))) {
-          selectedItem = item;
-          break;
-        }
-      }
-      
-      let queryString = "Buy " + analysisData.colors[0].color + " " + selectedItem.name;
-      const encodedQuery = encodeURIComponent(queryString);
-      const response = await fetch(`http://localhost:8000/get_shopping?query=${encodedQuery}`);
+  // Statuses meaning the backend could not fetch the URL itself, so
+  // uploading the image from the page may still work
+  const URL_FETCH_FAILED = [400, 413, 502];
+  const MAX_RETRY_AFTER_S = 10;
 
-      if (!response.ok) {
-        throw new Error('Shopping request failed: ' + response.statusText);
+  async function postImage(formData) {
+    const response = await fetch('http://localhost:8000/analyze_and_shop', {
+      method: 'POST',
+      body: formData
+    });
+    // When the backend is overloaded, wait as long as it asks and try once more
+    if (response.status === 429) {
+      const retryAfter = parseInt(response.headers.get('Retry-After'), 10);
+      if (retryAfter > 0 && retryAfter <= MAX_RETRY_AFTER_S) {
+        await new Promise(resolve => setTimeout(resolve, retryAfter * 1000));
+        return fetch('http://localhost:8000/analyze_and_shop', {
+          method: 'POST',
+          body: formData
+        });
       }
-
-      const data = await response.json();
-      console.log('SherlockCombs shopping results:', data);
-      
-      // Return up to 10 results
-      return data.shopping_results ? data.shopping_results.slice(0, 10) : [];
-    } catch (error) {
-      console.error('SherlockCombs shopping error:', error);
-      return [];
     }
+    return response;
   }
 
-  async function sendToBackend(url) {
+  async function analyzeAndShop(url) {
     try {
-      const response = await fetch(url);
-      if (!response.ok) throw new Error('Failed to fetch image: ' + response.statusText);
-      const blob = await response.blob();
-
-      const formData = new FormData();
-      formData.append('file', blob, 'image.jpg');
+      // Let the backend fetch public images itself; upload only if it cannot
+      let backendResponse = null;
+      if (/^https?:/.test(url)) {
+        const formData = new FormData();
+        formData.append('url', url);
+        backendResponse = await postImage(formData);
+      }
+      // Overload (429) and timeouts (504) are not fixed by uploading the
+      // same image again, so only URL fetch failures fall back
+      if (!backendResponse || URL_FETCH_FAILED.includes(backendResponse.status)) {
+        const response = await fetch(url);
+        if (!response.ok) throw new Error('Failed to fetch image: ' + response.statusText);
+        const blob = await response.blob();
 
-      const backendResponse = await fetch('http://localhost:8000/analyze', {
-        method: 'POST',
-        body: formData
-      });
+        const formData = new FormData();
+        formData.append('file', blob, 'image.jpg');
+        backendResponse = await postImage(formData);
+      }
 
       if (!backendResponse.ok) {
-        throw new Error('Backend request failed: ' + backendResponse.statusText);
+        const retryAfter = backendResponse.headers.get('Retry-After');
+        throw new Error(
+          'Backend request failed: ' + backendResponse.status + ' ' + backendResponse.statusText +
+          (retryAfter ? ' (retry after ' + retryAfter + 's)' : '')
+        );
       }
 
       const result = await backendResponse.json();
-      console.log('SherlockCombs backend analysis:', result);
+      console.log('SherlockCombs analysis and shopping results:', result);
       return result;
     } catch (error) {
       console.error('SherlockCombs backend error:', error);
@@ -423,15 +425,11 @@
         // Show loading panel with analyzing stage
         createOverlay(url, match, null, 'analyzing');
         
-        // Send image to backend and get analysis
-        const analysis = await sendToBackend(url);
+        // Analyze the image and get shopping results (sorted by price) in one call
+        const analysis = await analyzeAndShop(url);
         
         if (analysis) {
-          // Update to shopping stage
-          createOverlay(url, match, null, 'shopping');
-          
-          // Get shopping results based on analysis
-          const shoppingResults = await getShoppingResults(analysis);
+          const shoppingResults = analysis.shopping_results || [];
           
           // Update panel with shopping results and cache them
           if (shoppingResults.length > 0) {
@@ -443,13 +441,8 @@
               : null;
             styleCache.set(url, styleDescription);
             
-            // Sort by price to get lowest
-            const sortedResults = [...shoppingResults].sort((a, b) => {
-              const priceA = parseFloat(a.extracted_price || a.price.replace(/[^0-9.]/g, '') || '999999');
-              const priceB = parseFloat(b.extracted_price || b.price.replace(/[^0-9.]/g, '') || '999999');
-              return priceA - priceB;
-            });
-            const lowestPrice = cleanPrice(sortedResults[0].price);
+            // Results arrive sorted by price, lowest first
+            const lowestPrice = cleanPrice(shoppingResults[0].price);
             
             // Create price badge on the image
             if (match) {